@@ -1,8 +1,11 @@
-from flask import Flask, session
+from flask import Flask, session, jsonify
 from routes import main
 from routes.passwords import passwords
 from routes.totp import totp
 from translations import translations
+from services.totp_cache import code_cache
+from services.kdf_pool import KdfPoolBusy
+from services.password_hashing import ensure_calibrated
 import os
 
 def create_app():
@@ -14,6 +17,21 @@ def create_app():
     app.register_blueprint(passwords)
     app.register_blueprint(totp)
     
+    # 可选：在TOTP窗口切换前预先计算下一个窗口的代码
+    if os.environ.get('TOTP_CACHE_WARMER', '').lower() in ('1', 'true', 'yes', 'on'):
+        code_cache.start_warmer(lead=float(os.environ.get('TOTP_CACHE_WARMER_LEAD', 3)))
+    
+    # 首次启动时在本机校准密码哈希参数，而不是在第一个登录请求中校准
+    ensure_calibrated()
+    
+    # 密码哈希线程池已满时立即返回，客户端稍后重试
+    @app.errorhandler(KdfPoolBusy)
+    def kdf_pool_busy(error):
+        return jsonify({
+            'error': 'Server busy',
+            'message': 'Too many password verifications in progress. Please try again later.'
+        }), 503, {'Retry-After': '1'}
+    
     # 添加翻译函数到模板全局变量
     @app.context_processor
     def utility_processor():
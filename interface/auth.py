@@ -1,41 +1,33 @@
-import yaml
 import pyotp
-import binascii
+from utils.config import get_storage, load_config, save_config  # noqa: F401  配置读写经由存储后端
+from utils.journal import SET
+from services.totp_engine import engine
+from services.totp_cache import code_cache
 
-# 读取配置文件
-def load_config():
-    with open('config.yaml', 'r') as f:
-        return yaml.safe_load(f)
-
-# 保存配置文件
-def save_config(config):
-    with open('config.yaml', 'w') as f:
-        yaml.dump(config, f)
+_TOKEN_LIST_PATH = ('2fa_token_list',)
 
 # 添加2FA令牌
 def add_token(name, secret):
     try:
         # 验证密钥是否是有效的 base32 编码
-        pyotp.TOTP(secret).now()
-        config = load_config()
-        config['2fa_token_list'].append({'name': name, 'secret': secret})
-        save_config(config)
-        return True
-    except (binascii.Error, TypeError):
+        engine.prepare(secret)
+    except ValueError:
         return False
+    token = {'name': name, 'secret': secret}
+    get_storage().update(lambda read: [(SET, _TOKEN_LIST_PATH, (read(_TOKEN_LIST_PATH) or []) + [token])])
+    return True
 
 # 删除2FA令牌
 def remove_token(name):
-    config = load_config()
-    config['2fa_token_list'] = [token for token in config['2fa_token_list'] if token['name'] != name]
-    save_config(config)
+    get_storage().update(lambda read: [(SET, _TOKEN_LIST_PATH, [
+        token for token in read(_TOKEN_LIST_PATH) or [] if token['name'] != name
+    ])])
 
 # 生成当前2FA验证码
 def generate_totp(secret):
     try:
-        totp = pyotp.TOTP(secret)
-        return totp.now()
-    except (binascii.Error, TypeError):
+        return code_cache.code(engine.prepare(secret))[0]
+    except ValueError:
         return "Invalid Secret"  # 返回错误信息而不是抛出异常
 
 # 生成一个新的随机 TOTP 密钥
@@ -5,6 +5,41 @@ from cryptography.fernet import Fernet
 import json
 import base64
 
+# 密文格式：Fernet 令牌本身（已是 urlsafe base64，以版本字节 0x80 开头，所以总是以 gAAAAA 开头）。
+# 旧版本在令牌外又包了一层 base64（以 Z0FBQUFB 开头），大 33% 且每次读取要解码两次；
+# 读取时两种格式都接受。
+COMPACT_PREFIX = 'gAAAAA'
+
+
+def is_legacy_ciphertext(value: Optional[str]) -> bool:
+    """是否是旧格式（两层 base64）的密文"""
+    return bool(value) and not value.startswith(COMPACT_PREFIX)
+
+
+def compact_ciphertext(value: Optional[str]) -> Optional[str]:
+    """把旧格式的密文转换为紧凑格式（只去掉外层编码，不需要密钥）"""
+    if not is_legacy_ciphertext(value):
+        return value
+    # urlsafe_b64decode 同时接受标准字母表（旧的 decrypt_text 使用的变体）
+    return base64.urlsafe_b64decode(value).decode('ascii')
+
+
+def fernet_token(value: str) -> bytes:
+    """任一格式的密文对应的 Fernet 令牌"""
+    if value.startswith(COMPACT_PREFIX):
+        return value.encode('ascii')
+    return base64.urlsafe_b64decode(value)
+
+def parse_datetime(value):
+    """解析保存的日期时间（datetime 对象或不同格式的字符串）"""
+    if isinstance(value, str):
+        try:
+            return datetime.fromisoformat(value)
+        except ValueError:
+            # 尝试解析其他格式
+            return datetime.strptime(value, '%Y-%m-%d %H:%M:%S.%f')
+    return value
+
 @dataclass
 class PasswordEntry:
     id: str  # UUID
@@ -31,15 +66,15 @@ class PasswordEntry:
         if not data:
             return None
         f = Fernet(key)
-        return base64.urlsafe_b64encode(f.encrypt(data.encode())).decode()
+        return f.encrypt(data.encode()).decode()
     
     @staticmethod
     def decrypt_data(key: bytes, encrypted_data: str) -> str:
-        """使用给定的密钥解密数据"""
+        """使用给定的密钥解密数据（接受紧凑格式和旧格式）"""
         if not encrypted_data:
             return None
         f = Fernet(key)
-        return f.decrypt(base64.urlsafe_b64decode(encrypted_data)).decode()
+        return f.decrypt(fernet_token(encrypted_data)).decode()
     
     def to_dict(self) -> dict:
         """将条目转换为字典格式"""
@@ -63,22 +98,8 @@ class PasswordEntry:
         """从字典创建条目"""
         try:
             # 尝试解析不同格式的日期时间
-            created_at = data['created_at']
-            updated_at = data['updated_at']
-            
-            if isinstance(created_at, str):
-                try:
-                    created_at = datetime.fromisoformat(created_at)
-                except ValueError:
-                    # 尝试解析其他格式
-                    created_at = datetime.strptime(created_at, '%Y-%m-%d %H:%M:%S.%f')
-            
-            if isinstance(updated_at, str):
-                try:
-                    updated_at = datetime.fromisoformat(updated_at)
-                except ValueError:
-                    # 尝试解析其他格式
-                    updated_at = datetime.strptime(updated_at, '%Y-%m-%d %H:%M:%S.%f')
+            created_at = parse_datetime(data['created_at'])
+            updated_at = parse_datetime(data['updated_at'])
             
             return cls(
                 id=data['id'],
@@ -96,3 +117,53 @@ class PasswordEntry:
             )
         except Exception as e:
             raise ValueError(f"无法解析密码条目数据: {str(e)}, data: {data}")
+
+
+@dataclass
+class PasswordSummary:
+    """密码条目的元数据（不包含也不解密任何加密字段）"""
+    id: str
+    title: str
+    username: Optional[str]
+    url: Optional[str]
+    category: str
+    created_at: datetime
+    updated_at: datetime
+    has_notes: bool = False
+    has_totp: bool = False
+    totp_digits: int = 6
+    totp_interval: int = 30
+    
+    def to_dict(self) -> dict:
+        """将元数据转换为字典格式"""
+        return {
+            'id': self.id,
+            'title': self.title,
+            'username': self.username,
+            'url': self.url,
+            'category': self.category,
+            'created_at': self.created_at.strftime('%Y-%m-%dT%H:%M:%S.%f'),
+            'updated_at': self.updated_at.strftime('%Y-%m-%dT%H:%M:%S.%f'),
+            'has_notes': self.has_notes,
+            'has_totp': self.has_totp
+        }
+    
+    @classmethod
+    def from_dict(cls, data: dict) -> 'PasswordSummary':
+        """从保存的条目数据创建元数据"""
+        try:
+            return cls(
+                id=data['id'],
+                title=data['title'],
+                username=data.get('username'),
+                url=data.get('url'),
+                category=data['category'],
+                created_at=parse_datetime(data['created_at']),
+                updated_at=parse_datetime(data['updated_at']),
+                has_notes=bool(data.get('notes')),
+                has_totp=bool(data.get('totp_secret')),
+                totp_digits=data.get('totp_digits', 6),
+                totp_interval=data.get('totp_interval', 30)
+            )
+        except Exception as e:
+            raise ValueError(f"无法解析密码条目数据: {str(e)}")
@@ -2,10 +2,10 @@ from flask import Blueprint
 
 main = Blueprint('main', __name__)
 
-from .home import login, logout, dashboard, change_language
+from .home import login, logout, dashboard, change_language, kdf_stats
 from .backup import (backup_manager, create_backup, download_backup, delete_backup, 
                     restore_backup, upload_backup)
-from .settings import settings, update_password, update_username, toggle_2fa
+from .settings import settings, settings_qr, update_password, update_username, toggle_2fa
 
 # 登录相关路由
 main.add_url_rule('/', view_func=login, methods=['GET', 'POST'])
@@ -13,6 +13,7 @@ main.add_url_rule('/login', view_func=login, methods=['GET', 'POST'])
 main.add_url_rule('/logout', view_func=logout)
 main.add_url_rule('/dashboard', view_func=dashboard)
 main.add_url_rule('/change_language', view_func=change_language)
+main.add_url_rule('/api/kdf_stats', view_func=kdf_stats)
 
 # 备份管理路由
 main.add_url_rule('/backup', view_func=backup_manager)
@@ -26,4 +27,5 @@ main.add_url_rule('/backup/restore/<filename>', view_func=restore_backup)
 main.add_url_rule('/settings', view_func=settings)
 main.add_url_rule('/settings/username', view_func=update_username, methods=['POST'])
 main.add_url_rule('/settings/password', view_func=update_password, methods=['POST'])
-main.add_url_rule('/settings/2fa', view_func=toggle_2fa, methods=['POST'])
\ No newline at end of file
+main.add_url_rule('/settings/2fa', view_func=toggle_2fa, methods=['POST'])
+main.add_url_rule('/settings/2fa/qr.png', view_func=settings_qr)
\ No newline at end of file
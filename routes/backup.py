@@ -1,9 +1,10 @@
 from flask import render_template, request, redirect, url_for, flash, send_file, session
 from utils.auth import login_required
+from utils.config import load_config, save_config
+from utils import codec
 import os
 import shutil
 from datetime import datetime
-import yaml
 import zipfile
 import io
 from translations import translations
@@ -65,9 +66,8 @@ def create_backup():
 
     memory_file = io.BytesIO()
     with zipfile.ZipFile(memory_file, 'w', zipfile.ZIP_DEFLATED) as zf:
-        # 备份配置文件
-        if os.path.exists('config.yaml'):
-            zf.write('config.yaml')
+        # 备份配置文件（从当前存储后端导出为 YAML，与后端类型无关）
+        zf.writestr('config.yaml', codec.dumps_yaml(load_config()))
 
     memory_file.seek(0)
     with open(backup_path, 'wb') as f:
@@ -140,9 +140,12 @@ def restore_backup(filename):
 
     try:
         with zipfile.ZipFile(backup_path, 'r') as zf:
-            # 恢复配置文件
+            # 恢复配置文件（写入当前存储后端）
             if 'config.yaml' in zf.namelist():
-                zf.extract('config.yaml', '.')
+                config = codec.loads(zf.read('config.yaml')) or {}
+                # 去掉备份时的版本号，整体替换当前配置而不是与之合并
+                config.pop('store_version', None)
+                save_config(config)
         
         flash(t('backup.restore_success'), 'success')
     except Exception as e:
@@ -2,12 +2,12 @@ from flask import render_template, request, redirect, url_for, session, flash, j
 from interface.auth import load_config, add_token, remove_token, generate_totp, save_config
 from . import main
 import time
-import qrcode
 import base64
-import io
 import pyotp
 import re
 import yaml
+from services.totp_engine import engine
+from services.qr_cache import qr_cache, render_qr_png
 
 @main.route('/')
 def index():
@@ -141,16 +141,9 @@ def toggle_2fa():
         secret = pyotp.random_base32()
         totp = pyotp.TOTP(secret)
         
-        # 生成二维码
-        qr = qrcode.QRCode(version=1, box_size=10, border=5)
+        # 生成二维码（新密钥只会显示一次，不放入缓存）
         provisioning_uri = totp.provisioning_uri(config['auth_forntend']['username'], issuer_name="2FA Token Management")
-        qr.add_data(provisioning_uri)
-        qr.make(fit=True)
-        
-        img = qr.make_image(fill_color="black", back_color="white")
-        buffered = io.BytesIO()
-        img.save(buffered, format="PNG")
-        img_str = base64.b64encode(buffered.getvalue()).decode()
+        img_str = base64.b64encode(render_qr_png(provisioning_uri)).decode()
         
         return jsonify({
             'enabled': True,
@@ -172,8 +165,7 @@ def verify_2fa():
     code = data['code']
     
     # 验证代码
-    totp = pyotp.TOTP(secret)
-    if totp.verify(code):
+    if engine.verify(secret, code):
         # 验证成功，保存配置
         config = load_config()
         config['auth_forntend']['2fa_secret'] = secret
@@ -204,8 +196,7 @@ def add_token_route():
     # 检查密钥格式是否正确
     try:
         # 尝试生成一个验证码来验证密钥是否有效
-        totp = pyotp.TOTP(token_secret)
-        totp.now()
+        engine.prepare(token_secret)
         add_token(token_name, token_secret)
         flash('token_added', 'success')
     except Exception as e:
@@ -242,20 +233,12 @@ def get_token_details(token_name):
     
     # 生成二维码
     totp = pyotp.TOTP(token['secret'])
-    qr = qrcode.QRCode(version=1, box_size=10, border=5)
     provisioning_uri = totp.provisioning_uri(token['name'], issuer_name="2FA Token Management")
-    qr.add_data(provisioning_uri)
-    qr.make(fit=True)
-    
-    img = qr.make_image(fill_color="black", back_color="white")
-    buffered = io.BytesIO()
-    img.save(buffered, format="PNG")
-    img_str = base64.b64encode(buffered.getvalue()).decode()
     
     return jsonify({
         'name': token['name'],
         'secret': token['secret'],
         'current_code': current_code,
         'seconds_remaining': seconds_remaining,
-        'qr_code': f'data:image/png;base64,{img_str}'
+        'qr_code': qr_cache.data_uri(provisioning_uri)
     })
@@ -1,9 +1,12 @@
-from flask import render_template, request, redirect, url_for, session, flash
+from flask import render_template, request, redirect, url_for, session, flash, jsonify
 from utils.auth import login_required
-from utils.config import load_config
-from werkzeug.security import check_password_hash
+from utils.config import get_storage, load_config_view
 from translations import translations
-import pyotp
+from services.totp_engine import engine
+from services.kdf_pool import kdf_pool, KdfPoolBusy
+from services.password_hashing import hash_password, needs_rehash
+from services.password_manager import migrate_ciphertexts
+from utils.login_limit import check_login_limit, record_login_attempt
 
 def t(key):
     """翻译函数，支持嵌套键"""
@@ -28,19 +31,28 @@ def login():
         
         print(f"Login attempt - Username: {username}, Has Password: {'Yes' if password else 'No'}, TOTP Code: {totp_code}")
         
-        config = load_config()
+        # 检查登录限制（IP 和用户名分别计数），锁定期间不再验证密码
+        allowed, wait_time = check_login_limit(request.remote_addr, username)
+        if not allowed:
+            print(f"Login locked for {wait_time}s - IP: {request.remote_addr}, Username: {username}")
+            flash(t('login.too_many_attempts').format(seconds=wait_time), 'error')
+            return render_template('login.html', show_2fa=False), 429
+        
+        config = load_config_view()
         users = config.get('users', {})
         user = users.get(username)
         
         # 如果用户不存在
         if not user:
             print(f"User not found: {username}")
+            record_login_attempt(request.remote_addr, False, username)
             flash(t('login.invalid_credentials'), 'error')
             return render_template('login.html', show_2fa=False)
         
         # 验证密码
-        if not check_password_hash(user['password_hash'], password):
+        if not kdf_pool.check_password_hash(user['password_hash'], password):
             print(f"Invalid password for user: {username}")
+            record_login_attempt(request.remote_addr, False, username)
             flash(t('login.invalid_credentials'), 'error')
             return render_template('login.html', show_2fa=False)
         
@@ -53,15 +65,25 @@ def login():
                 return render_template('login.html', show_2fa=True, username=username, request=request)
             
             # 验证2FA代码
-            totp = pyotp.TOTP(user['totp_secret'])
-            if not totp.verify(totp_code):
+            if not engine.verify(user['totp_secret'], totp_code):
                 print(f"Invalid TOTP code: {totp_code}")
+                record_login_attempt(request.remote_addr, False, username)
                 flash(t('login.invalid_2fa'), 'error')
                 return render_template('login.html', show_2fa=True, username=username, request=request)
             print("TOTP code verified successfully")
         
         # 所有验证通过，设置会话
         print(f"Login successful for user: {username}")
+        record_login_attempt(request.remote_addr, True, username)
+        # 哈希参数与当前校准结果不同时，用本次输入的密码重新生成哈希
+        if needs_rehash(user['password_hash']):
+            try:
+                get_storage().set(('users', username, 'password_hash'), hash_password(password))
+                print(f"Password hash upgraded for user: {username}")
+            except KdfPoolBusy:
+                pass
+        # 把旧格式的密文一次性改写为紧凑格式（之后的读取都是只读的）
+        migrate_ciphertexts(username)
         session['user_id'] = username
         if not session.get('lang'):
             session['lang'] = 'en'
@@ -71,10 +93,15 @@ def login():
 
 @login_required
 def dashboard():
-    config = load_config()
+    config = load_config_view()
     user = config['users'].get(session.get('user_id'))
     return render_template('dashboard.html', user=user)
 
+@login_required
+def kdf_stats():
+    """密码哈希线程池的统计信息"""
+    return jsonify(kdf_pool.stats())
+
 def logout():
     # 保存当前语言设置
     current_lang = session.get('lang', 'en')
@@ -1,13 +1,14 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, session, jsonify
+from flask import Blueprint, render_template, request, redirect, url_for, flash, session, jsonify, Response
 from utils.auth import login_required
 from services.password_manager import PasswordManager
 from services.totp_manager import TotpManager
+from services.totp_engine import engine
+from services.totp_cache import code_cache
+from services.qr_cache import qr_cache
+from utils.pagination import PAGE_SIZE
 import pyotp
 from translations import translations
 from datetime import datetime
-import qrcode
-import io
-import base64
 
 passwords = Blueprint('passwords', __name__)
 
@@ -31,8 +32,27 @@ def t(key):
 def password_list():
     """显示密码列表页面"""
     manager = PasswordManager(session['user_id'])
-    passwords = manager.get_all_entries()
-    return render_template('passwords/index.html', passwords=passwords)
+    # 只渲染第一页，之后的页面由前端通过 list_password_entries 加载
+    passwords, next_cursor = manager.list_page()
+    return render_template('passwords/index.html', passwords=passwords, next_cursor=next_cursor)
+
+@passwords.route('/passwords/entries')
+@login_required
+def list_password_entries():
+    """按游标分页获取条目元数据"""
+    manager = PasswordManager(session['user_id'])
+    try:
+        entries, next_cursor = manager.list_page(
+            cursor=request.args.get('cursor'),
+            limit=request.args.get('limit', PAGE_SIZE),
+            sort=request.args.get('sort', 'title')
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({
+        'entries': [summary.to_dict() for summary in entries],
+        'next_cursor': next_cursor
+    })
 
 @passwords.route('/passwords/new', methods=['GET', 'POST'])
 @login_required
@@ -62,22 +82,34 @@ def new_password():
 def view_password(entry_id):
     """查看密码条目详情"""
     manager = PasswordManager(session['user_id'])
-    entry = manager.get_entry(entry_id)
+    # 页面只显示元数据，加密字段在查看/复制时通过 reveal_password_field 获取
+    entry = manager.get_summary(entry_id)
     if not entry:
         flash(t('passwords.not_found'), 'error')
         return redirect(url_for('passwords.password_list'))
     return render_template('passwords/view.html', entry=entry)
 
+@passwords.route('/passwords/<entry_id>/reveal/<field>')
+@login_required
+def reveal_password_field(entry_id, field):
+    """解密条目的一个字段"""
+    manager = PasswordManager(session['user_id'])
+    try:
+        value = manager.reveal_field(entry_id, field)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except KeyError:
+        return jsonify({'error': 'Entry not found'}), 404
+    
+    response = jsonify({'value': value})
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
 @passwords.route('/passwords/<entry_id>/edit', methods=['GET', 'POST'])
 @login_required
 def edit_password(entry_id):
     """编辑密码条目"""
     manager = PasswordManager(session['user_id'])
-    entry = manager.get_entry(entry_id)
-    
-    if not entry:
-        flash(t('passwords.not_found'), 'error')
-        return redirect(url_for('passwords.password_list'))
     
     if request.method == 'POST':
         try:
@@ -85,21 +117,28 @@ def edit_password(entry_id):
             enable_totp = request.form.get('enableTotp') == 'on'
             totp_secret = request.form.get('totp_secret') if enable_totp else None
             
+            # 未提交的字段传 None，保持不变
             updated_entry = manager.update_entry(
                 entry_id,
                 title=request.form['title'],
                 username=request.form.get('username'),
-                password=request.form.get('password', entry.password),
+                password=request.form.get('password'),
                 url=request.form.get('url'),
                 notes=request.form.get('notes'),
                 category=request.form.get('category'),
                 totp_secret=totp_secret
             )
-            flash(t('passwords.update_success'), 'success')
-            return redirect(url_for('passwords.view_password', entry_id=entry_id))
+            if updated_entry:
+                flash(t('passwords.update_success'), 'success')
+                return redirect(url_for('passwords.view_password', entry_id=entry_id))
         except Exception as e:
             flash(t('passwords.update_error'), 'error')
     
+    entry = manager.get_entry(entry_id)
+    if not entry:
+        flash(t('passwords.not_found'), 'error')
+        return redirect(url_for('passwords.password_list'))
+    
     return render_template('passwords/edit.html', entry=entry)
 
 @passwords.route('/passwords/<entry_id>/delete', methods=['POST'])
@@ -116,44 +155,77 @@ def delete_password(entry_id):
 @passwords.route('/passwords/search')
 @login_required
 def search_passwords():
-    """搜索密码条目"""
-    query = request.args.get('q', '').lower()
-    manager = PasswordManager(session['user_id'])
-    entries = manager.get_all_entries()
-    
-    if query:
-        entries = [
-            entry for entry in entries
-            if query in entry['title'].lower() or
-               query in entry.get('username', '').lower() or
-               query in entry.get('url', '').lower()
-        ]
+    """搜索密码条目（只返回元数据）"""
+    query = request.args.get('q', '')
+    limit = min(max(request.args.get('limit', 50, type=int), 1), 200)
+    offset = max(request.args.get('offset', 0, type=int), 0)
     
-    return jsonify(entries)
+    manager = PasswordManager(session['user_id'])
+    results, total = manager.search_entries(query, limit, offset)
+    return jsonify({
+        'results': [summary.to_dict() for summary in results],
+        'total': total
+    })
+
+@passwords.route('/passwords/changes')
+@login_required
+def get_password_changes():
+    """获取某个版本之后变化的条目，用于增量同步"""
+    manager = PasswordManager(session['user_id'])
+    return jsonify(manager.changes_since(request.args.get('since', 0, type=int)))
+
+@passwords.route('/passwords/match')
+@login_required
+def match_passwords():
+    """查找与网址主机名相同的条目（只返回元数据）"""
+    url = request.args.get('url', '')
+    manager = PasswordManager(session['user_id'])
+    host, results = manager.match_url(url)
+    if host is None:
+        return jsonify({'error': 'Invalid URL'}), 400
+    return jsonify({
+        'domain': host,
+        'results': [summary.to_dict() for summary in results]
+    })
 
 @passwords.route('/passwords/<entry_id>/totp')
 @login_required
 def get_totp_code(entry_id):
     """获取TOTP验证码"""
     manager = PasswordManager(session['user_id'])
-    entry = manager.get_entry(entry_id)
+    totp_info = manager.get_totp_secret(entry_id)
     
-    if not entry or not entry.totp_secret:
+    if not totp_info:
         return jsonify({'error': 'TOTP not found'}), 404
         
-    # 创建 TOTP 对象
-    totp = pyotp.TOTP(entry.totp_secret)
+    try:
+        prepared = engine.prepare(totp_info['secret'], totp_info['digits'], totp_info['interval'])
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
     # 获取当前时间和剩余秒数
     now = datetime.now().timestamp()
-    step = 30  # TOTP 默认时间步长
+    step = prepared.interval
     progress = 1.0 - ((now % step) / step)  # 计算进度
+    code, valid_until = code_cache.code(prepared, now)
     
     return jsonify({
-        'code': totp.now(),
-        'progress': progress
+        'code': code,
+        'progress': progress,
+        'valid_until': valid_until
     })
 
+@passwords.route('/passwords/totp_codes')
+@login_required
+def get_totp_codes():
+    """一次性获取所有启用了TOTP的条目的当前代码"""
+    manager = PasswordManager(session['user_id'])
+    codes = code_cache.batch_codes(
+        (entry_id, info['secret'], info['digits'], info['interval'], None)
+        for entry_id, info in manager.get_totp_secrets().items()
+    )
+    return jsonify({'codes': codes})
+
 @passwords.route('/passwords/generate-totp')
 @login_required
 def generate_totp_secret():
@@ -177,45 +249,57 @@ def api_get_totp_code():
         return jsonify({'error': 'Secret is required'}), 400
         
     try:
-        totp = pyotp.TOTP(secret)
-        code = totp.now()
+        code, _ = code_cache.code(engine.prepare(secret))
         return jsonify({'code': code})
     except Exception as e:
         return jsonify({'error': str(e)}), 400
 
+def _totp_qr_uri(manager, entry_id):
+    """密码条目的 otpauth URI，条目不存在或未启用TOTP时返回 None"""
+    entry = manager.get_summary(entry_id)
+    if not entry or not entry.has_totp:
+        return None
+    secret = manager.reveal_field(entry_id, 'totp_secret')
+    return pyotp.TOTP(secret).provisioning_uri(entry.title, issuer_name="2FA Manager")
+
 @passwords.route('/passwords/<id>/totp_qr')
 @login_required
 def get_totp_qr(id):
     """生成TOTP二维码"""
     manager = PasswordManager(session['user_id'])
-    entry = manager.get_entry(id)
+    uri = _totp_qr_uri(manager, id)
     
-    if not entry or not entry.totp_secret:
+    if not uri:
         return jsonify({'error': 'TOTP secret not found'}), 404
     
     try:
-        # 生成otpauth URI
-        uri = pyotp.TOTP(entry.totp_secret).provisioning_uri(entry.title, issuer_name="2FA Manager")
-        
-        # 生成二维码
-        qr = qrcode.QRCode(version=1, box_size=10, border=5)
-        qr.add_data(uri)
-        qr.make(fit=True)
-        
-        # 将二维码转换为图片
-        img = qr.make_image(fill_color="black", back_color="white")
-        
-        # 将图片转换为base64
-        buffered = io.BytesIO()
-        img.save(buffered, format="PNG")
-        img_str = base64.b64encode(buffered.getvalue()).decode()
-        
         return jsonify({
-            'qr_code': f"data:image/png;base64,{img_str}"
+            'qr_code': qr_cache.data_uri(uri)
         })
     except Exception as e:
         return jsonify({'error': str(e)}), 400
 
+@passwords.route('/passwords/<id>/totp_qr.png')
+@login_required
+def get_totp_qr_png(id):
+    """以 PNG 图片返回TOTP二维码"""
+    manager = PasswordManager(session['user_id'])
+    uri = _totp_qr_uri(manager, id)
+    
+    if not uri:
+        return jsonify({'error': 'TOTP secret not found'}), 404
+    
+    try:
+        png, etag = qr_cache.render(uri)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 400
+    
+    # 图片中包含密钥：只允许浏览器缓存，并在每次使用前用 ETag 验证
+    response = Response(png, mimetype='image/png')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response.make_conditional(request)
+
 @passwords.route('/api/decrypt', methods=['POST'])
 @login_required
 def decrypt_text():
@@ -1,12 +1,14 @@
-from flask import render_template, request, redirect, url_for, session, flash
+from flask import render_template, request, redirect, url_for, session, flash, Response
 from utils.auth import login_required
-from utils.config import load_config, save_config
-from werkzeug.security import check_password_hash, generate_password_hash
+from utils.config import get_storage, load_config, load_config_view, update_config
 import pyotp
-import qrcode
-import io
-import base64
+from services.totp_engine import engine
+from services.qr_cache import qr_cache
+from services.kdf_pool import kdf_pool
+from services.password_hashing import hash_password
 from translations import translations
+import os
+import time
 
 def t(key):
     """翻译函数，支持嵌套键"""
@@ -23,40 +25,71 @@ def t(key):
     except (KeyError, AttributeError):
         return key
 
+# 待启用的2FA密钥的有效期（秒）
+ENROLLMENT_TTL = int(os.environ.get('TOTP_ENROLLMENT_TTL', 600))
+
+def _pending_path(user_id):
+    return ('users', user_id, 'pending_totp')
+
+def _get_pending_secret(user_id):
+    """返回未过期的待启用2FA密钥，不存在时返回 None"""
+    pending = get_storage().get(_pending_path(user_id))
+    if not pending or pending.get('expires_at', 0) <= time.time():
+        return None
+    return pending['secret']
+
+def _start_enrollment(user_id):
+    """返回待启用的2FA密钥，不存在或已过期时生成新的"""
+    secret = _get_pending_secret(user_id)
+    if secret is None:
+        secret = pyotp.random_base32()
+        get_storage().set(_pending_path(user_id), {
+            'secret': secret,
+            'expires_at': time.time() + ENROLLMENT_TTL
+        })
+    return secret
+
 @login_required
 def settings():
-    config = load_config()
-    user = config['users'].get(session.get('user_id'))
+    config = load_config_view()
+    user_id = session.get('user_id')
+    user = config['users'].get(user_id)
     
-    # 总是生成新的TOTP密钥用于启用2FA
+    # 未启用2FA时复用同一个待启用密钥，刷新页面不会使已扫描的二维码失效
     if not user.get('totp_enabled'):
-        new_secret = pyotp.random_base32()
-        totp_secret = new_secret
-        session['new_totp_secret'] = new_secret  # 保存到会话中供后续验证使用
+        totp_secret = _start_enrollment(user_id)
     else:
         totp_secret = user['totp_secret']
     
-    totp_uri = pyotp.TOTP(totp_secret).provisioning_uri(
-        user['username'], 
-        issuer_name=t('dashboard.title')
-    )
-    
-    # 生成QR码
-    qr = qrcode.QRCode(version=1, box_size=10, border=5)
-    qr.add_data(totp_uri)
-    qr.make(fit=True)
-    qr_image = qr.make_image(fill_color="black", back_color="white")
-    
-    # 将QR码转换为base64字符串
-    buffered = io.BytesIO()
-    qr_image.save(buffered, format="PNG")
-    qr_base64 = base64.b64encode(buffered.getvalue()).decode()
-    
     return render_template('settings.html', 
                          user=user,
-                         qr_code=qr_base64,
                          totp_secret=totp_secret)
 
+def _totp_uri(user, secret):
+    """登录2FA的 otpauth URI"""
+    return pyotp.TOTP(secret).provisioning_uri(
+        user['username'], 
+        issuer_name=t('dashboard.title')
+    )
+
+@login_required
+def settings_qr():
+    """以 PNG 图片返回待启用的2FA密钥的二维码"""
+    config = load_config_view()
+    user_id = session.get('user_id')
+    user = config['users'].get(user_id)
+    secret = _get_pending_secret(user_id)
+    if not user or not secret:
+        return '', 404
+    
+    png, etag = qr_cache.render(_totp_uri(user, secret))
+    
+    # 图片中包含密钥：只允许浏览器缓存，并在每次使用前用 ETag 验证
+    response = Response(png, mimetype='image/png')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response.make_conditional(request)
+
 @login_required
 def update_username():
     if not request.form.get('new_username'):
@@ -68,7 +101,7 @@ def update_username():
     new_username = request.form.get('new_username')
     password = request.form.get('password')
     
-    if not check_password_hash(current_user['password_hash'], password):
+    if not kdf_pool.check_password_hash(current_user['password_hash'], password):
         flash(t('settings.password_wrong'), 'danger')
         return redirect(url_for('main.settings'))
     
@@ -78,22 +111,23 @@ def update_username():
     
     old_username = session.get('user_id')
     
-    # 更新用户名
-    user_data = config['users'].pop(old_username)
-    user_data['username'] = new_username
-    config['users'][new_username] = user_data
-    
-    # 更新密码存储
-    if 'password_store' in config and old_username in config['password_store']:
-        password_store = config['password_store'].pop(old_username)
-        config['password_store'][new_username] = password_store
-    
-    # 更新TOTP存储
-    if 'totp_store' in config and old_username in config['totp_store']:
-        totp_store = config['totp_store'].pop(old_username)
-        config['totp_store'][new_username] = totp_store
+    def rename(config):
+        # 更新用户名
+        user_data = config['users'].pop(old_username)
+        user_data['username'] = new_username
+        config['users'][new_username] = user_data
+        
+        # 更新密码存储
+        if 'password_store' in config and old_username in config['password_store']:
+            password_store = config['password_store'].pop(old_username)
+            config['password_store'][new_username] = password_store
+        
+        # 更新TOTP存储
+        if 'totp_store' in config and old_username in config['totp_store']:
+            totp_store = config['totp_store'].pop(old_username)
+            config['totp_store'][new_username] = totp_store
     
-    save_config(config)
+    update_config(rename)
     
     # 更新会话
     session['user_id'] = new_username
@@ -117,13 +151,17 @@ def update_password():
     config = load_config()
     current_user = config['users'].get(session.get('user_id'))
     
-    if not check_password_hash(current_user['password_hash'], current_password):
+    if not kdf_pool.check_password_hash(current_user['password_hash'], current_password):
         flash(t('settings.password_wrong'), 'danger')
         return redirect(url_for('main.settings'))
     
     # 更新密码
-    current_user['password_hash'] = generate_password_hash(new_password)
-    save_config(config)
+    password_hash = hash_password(new_password)
+    
+    def set_password(config):
+        config['users'][session.get('user_id')]['password_hash'] = password_hash
+    
+    update_config(set_password)
     
     flash(t('settings.password_updated'), 'success')
     return redirect(url_for('main.settings'))
@@ -135,6 +173,7 @@ def toggle_2fa():
     action = request.form.get('action')
     totp_code = request.form.get('totp_code')
     password = request.form.get('password', '')
+    updates = {}
     
     if action == 'enable':
         if not totp_code:
@@ -142,22 +181,18 @@ def toggle_2fa():
             return redirect(url_for('main.settings'))
         
         # 验证新的TOTP代码
-        new_secret = session.get('new_totp_secret')
+        new_secret = _get_pending_secret(session.get('user_id'))
         if not new_secret:
             flash(t('settings.setup_2fa_first'), 'error')
             return redirect(url_for('main.settings'))
             
-        totp = pyotp.TOTP(new_secret)
-        if not totp.verify(totp_code):
+        # 验证失败时保留待启用密钥，用户可以用已扫描的二维码重试
+        if not engine.verify(new_secret, totp_code):
             flash(t('login.invalid_2fa'), 'error')
-            # 验证失败时生成新的密钥
-            session.pop('new_totp_secret', None)
             return redirect(url_for('main.settings'))
         
         # 启用2FA并保存新密钥
-        user['totp_enabled'] = True
-        user['totp_secret'] = new_secret
-        session.pop('new_totp_secret', None)  # 清除会话中的临时密钥
+        updates = {'totp_enabled': True, 'totp_secret': new_secret}
         
     elif action == 'disable':
         if not all([password, totp_code]):
@@ -165,20 +200,25 @@ def toggle_2fa():
             return redirect(url_for('main.settings'))
             
         # 验证密码
-        if not check_password_hash(user['password_hash'], password):
+        if not kdf_pool.check_password_hash(user['password_hash'], password):
             flash(t('settings.password_wrong'), 'error')
             return redirect(url_for('main.settings'))
             
         # 验证当前TOTP代码
-        totp = pyotp.TOTP(user['totp_secret'])
-        if not totp.verify(totp_code):
+        if not engine.verify(user['totp_secret'], totp_code):
             flash(t('login.invalid_2fa'), 'error')
             return redirect(url_for('main.settings'))
             
         # 禁用2FA
-        user['totp_enabled'] = False
-        
-    save_config(config)
+        updates = {'totp_enabled': False}
+    
+    def apply_updates(config):
+        user = config['users'][session.get('user_id')]
+        user.update(updates)
+        if action == 'enable':
+            user.pop('pending_totp', None)  # 清除待启用的临时密钥
+    
+    update_config(apply_updates)
     
     if action == 'enable':
         flash(t('settings.2fa_enabled_success'), 'success')
@@ -1,6 +1,11 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, session, jsonify
+from flask import Blueprint, render_template, request, redirect, url_for, flash, session, jsonify, Response
 from utils.auth import login_required
-from services.totp_manager import TotpManager
+from services.totp_manager import TotpManager, key_metadata
+from services.totp_engine import engine
+from services.totp_cache import code_cache
+from services.totp_stream import broadcaster
+from services.qr_cache import qr_cache
+from utils.pagination import PAGE_SIZE
 from translations import translations
 import pyotp
 from datetime import datetime
@@ -27,8 +32,62 @@ def t(key):
 def totp_list():
     """显示TOTP密钥列表页面"""
     manager = TotpManager(session['user_id'])
-    totp_keys = manager.get_all_keys()
-    return render_template('totp/index.html', totp_keys=totp_keys)
+    # 只渲染第一页，之后的页面由前端通过 list_totp_keys 加载
+    totp_keys, next_cursor = manager.list_page()
+    return render_template('totp/index.html', totp_keys=totp_keys, next_cursor=next_cursor)
+
+@totp.route('/totp/keys')
+@login_required
+def list_totp_keys():
+    """按游标分页获取TOTP密钥（不包含密钥本身）"""
+    manager = TotpManager(session['user_id'])
+    try:
+        keys, next_cursor = manager.list_page(
+            cursor=request.args.get('cursor'),
+            limit=request.args.get('limit', PAGE_SIZE),
+            sort=request.args.get('sort', 'name'),
+            query=request.args.get('q')
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({
+        'keys': [key_metadata(key) for key in keys],
+        'next_cursor': next_cursor
+    })
+
+@totp.route('/totp/changes')
+@login_required
+def get_totp_changes():
+    """获取某个版本之后变化的密钥，用于增量同步"""
+    manager = TotpManager(session['user_id'])
+    return jsonify(manager.changes_since(request.args.get('since', 0, type=int)))
+
+@totp.route('/totp/codes')
+@login_required
+def get_totp_codes():
+    """一次性获取当前用户所有TOTP密钥的当前代码"""
+    manager = TotpManager(session['user_id'])
+    codes = code_cache.batch_codes(
+        (key['id'], key['secret'], key.get('digits'), key.get('interval'), key.get('algorithm'))
+        for key in manager.get_all_keys()
+    )
+    return jsonify({'codes': codes})
+
+@totp.route('/totp/stream')
+@login_required
+def stream_totp_codes():
+    """通过 Server-Sent Events 推送TOTP代码的更新（每个窗口重连一次，见 TotpBroadcaster）"""
+    user_id = session['user_id']
+    
+    def load_items():
+        return [
+            (key['id'], key['secret'], key.get('digits'), key.get('interval'), key.get('algorithm'))
+            for key in TotpManager(user_id).get_all_keys()
+        ]
+    
+    response = Response(broadcaster.push(load_items), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
 
 @totp.route('/totp/new', methods=['GET', 'POST'])
 @login_required
@@ -106,8 +165,35 @@ def get_totp_code(key_id):
     if not key:
         return jsonify({'error': 'Key not found'}), 404
     
-    totp = pyotp.TOTP(key['secret'])
+    try:
+        prepared = engine.prepare(key['secret'], key.get('digits'), key.get('interval'), key.get('algorithm'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    code, valid_until = code_cache.code(prepared)
     return jsonify({
-        'code': totp.now(),
-        'valid_until': (datetime.now().timestamp() // 30 + 1) * 30
+        'code': code,
+        'valid_until': valid_until
     })
+
+@totp.route('/totp/<key_id>/qr.png')
+@login_required
+def get_totp_qr_png(key_id):
+    """以 PNG 图片返回TOTP密钥的二维码"""
+    manager = TotpManager(session['user_id'])
+    key = manager.get_key(key_id)
+    if not key:
+        return jsonify({'error': 'Key not found'}), 404
+    
+    try:
+        uri = pyotp.TOTP(key['secret'], digits=int(key.get('digits') or 6),
+                         interval=int(key.get('interval') or 30)).provisioning_uri(
+            key.get('name'), issuer_name=key.get('issuer') or '2FA')
+        png, etag = qr_cache.render(uri)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 400
+    
+    # 图片中包含密钥：只允许浏览器缓存，并在每次使用前用 ETag 验证
+    response = Response(png, mimetype='image/png')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response.make_conditional(request)
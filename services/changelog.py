@@ -0,0 +1,73 @@
+import os
+from utils.journal import SET, DELETE
+
+# 每个用户存储保留的变更记录数量，更早的记录被丢弃，客户端需要完整重新同步
+MAX_CHANGES = int(os.environ.get('CHANGELOG_MAX_RECORDS', 500))
+
+CREATE = 'create'
+UPDATE = 'update'
+REMOVE = 'delete'
+
+
+def version_path(store_path: tuple) -> tuple:
+    """存储版本号的路径（每次写入条目时递增）"""
+    return store_path + ('version',)
+
+
+def record(store_path: tuple, version: int, item_id: str, op: str) -> list:
+    """
+    生成把存储推进到 version 所需的变更：更新版本号、写入一条变更记录、丢弃过旧的记录
+    """
+    changes = [
+        (SET, version_path(store_path), version),
+        (SET, store_path + ('changes', str(version)), {'id': item_id, 'op': op}),
+    ]
+    if version > MAX_CHANGES:
+        changes.append((DELETE, store_path + ('changes', str(version - MAX_CHANGES)), None))
+    return changes
+
+
+def commit(storage, store_path: tuple, changes: list, item_id: str, op: str) -> int:
+    """
+    应用一个条目的变更并推进存储版本
+
+    版本号在提交锁内读取和递增，并发的写入（包括其它进程的）各自占用一个版本号，
+    不会丢失，也不需要重试。
+    :return: 提交前的版本号
+    """
+    path = version_path(store_path)
+    committed = []
+
+    def build(read):
+        version = read(path) or 0
+        committed[:] = [version]
+        return changes + record(store_path, version + 1, item_id, op)
+    storage.update(build)
+    return committed[0]
+
+
+def changes_since(storage, store_path: tuple, since: int) -> dict:
+    """
+    获取某个版本之后的变更
+    :return: {'version': 当前版本, 'resync': 是否需要完整重新同步, 'changes': [{'version', 'id', 'op'}]}，
+             同一个条目只保留最后一次变更
+    """
+    version = storage.get(version_path(store_path), 0)
+    if since == version:
+        return {'version': version, 'resync': False, 'changes': []}
+    # 客户端的版本比存储还新（例如恢复了备份），或者需要的记录已被丢弃
+    if since > version or since < version - MAX_CHANGES:
+        return {'version': version, 'resync': True, 'changes': []}
+
+    log = storage.peek(store_path + ('changes',), {})
+    latest = {}
+    for number in range(since + 1, version + 1):
+        entry = log.get(str(number))
+        if entry is None:
+            return {'version': version, 'resync': True, 'changes': []}
+        latest[entry['id']] = {'version': number, 'id': entry['id'], 'op': entry['op']}
+    return {
+        'version': version,
+        'resync': False,
+        'changes': sorted(latest.values(), key=lambda change: change['version'])
+    }
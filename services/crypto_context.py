@@ -0,0 +1,112 @@
+import base64
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+from cryptography.fernet import Fernet
+from models.password_entry import fernet_token
+
+
+def key_fingerprint(key: bytes) -> str:
+    """密钥标识，不包含密钥本身"""
+    return hashlib.sha256(key).hexdigest()[:32]
+
+
+class CryptoContext:
+    """
+    一个用户的加解密上下文
+
+    密钥只解析一次（Fernet 初始化），之后所有字段的加解密都复用同一个对象。
+    密文格式与 PasswordEntry.encrypt_data 相同。
+    """
+    __slots__ = ('fernet', 'fingerprint')
+
+    def __init__(self, key: bytes):
+        self.fernet = Fernet(key)
+        self.fingerprint = key_fingerprint(key)
+
+    def encrypt(self, data: str) -> Optional[str]:
+        """加密一个字段"""
+        if not data:
+            return None
+        return self.fernet.encrypt(data.encode()).decode()
+
+    def decrypt(self, encrypted_data: str) -> Optional[str]:
+        """解密一个字段（接受紧凑格式和旧格式）"""
+        if not encrypted_data:
+            return None
+        return self.fernet.decrypt(fernet_token(encrypted_data)).decode()
+
+
+class CryptoRegistry:
+    """
+    跨请求复用的加解密上下文
+
+    按 (用户, 密钥标识) 缓存在一个有界的 LRU 中；用户更换密钥后旧的上下文
+    不会再被命中，最终被淘汰。
+    """
+
+    def __init__(self, max_contexts: int = 256):
+        self.max_contexts = max_contexts
+        self._contexts = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id: str, key: bytes) -> CryptoContext:
+        """获取用户的加解密上下文"""
+        cache_key = (user_id, key_fingerprint(key))
+        with self._lock:
+            context = self._contexts.get(cache_key)
+            if context is not None:
+                self._contexts.move_to_end(cache_key)
+                return context
+        context = CryptoContext(key)
+        with self._lock:
+            self._contexts[cache_key] = context
+            while len(self._contexts) > self.max_contexts:
+                self._contexts.popitem(last=False)
+        return context
+
+    def discard(self, user_id: str):
+        """丢弃一个用户的所有上下文"""
+        with self._lock:
+            for cache_key in [k for k in self._contexts if k[0] == user_id]:
+                del self._contexts[cache_key]
+
+
+crypto_registry = CryptoRegistry()
+
+
+def _benchmark(entry_count=2000):
+    """比较每个字段新建 Fernet 与复用上下文的解密速度，以及旧格式与紧凑格式的大小和解密速度"""
+    from models.password_entry import PasswordEntry
+    key = Fernet.generate_key()
+    context = crypto_registry.get('benchmark', key)
+    fields = [context.encrypt(f'secret-{i}') for i in range(entry_count * 3)]
+    legacy = [base64.urlsafe_b64encode(field.encode()).decode() for field in fields]
+
+    start = time.perf_counter()
+    for field in fields:
+        PasswordEntry.decrypt_data(key, field)
+    per_field = time.perf_counter() - start
+
+    start = time.perf_counter()
+    context = crypto_registry.get('benchmark', key)
+    for field in fields:
+        context.decrypt(field)
+    shared = time.perf_counter() - start
+
+    print(f'{entry_count} entries x 3 fields')
+    print(f'Fernet per field: {per_field * 1000:8.1f} ms')
+    print(f'shared context:   {shared * 1000:8.1f} ms')
+
+    start = time.perf_counter()
+    for field in legacy:
+        context.decrypt(field)
+    legacy_time = time.perf_counter() - start
+    print(f'legacy format:    {legacy_time * 1000:8.1f} ms, {sum(map(len, legacy)) / 1024:8.1f} KB')
+    print(f'compact format:   {shared * 1000:8.1f} ms, {sum(map(len, fields)) / 1024:8.1f} KB')
+
+
+if __name__ == '__main__':
+    _benchmark()
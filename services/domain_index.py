@@ -0,0 +1,77 @@
+import threading
+from typing import Optional
+from urllib.parse import urlsplit
+
+def normalize_host(url: str) -> Optional[str]:
+    """
+    提取网址中的主机名：转为小写，去掉端口和开头的 www.
+    :return: 主机名，网址无效时返回 None
+    """
+    if not url:
+        return None
+    url = url.strip()
+    if '://' not in url:
+        url = '//' + url
+    try:
+        host = urlsplit(url).hostname
+    except ValueError:
+        return None
+    if not host:
+        return None
+    host = host.rstrip('.')
+    if host.startswith('www.'):
+        host = host[4:]
+    return host or None
+
+
+class DomainIndex:
+    """
+    规范化的主机名 -> 条目的索引
+
+    查询一个网址只需要一次字典查找，与条目数量无关。只匹配规范化后完全相同的主机名：
+    不按“可注册域名”合并子域名，因为没有完整的公共后缀列表时无法区分
+    alice.github.io 与 bob.github.io 这类属于不同所有者的站点。
+    写请求在其它线程增量更新索引，所以读写都持有索引自己的锁。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._hosts = {}
+        self._entries = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def add(self, entry_id: str, url: Optional[str]):
+        """添加或替换一个条目"""
+        host = normalize_host(url)
+        with self._lock:
+            self._remove(entry_id)
+            if host:
+                self._hosts.setdefault(host, {})[entry_id] = True
+                self._entries[entry_id] = host
+
+    def remove(self, entry_id: str):
+        """移除一个条目"""
+        with self._lock:
+            self._remove(entry_id)
+
+    def _remove(self, entry_id):
+        host = self._entries.pop(entry_id, None)
+        if host is None:
+            return
+        entries = self._hosts[host]
+        entries.pop(entry_id, None)
+        if not entries:
+            del self._hosts[host]
+
+    def lookup(self, url: str):
+        """
+        查找与网址主机名相同的条目
+        :return: (规范化的主机名, 条目 ID 列表)，网址无效时返回 (None, [])
+        """
+        host = normalize_host(url)
+        if not host:
+            return None, []
+        with self._lock:
+            return host, list(self._hosts.get(host, ()))
@@ -0,0 +1,127 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from werkzeug.security import check_password_hash, generate_password_hash
+
+# 执行密码哈希的线程数，以及排队等待的任务上限（超出时立即拒绝）
+KDF_WORKERS = int(os.environ.get('KDF_WORKERS', min(4, os.cpu_count() or 1)))
+KDF_MAX_QUEUE = int(os.environ.get('KDF_MAX_QUEUE', 16))
+
+
+class KdfPoolBusy(Exception):
+    """密码哈希线程池已满"""
+
+
+class KdfPool:
+    """
+    密码哈希（pbkdf2/scrypt）专用的有界线程池
+
+    hashlib 计算时释放 GIL，所以哈希在工作线程中运行时，请求线程和其它请求
+    （例如 TOTP 代码轮询）不会被拖慢。同时运行和排队的任务总数有上限，
+    大量登录请求涌入时多出的请求立即失败，而不是无限排队占满所有请求线程。
+    """
+
+    def __init__(self, max_workers: int = KDF_WORKERS, max_queue: int = KDF_MAX_QUEUE):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='kdf')
+        self._slots = threading.BoundedSemaphore(max_workers + max_queue)
+        self._lock = threading.Lock()
+        self._completed = 0
+        self._rejected = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._compute_total = 0.0
+        self._compute_max = 0.0
+
+    def _run(self, submitted, fn, args):
+        started = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            finished = time.perf_counter()
+            self._slots.release()
+            with self._lock:
+                wait, compute = started - submitted, finished - started
+                self._completed += 1
+                self._wait_total += wait
+                self._compute_total += compute
+                self._wait_max = max(self._wait_max, wait)
+                self._compute_max = max(self._compute_max, compute)
+
+    def run(self, fn, *args):
+        """
+        在线程池中执行 fn(*args) 并等待结果
+        :raises KdfPoolBusy: 运行和排队的任务已达上限
+        """
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._rejected += 1
+            raise KdfPoolBusy()
+        try:
+            future = self._executor.submit(self._run, time.perf_counter(), fn, args)
+        except BaseException:
+            self._slots.release()
+            raise
+        return future.result()
+
+    def check_password_hash(self, password_hash: str, password: str) -> bool:
+        """验证密码"""
+        return self.run(check_password_hash, password_hash, password or '')
+
+    def generate_password_hash(self, password: str, method: str = 'scrypt') -> str:
+        """生成密码哈希"""
+        return self.run(generate_password_hash, password, method)
+
+    def stats(self) -> dict:
+        """线程池统计信息：排队等待时间与计算时间（毫秒）"""
+        with self._lock:
+            completed = self._completed or 1
+            return {
+                'workers': self.max_workers,
+                'max_queue': self.max_queue,
+                'completed': self._completed,
+                'rejected': self._rejected,
+                'wait_avg_ms': round(self._wait_total / completed * 1000, 2),
+                'wait_max_ms': round(self._wait_max * 1000, 2),
+                'compute_avg_ms': round(self._compute_total / completed * 1000, 2),
+                'compute_max_ms': round(self._compute_max * 1000, 2),
+            }
+
+
+kdf_pool = KdfPool()
+
+
+def _benchmark(burst=32):
+    """模拟大量登录请求，同时测量其它请求的响应延迟"""
+    password_hash = generate_password_hash('benchmark')
+    pool = KdfPool()
+    results = {'ok': 0, 'busy': 0}
+
+    def attempt():
+        try:
+            pool.check_password_hash(password_hash, 'wrong')
+            results['ok'] += 1
+        except KdfPoolBusy:
+            results['busy'] += 1
+
+    threads = [threading.Thread(target=attempt) for _ in range(burst)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    latencies = []
+    while any(thread.is_alive() for thread in threads):
+        tick = time.perf_counter()
+        sum(range(1000))
+        latencies.append(time.perf_counter() - tick)
+        time.sleep(0.005)
+    for thread in threads:
+        thread.join()
+    print(f'{burst} concurrent logins in {(time.perf_counter() - start) * 1000:.0f} ms: {results}')
+    print(f'light request latency: max {max(latencies, default=0) * 1000:.2f} ms')
+    print(pool.stats())
+
+
+if __name__ == '__main__':
+    _benchmark()
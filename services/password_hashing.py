@@ -0,0 +1,162 @@
+import hashlib
+import os
+import threading
+import time
+from datetime import datetime
+from werkzeug.security import generate_password_hash
+from utils.config import get_storage
+from utils.journal import SET
+from utils.storage import VersionConflict
+from services.kdf_pool import kdf_pool
+
+# 单次密码哈希的目标耗时（毫秒）和算法（pbkdf2 或 scrypt）
+TARGET_MS = int(os.environ.get('PASSWORD_HASH_TARGET_MS', 150))
+SCHEME = os.environ.get('PASSWORD_HASH_SCHEME', 'pbkdf2').lower()
+# 参数下限：较慢的机器上校准结果也不会低于这个强度（此时单次哈希会超过目标耗时）
+PBKDF2_MIN_ITERATIONS = int(os.environ.get('PBKDF2_MIN_ITERATIONS', 100000))
+# 当前方法的实测耗时超过目标的这个倍数时，登录不再把旧哈希升级到当前方法
+REHASH_TOLERANCE = 1.5
+SCRYPT_MIN_N = 2 ** 14
+SCRYPT_MAX_N = 2 ** 20
+SCRYPT_R = 8
+SCRYPT_P = 1
+
+_CONFIG_PATH = ('password_hashing',)
+_METHOD_PATH = _CONFIG_PATH + ('method',)
+_calibration_lock = threading.Lock()
+# 本进程实测的各哈希方法的耗时（毫秒），启动时测量
+_costs = {}
+
+
+def _measure(fn, rounds=3) -> float:
+    """fn 的最短耗时（秒）"""
+    best = None
+    for _ in range(rounds):
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def calibrate_pbkdf2(target_ms: int = TARGET_MS) -> str:
+    """测量本机的 pbkdf2_hmac 速度，返回达到目标耗时的 werkzeug 方法字符串"""
+    probe = 20000
+    elapsed = _measure(lambda: hashlib.pbkdf2_hmac('sha256', b'calibrate', b'salt' * 4, probe))
+    iterations = int(probe * (target_ms / 1000) / elapsed) // 1000 * 1000
+    return f'pbkdf2:sha256:{max(iterations, PBKDF2_MIN_ITERATIONS)}'
+
+
+def calibrate_scrypt(target_ms: int = TARGET_MS) -> str:
+    """测量本机的 scrypt 速度，返回达到目标耗时的 werkzeug 方法字符串（n 为 2 的幂）"""
+    n = SCRYPT_MIN_N
+    while n < SCRYPT_MAX_N:
+        elapsed = _measure(lambda: hashlib.scrypt(
+            b'calibrate', salt=b'salt' * 4, n=n, r=SCRYPT_R, p=SCRYPT_P,
+            maxmem=132 * n * SCRYPT_R * SCRYPT_P), rounds=2)
+        # 再翻倍会比目标更远时停止
+        if elapsed * 2 - target_ms / 1000 > target_ms / 1000 - elapsed:
+            break
+        n *= 2
+    return f'scrypt:{n}:{SCRYPT_R}:{SCRYPT_P}'
+
+
+def calibrate(target_ms: int = TARGET_MS, scheme: str = SCHEME) -> str:
+    """按目标耗时选择哈希参数"""
+    if scheme == 'scrypt':
+        return calibrate_scrypt(target_ms)
+    if scheme == 'pbkdf2':
+        return calibrate_pbkdf2(target_ms)
+    raise ValueError(f'Unsupported password hash scheme: {scheme}')
+
+
+def _calibration(target_ms: int, scheme: str) -> dict:
+    return {
+        'method': calibrate(target_ms, scheme),
+        'scheme': scheme,
+        'target_ms': target_ms,
+        'calibrated_at': datetime.now().isoformat()
+    }
+
+
+def save_calibration(target_ms: int = TARGET_MS, scheme: str = SCHEME) -> dict:
+    """重新校准并把选中的参数保存到配置（覆盖已有的校准结果）"""
+    settings = _calibration(target_ms, scheme)
+    get_storage().set(_CONFIG_PATH, settings)
+    return settings
+
+
+def measure_method(method: str) -> float:
+    """实测一个哈希方法在本机的耗时（毫秒），结果在本进程内缓存"""
+    if method not in _costs:
+        _costs[method] = _measure(lambda: generate_password_hash('calibrate', method=method), rounds=1) * 1000
+    return _costs[method]
+
+
+def ensure_calibrated() -> str:
+    """
+    确保配置中有校准结果，返回当前的哈希方法
+
+    应用启动时调用。没有校准结果时在密码哈希线程池中按 PASSWORD_HASH_TARGET_MS 校准一次：
+    进程内由锁保证只校准一次，多个进程同时校准时只保存最先提交的结果。
+    同时实测当前方法的耗时，供 needs_rehash() 判断。
+    """
+    method = get_storage().get(_METHOD_PATH)
+    if method and method in _costs:
+        return method
+    with _calibration_lock:
+        method = get_storage().get(_METHOD_PATH)
+        if not method:
+            settings = kdf_pool.run(_calibration, TARGET_MS, SCHEME)
+            try:
+                get_storage().apply([(SET, _CONFIG_PATH, settings)], expect=[(_METHOD_PATH, None)])
+            except VersionConflict:
+                pass  # 其它进程先保存了校准结果
+            method = get_storage().get(_METHOD_PATH)
+        if method not in _costs:
+            kdf_pool.run(measure_method, method)
+        return method
+
+
+def current_method() -> str:
+    """
+    当前的哈希方法
+
+    校准结果在启动时生成（ensure_calibrated）；更换目标耗时或算法需要重新运行校准
+    （python -m services.password_hashing）。
+    """
+    return get_storage().get(_METHOD_PATH) or ensure_calibrated()
+
+
+def hash_password(password: str) -> str:
+    """用当前的哈希方法生成密码哈希（在密码哈希线程池中执行）"""
+    return kdf_pool.generate_password_hash(password, current_method())
+
+
+def needs_rehash(password_hash: str) -> bool:
+    """
+    登录时是否应该把哈希升级到当前方法
+
+    只在哈希参数与当前方法不同、且当前方法在本机的实测耗时没有超过目标时升级；
+    耗时未测量（没有经过 ensure_calibrated）或超过目标时不升级，避免之后每次登录都变慢。
+    """
+    method = current_method()
+    if password_hash.split('$', 1)[0] == method:
+        return False
+    cost = _costs.get(method)
+    return cost is not None and cost <= TARGET_MS * REHASH_TOLERANCE
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Calibrate password hashing parameters for this host')
+    parser.add_argument('--target-ms', type=int, default=TARGET_MS)
+    parser.add_argument('--scheme', choices=('pbkdf2', 'scrypt'), default=SCHEME)
+    parser.add_argument('--dry-run', action='store_true', help='print the parameters without saving them')
+    args = parser.parse_args()
+    if args.dry_run:
+        method = calibrate(args.target_ms, args.scheme)
+    else:
+        method = save_calibration(args.target_ms, args.scheme)['method']
+    elapsed = _measure(lambda: generate_password_hash('calibrate', method=method))
+    print(f'{method}: {elapsed * 1000:.0f} ms per hash')
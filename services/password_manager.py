@@ -1,44 +1,132 @@
 import json
 import os
-from typing import List, Optional
+from typing import List, Optional, Tuple
 from datetime import datetime
 import uuid
-from models.password_entry import PasswordEntry
-from utils.config import load_config, save_config
-from cryptography.fernet import Fernet
-import base64
+from models.password_entry import (PasswordEntry, PasswordSummary, parse_datetime,
+                                   is_legacy_ciphertext, compact_ciphertext)
+from utils.config import get_storage
+from utils.journal import SET, DELETE
+from utils.storage import VersionConflict
+from utils.pagination import PAGE_SIZE, paginate
+from services.crypto_context import crypto_registry
+from services.search_index import SearchIndex, indexes
+from services.domain_index import DomainIndex
+from services import changelog
+from services.totp_cache import code_cache
+
+# 加密保存的字段
+ENCRYPTED_FIELDS = ('password', 'notes', 'totp_secret')
+
+def migrate_ciphertexts(user_id: str) -> int:
+    """
+    把用户密码条目中旧格式（两层 base64）的密文改写为紧凑格式
+
+    只去掉外层编码，不需要密钥，明文不变；没有旧格式密文时不写入。登录成功后调用，
+    也可以一次迁移所有用户（python -m utils.migrate_ciphertexts）。
+    期间被其它写入修改过的字段不再改写。
+    :return: 改写的字段数
+    """
+    storage = get_storage()
+    entries_path = ('password_store', user_id, 'entries')
+    legacy = {}
+    for entry_id, entry_data in storage.peek(entries_path, {}).items():
+        for field in ENCRYPTED_FIELDS:
+            if is_legacy_ciphertext(entry_data.get(field)):
+                legacy[entries_path + (entry_id, field)] = entry_data[field]
+    if not legacy:
+        return 0
+    migrated = []
+    
+    def build(read):
+        changes = [(SET, path, compact_ciphertext(value))
+                   for path, value in legacy.items() if read(path) == value]
+        migrated[:] = changes
+        return changes
+    storage.update(build)
+    return len(migrated)
 
 class PasswordManager:
     def __init__(self, user_id: str):
         """初始化密码管理器"""
         self.user_id = user_id
-        self.config = load_config()
-        self._ensure_password_store()
+        self.storage = get_storage()
         
         # 获取或创建用户的加密密钥
         self.encryption_key = self._get_or_create_encryption_key()
-        self.crypto = Fernet(self.encryption_key)
-    
-    def _ensure_password_store(self):
-        """确保密码存储相关的配置存在"""
-        if 'password_store' not in self.config:
-            self.config['password_store'] = {}
-        if self.user_id not in self.config['password_store']:
-            self.config['password_store'][self.user_id] = {
-                'encryption_key': PasswordEntry.generate_key().decode(),
-                'entries': {}
-            }
-            save_config(self.config)
+        self.crypto = crypto_registry.get(user_id, self.encryption_key)
+    
+    def _entry_path(self, *parts) -> tuple:
+        """用户密码条目在存储中的路径"""
+        return ('password_store', self.user_id, 'entries') + parts
+    
+    def _store_path(self) -> tuple:
+        """用户密码存储在存储中的路径"""
+        return ('password_store', self.user_id)
+    
+    def _version(self) -> int:
+        return self.storage.get(changelog.version_path(self._store_path()), 0)
+    
+    def _commit(self, changes: list, entry_id: str, entry_data: Optional[dict], op: str):
+        """
+        应用条目的变更，递增版本号并记录变更日志，同时增量更新内存索引
+        :param entry_data: 变更后的条目数据，删除时为 None
+        """
+        version = changelog.commit(self.storage, self._store_path(), changes, entry_id, op)
+        
+        def update_search(index):
+            if entry_data is None:
+                index.remove(entry_id)
+            else:
+                index.add(entry_id, entry_data)
+        
+        def update_domains(index):
+            if entry_data is None:
+                index.remove(entry_id)
+            else:
+                index.add(entry_id, entry_data.get('url'))
+        
+        indexes.update(('search', self.user_id), version, version + 1, update_search)
+        indexes.update(('domain', self.user_id), version, version + 1, update_domains)
+    
+    def _search_index(self) -> SearchIndex:
+        """获取与存储版本一致的搜索索引（只包含非加密字段）"""
+        def build():
+            index = SearchIndex()
+            for entry_id, entry_data in self.storage.peek(self._entry_path(), {}).items():
+                index.add(entry_id, entry_data)
+            return index
+        return indexes.get(('search', self.user_id), self._version(), build)
+    
+    def _domain_index(self) -> DomainIndex:
+        """获取与存储版本一致的域名索引"""
+        def build():
+            index = DomainIndex()
+            for entry_id, entry_data in self.storage.peek(self._entry_path(), {}).items():
+                index.add(entry_id, entry_data.get('url'))
+            return index
+        return indexes.get(('domain', self.user_id), self._version(), build)
     
     def _get_or_create_encryption_key(self) -> bytes:
         """获取或创建用户的加密密钥"""
-        user_store = self.config['password_store'][self.user_id]
-        if 'encryption_key' not in user_store:
+        key_path = ('password_store', self.user_id, 'encryption_key')
+        encryption_key = self.storage.get(key_path)
+        if not encryption_key:
             key = PasswordEntry.generate_key()
-            user_store['encryption_key'] = key.decode()
-            save_config(self.config)
-            return key
-        return user_store['encryption_key'].encode()
+            try:
+                # 只在还没有密钥时写入，并发的第一次请求不能覆盖彼此的密钥
+                self.storage.apply([(SET, key_path, key.decode())], expect=[(key_path, None)])
+                return key
+            except VersionConflict:
+                encryption_key = self.storage.get(key_path)
+        return encryption_key.encode()
+    
+    def _decrypt_fields(self, entry_data: dict) -> dict:
+        """解密条目中的敏感字段（原地修改）"""
+        for field in ENCRYPTED_FIELDS:
+            if entry_data.get(field):
+                entry_data[field] = self.crypto.decrypt(entry_data[field])
+        return entry_data
     
     def create_entry(self, title: str, password: str, username: Optional[str] = None,
                     url: Optional[str] = None, notes: Optional[str] = None,
@@ -48,9 +136,9 @@ class PasswordManager:
         now = datetime.utcnow()
         
         # 加密敏感数据
-        encrypted_password = PasswordEntry.encrypt_data(self.encryption_key, password)
-        encrypted_notes = PasswordEntry.encrypt_data(self.encryption_key, notes) if notes else None
-        encrypted_totp = PasswordEntry.encrypt_data(self.encryption_key, totp_secret) if totp_secret else None
+        encrypted_password = self.crypto.encrypt(password)
+        encrypted_notes = self.crypto.encrypt(notes) if notes else None
+        encrypted_totp = self.crypto.encrypt(totp_secret) if totp_secret else None
         
         entry = PasswordEntry(
             id=entry_id,
@@ -65,8 +153,8 @@ class PasswordManager:
             totp_secret=encrypted_totp
         )
         
-        self.config['password_store'][self.user_id]['entries'][entry_id] = entry.to_dict()
-        save_config(self.config)
+        entry_data = entry.to_dict()
+        self._commit([(SET, self._entry_path(entry_id), entry_data)], entry_id, entry_data, changelog.CREATE)
         
         # 返回解密后的条目
         return self.get_entry(entry_id)
@@ -74,117 +162,187 @@ class PasswordManager:
     def get_all_entries(self) -> List[PasswordEntry]:
         """获取所有密码条目"""
         entries = []
-        for entry_id, entry_data in self.config['password_store'][self.user_id]['entries'].items():
-            entry_data = entry_data.copy()  # 创建副本以避免修改原始数据
+        for entry_id, entry_data in self.storage.get(self._entry_path(), {}).items():
             # 解密敏感数据
-            if entry_data.get('password'):
-                entry_data['password'] = PasswordEntry.decrypt_data(self.encryption_key, entry_data['password'])
-            if entry_data.get('notes'):
-                entry_data['notes'] = PasswordEntry.decrypt_data(self.encryption_key, entry_data['notes'])
-            if entry_data.get('totp_secret'):
-                entry_data['totp_secret'] = PasswordEntry.decrypt_data(self.encryption_key, entry_data['totp_secret'])
-            
-            entries.append(PasswordEntry.from_dict(entry_data))
+            entries.append(PasswordEntry.from_dict(self._decrypt_fields(entry_data)))
         return entries
     
     def get_entry(self, entry_id: str) -> Optional[PasswordEntry]:
         """获取指定的密码条目"""
-        entries = self.config['password_store'][self.user_id]['entries']
-        if entry_id not in entries:
+        entry_data = self.storage.get(self._entry_path(entry_id))
+        if entry_data is None:
             return None
-            
-        entry_data = entries[entry_id].copy()  # 创建副本以避免修改原始数据
         
         # 解密敏感数据
-        if entry_data.get('password'):
-            entry_data['password'] = PasswordEntry.decrypt_data(self.encryption_key, entry_data['password'])
-        if entry_data.get('notes'):
-            entry_data['notes'] = PasswordEntry.decrypt_data(self.encryption_key, entry_data['notes'])
-        if entry_data.get('totp_secret'):
-            entry_data['totp_secret'] = PasswordEntry.decrypt_data(self.encryption_key, entry_data['totp_secret'])
-            
-        return PasswordEntry.from_dict(entry_data)
+        return PasswordEntry.from_dict(self._decrypt_fields(entry_data))
+    
+    def list_entries(self) -> List[PasswordSummary]:
+        """获取所有密码条目的元数据（不解密任何字段）"""
+        return [PasswordSummary.from_dict(entry_data)
+                for entry_data in self.storage.get(self._entry_path(), {}).values()]
+    
+    def list_page(self, cursor: Optional[str] = None, limit: int = PAGE_SIZE,
+                  sort: str = 'title') -> Tuple[List[PasswordSummary], Optional[str]]:
+        """
+        按游标分页获取条目元数据（不解密任何字段）
+        :param sort: 'title' 按标题升序，'updated' 按更新时间降序
+        :return: (当前页的条目元数据, 下一页的游标)
+        :raises ValueError: 排序方式或游标无效
+        """
+        if sort == 'title':
+            sort_key, reverse = (lambda item: ((item[1].get('title') or '').lower(), item[0])), False
+        elif sort == 'updated':
+            sort_key, reverse = (lambda item: (parse_datetime(item[1]['updated_at']).isoformat(), item[0])), True
+        else:
+            raise ValueError(f'Unknown sort: {sort}')
+        entries = self.storage.peek(self._entry_path(), {})
+        page, next_cursor = paginate(entries.items(), sort_key, sort, cursor, limit, reverse)
+        return [PasswordSummary.from_dict(entry_data) for _, entry_data in page], next_cursor
+    
+    def get_summary(self, entry_id: str) -> Optional[PasswordSummary]:
+        """获取指定密码条目的元数据（不解密任何字段）"""
+        entry_data = self.storage.get(self._entry_path(entry_id))
+        if entry_data is None:
+            return None
+        return PasswordSummary.from_dict(entry_data)
+    
+    def reveal_field(self, entry_id: str, field: str) -> Optional[str]:
+        """
+        只解密条目的一个字段
+        :raises ValueError: 字段不是加密字段
+        :raises KeyError: 条目不存在
+        """
+        if field not in ENCRYPTED_FIELDS:
+            raise ValueError(f'Unknown field: {field}')
+        entry_data = self.storage.get(self._entry_path(entry_id))
+        if entry_data is None:
+            raise KeyError(entry_id)
+        return self.crypto.decrypt(entry_data.get(field))
+    
+    def get_totp_secret(self, entry_id: str) -> Optional[dict]:
+        """获取一个条目的TOTP密钥（只解密TOTP密钥字段），未启用TOTP时返回 None"""
+        entry_data = self.storage.get(self._entry_path(entry_id))
+        if not entry_data or not entry_data.get('totp_secret'):
+            return None
+        return {
+            'secret': self.crypto.decrypt(entry_data['totp_secret']),
+            'digits': entry_data.get('totp_digits', 6),
+            'interval': entry_data.get('totp_interval', 30)
+        }
+    
+    def get_totp_secrets(self) -> dict:
+        """获取所有启用了TOTP的条目的密钥（只解密TOTP密钥字段）"""
+        secrets = {}
+        for entry_id, entry_data in self.storage.get(self._entry_path(), {}).items():
+            if entry_data.get('totp_secret'):
+                secrets[entry_id] = {
+                    'secret': self.crypto.decrypt(entry_data['totp_secret']),
+                    'digits': entry_data.get('totp_digits', 6),
+                    'interval': entry_data.get('totp_interval', 30)
+                }
+        return secrets
     
     def update_entry(self, entry_id: str, title: Optional[str] = None,
                     password: Optional[str] = None, username: Optional[str] = None,
                     url: Optional[str] = None, notes: Optional[str] = None,
                     category: Optional[str] = None, totp_secret: Optional[str] = None) -> Optional[PasswordEntry]:
-        """更新密码条目"""
-        # 获取现有条目
-        entry = self.get_entry(entry_id)
-        if not entry:
+        """
+        更新密码条目
+
+        只写入实际变化的字段：未变化的加密字段保留原有密文，不重新加密。
+        """
+        entry_path = self._entry_path(entry_id)
+        entry_data = self.storage.get(entry_path)
+        if entry_data is None:
             return None
-            
-        # 创建一个新的条目对象，保留未更新的字段
-        updated_data = {
-            'id': entry_id,
-            'title': title if title is not None else entry.title,
-            'username': username if username is not None else entry.username,
-            'url': url if url is not None else entry.url,
-            'category': category if category is not None else entry.category,
-            'created_at': entry.created_at,
-            'updated_at': datetime.utcnow()
-        }
         
-        # 处理需要加密的字段
-        if password is not None:
-            updated_data['password'] = PasswordEntry.encrypt_data(self.encryption_key, password)
-        else:
-            # 重新加密现有密码
-            updated_data['password'] = PasswordEntry.encrypt_data(self.encryption_key, entry.password)
-            
-        if notes is not None:
-            updated_data['notes'] = PasswordEntry.encrypt_data(self.encryption_key, notes) if notes else None
-        elif entry.notes:
-            updated_data['notes'] = PasswordEntry.encrypt_data(self.encryption_key, entry.notes)
-        else:
-            updated_data['notes'] = None
-            
-        if totp_secret is not None:
-            updated_data['totp_secret'] = PasswordEntry.encrypt_data(self.encryption_key, totp_secret) if totp_secret else None
-        elif entry.totp_secret:
-            updated_data['totp_secret'] = PasswordEntry.encrypt_data(self.encryption_key, entry.totp_secret)
-        else:
-            updated_data['totp_secret'] = None
-            
-        # 保存更新后的条目
-        self.config['password_store'][self.user_id]['entries'][entry_id] = updated_data
-        save_config(self.config)
+        changes = []
+        for field, value in (('title', title), ('username', username), ('url', url), ('category', category)):
+            if value is not None and value != entry_data.get(field):
+                entry_data[field] = value
+                changes.append((SET, entry_path + (field,), value))
         
-        # 返回解密后的条目
-        return self.get_entry(entry_id)
+        # 加密字段：与当前明文比较，只有变化时才加密
+        plaintext = {}
+        for field, value in (('password', password), ('notes', notes), ('totp_secret', totp_secret)):
+            current = self.crypto.decrypt(entry_data.get(field))
+            plaintext[field] = current
+            if value is None or (value or None) == current:
+                continue
+            plaintext[field] = value or None
+            if field == 'totp_secret' and current:
+                self._forget_totp(current, entry_data)
+            entry_data[field] = self.crypto.encrypt(value)
+            changes.append((SET, entry_path + (field,), entry_data[field]))
+        
+        if changes:
+            entry_data['updated_at'] = datetime.utcnow()
+            changes.append((SET, entry_path + ('updated_at',), entry_data['updated_at']))
+            self._commit(changes, entry_id, entry_data, changelog.UPDATE)
+        
+        # 用已知的明文构造返回的条目，不再读取和解密一遍
+        entry_data.update(plaintext)
+        return PasswordEntry.from_dict(entry_data)
     
     def delete_entry(self, entry_id: str) -> bool:
         """删除密码条目"""
-        entries = self.config['password_store'][self.user_id]['entries']
-        if entry_id not in entries:
+        entry_data = self.storage.get(self._entry_path(entry_id))
+        if entry_data is None:
             return False
             
-        del entries[entry_id]
-        save_config(self.config)
+        self._commit([(DELETE, self._entry_path(entry_id), None)], entry_id, None, changelog.REMOVE)
+        if entry_data.get('totp_secret'):
+            self._forget_totp(self.crypto.decrypt(entry_data['totp_secret']), entry_data)
         return True
     
-    def search_entries(self, query: str) -> List[PasswordEntry]:
-        """搜索密码条目"""
-        query = query.lower()
+    @staticmethod
+    def _forget_totp(secret: str, entry_data: dict):
+        """TOTP密钥被删除或更换后，丢弃缓存中它的预处理结果和代码"""
+        code_cache.forget(secret, entry_data.get('totp_digits', 6), entry_data.get('totp_interval', 30))
+    
+    def search_entries(self, query: str, limit: int = 50, offset: int = 0) -> Tuple[List[PasswordSummary], int]:
+        """
+        搜索密码条目（按标题、用户名和网址，不解密任何字段）
+        :return: (按相关度排序的当前页条目元数据, 匹配总数)
+        """
+        entry_ids, total = self._search_index().search(query, limit, offset)
         results = []
-        
-        for entry in self.get_all_entries():
-            if (query in entry.title.lower() or
-                (entry.username and query in entry.username.lower()) or
-                (entry.url and query in entry.url.lower())):
-                results.append(entry)
-        
-        return results
+        for entry_id in entry_ids:
+            summary = self.get_summary(entry_id)
+            if summary:
+                results.append(summary)
+        return results, total
+    
+    def changes_since(self, since: int) -> dict:
+        """
+        获取某个版本之后变化的条目
+        :return: {'version', 'resync', 'changes'}，新建和更新的条目附带元数据
+        """
+        result = changelog.changes_since(self.storage, self._store_path(), since)
+        for change in result['changes']:
+            if change['op'] != changelog.REMOVE:
+                summary = self.get_summary(change['id'])
+                change['entry'] = summary.to_dict() if summary else None
+        return result
+    
+    def match_url(self, url: str) -> Tuple[Optional[str], List[PasswordSummary]]:
+        """
+        查找与网址主机名相同的条目（不解密任何字段）
+        :return: (规范化的主机名, 条目元数据列表)
+        """
+        host, entry_ids = self._domain_index().lookup(url)
+        results = []
+        for entry_id in entry_ids:
+            summary = self.get_summary(entry_id)
+            if summary:
+                results.append(summary)
+        return host, results
     
     def decrypt_text(self, encrypted_text: str) -> str:
-        """解密文本"""
+        """解密文本（接受紧凑格式和旧格式的密文）"""
         try:
-            # 将 base64 编码的文本转换为字节
-            encrypted_bytes = base64.b64decode(encrypted_text)
-            # 解密
-            decrypted_bytes = self.crypto.decrypt(encrypted_bytes)
-            # 转换为字符串
-            return decrypted_bytes.decode('utf-8')
+            if not encrypted_text:
+                raise ValueError('empty ciphertext')
+            return self.crypto.decrypt(encrypted_text)
         except Exception as e:
             raise ValueError(f"Failed to decrypt text: {str(e)}")
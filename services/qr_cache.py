@@ -0,0 +1,69 @@
+import base64
+import hashlib
+import io
+import threading
+from collections import OrderedDict
+import qrcode
+
+
+def render_qr_png(data: str, box_size: int = 10, border: int = 5) -> bytes:
+    """把文本渲染成二维码 PNG"""
+    qr = qrcode.QRCode(version=1, box_size=box_size, border=border)
+    qr.add_data(data)
+    qr.make(fit=True)
+    img = qr.make_image(fill_color="black", back_color="white")
+    buffered = io.BytesIO()
+    img.save(buffered, format="PNG")
+    return buffered.getvalue()
+
+
+class QrCodeCache:
+    """
+    渲染好的二维码 PNG 的 LRU 缓存
+
+    以 provisioning URI 和渲染参数的哈希为键，缓存中不保存 URI 本身（其中包含密钥）。
+    同一输入渲染出的图片总是相同的，所以键哈希同时用作强 ETag。
+    """
+
+    def __init__(self, max_items: int = 256):
+        self.max_items = max_items
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(data: str, box_size: int, border: int) -> str:
+        return hashlib.sha256(f'{box_size}:{border}:{data}'.encode('utf-8')).hexdigest()[:32]
+
+    def render(self, data: str, box_size: int = 10, border: int = 5):
+        """
+        获取二维码 PNG
+        :return: (png_bytes, etag)
+        """
+        key = self._key(data, box_size, border)
+        with self._lock:
+            png = self._items.get(key)
+            if png is not None:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return png, key
+            self.misses += 1
+        png = render_qr_png(data, box_size, border)
+        with self._lock:
+            self._items[key] = png
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+        return png, key
+
+    def data_uri(self, data: str, box_size: int = 10, border: int = 5) -> str:
+        """获取二维码的 data URI（用于仍然内嵌图片的接口）"""
+        png, _ = self.render(data, box_size, border)
+        return 'data:image/png;base64,' + base64.b64encode(png).decode()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'items': len(self._items), 'hits': self.hits, 'misses': self.misses}
+
+
+qr_cache = QrCodeCache()
@@ -0,0 +1,220 @@
+import bisect
+import heapq
+import re
+import threading
+import time
+from collections import OrderedDict
+
+# 参与搜索的字段及其权重（只包含非加密字段）
+SEARCH_FIELDS = (('title', 3), ('username', 2), ('url', 1))
+
+_TOKEN_RE = re.compile(r'\w+')
+
+
+def tokenize(text: str) -> list:
+    """把文本切分为小写的词"""
+    return _TOKEN_RE.findall(text.lower()) if text else []
+
+
+def trigrams(term: str) -> set:
+    """词的所有三字母片段"""
+    return {term[i:i + 3] for i in range(len(term) - 2)}
+
+
+class SearchIndex:
+    """
+    密码条目元数据的内存搜索索引
+
+    词 -> {条目: 字段权重} 的倒排表，外加三字母片段 -> 词 的倒排表。
+    查询中的每个词先找到匹配的索引词：三个字符及以上时用三字母片段求交集再确认
+    子串匹配，更短的词按前缀在排序的词表上二分查找。所有查询词都匹配的条目才返回，
+    按匹配程度（完整词 > 词前缀 > 子串）乘以字段权重排序。
+
+    写请求在其它线程增量更新索引的同时可能有请求在搜索，所以读写都持有索引自己的锁。
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._docs = {}
+        self._titles = {}
+        self._postings = {}
+        self._trigrams = {}
+        self._vocabulary = []
+
+    def __len__(self):
+        return len(self._docs)
+
+    def add(self, doc_id: str, fields: dict):
+        """添加或替换一个条目"""
+        with self._lock:
+            self._add(doc_id, fields)
+
+    def _add(self, doc_id, fields):
+        if doc_id in self._docs:
+            self._remove(doc_id)
+        weights = {}
+        for field, weight in SEARCH_FIELDS:
+            for token in tokenize(fields.get(field) or ''):
+                if weight > weights.get(token, 0):
+                    weights[token] = weight
+        for token, weight in weights.items():
+            postings = self._postings.get(token)
+            if postings is None:
+                postings = self._postings[token] = {}
+                bisect.insort(self._vocabulary, token)
+                for gram in trigrams(token):
+                    self._trigrams.setdefault(gram, set()).add(token)
+            postings[doc_id] = weight
+        self._docs[doc_id] = tuple(weights)
+        self._titles[doc_id] = (fields.get('title') or '').lower()
+
+    def remove(self, doc_id: str):
+        """移除一个条目"""
+        with self._lock:
+            self._remove(doc_id)
+
+    def _remove(self, doc_id):
+        tokens = self._docs.pop(doc_id, None)
+        self._titles.pop(doc_id, None)
+        for token in tokens or ():
+            postings = self._postings[token]
+            postings.pop(doc_id, None)
+            if postings:
+                continue
+            del self._postings[token]
+            del self._vocabulary[bisect.bisect_left(self._vocabulary, token)]
+            for gram in trigrams(token):
+                grams = self._trigrams[gram]
+                grams.discard(token)
+                if not grams:
+                    del self._trigrams[gram]
+
+    def _matching_tokens(self, term: str):
+        """返回 [(索引词, 匹配程度)]：3 完整词，2 词前缀，1 子串"""
+        if len(term) < 3:
+            matches = []
+            index = bisect.bisect_left(self._vocabulary, term)
+            while index < len(self._vocabulary) and self._vocabulary[index].startswith(term):
+                token = self._vocabulary[index]
+                matches.append((token, 3 if token == term else 2))
+                index += 1
+            return matches
+        grams = sorted((self._trigrams.get(gram, ()) for gram in trigrams(term)), key=len)
+        if not grams[0]:
+            return []
+        candidates = set(grams[0]).intersection(*grams[1:])
+        return [(token, 3 if token == term else 2 if token.startswith(term) else 1)
+                for token in candidates if term in token]
+
+    def search(self, query: str, limit: int = 50, offset: int = 0):
+        """
+        搜索条目
+        :return: (当前页的条目 ID 列表, 匹配总数)
+        """
+        terms = tokenize(query)
+        if not terms:
+            return [], 0
+        with self._lock:
+            return self._search(terms, limit, offset)
+
+    def _search(self, terms, limit, offset):
+        scores = None
+        for term in set(terms):
+            term_scores = {}
+            for token, level in self._matching_tokens(term):
+                for doc_id, weight in self._postings[token].items():
+                    score = level * weight
+                    if score > term_scores.get(doc_id, 0):
+                        term_scores[doc_id] = score
+            if scores is None:
+                scores = term_scores
+            else:
+                scores = {doc_id: score + term_scores[doc_id]
+                          for doc_id, score in scores.items() if doc_id in term_scores}
+            if not scores:
+                return [], 0
+        titles = self._titles
+        page = heapq.nsmallest(offset + limit, scores, key=lambda doc_id: (-scores[doc_id], titles[doc_id]))
+        return page[offset:], len(scores)
+
+
+class IndexRegistry:
+    """
+    跨请求复用的内存索引
+
+    索引按键（例如 ('search', user_id)）缓存在一个有界的 LRU 中，并记录构建时
+    存储中的版本号。版本号不一致时重新构建；写操作可以在版本号连续时增量更新索引，
+    否则直接丢弃，下次使用时重建。
+    """
+
+    def __init__(self, max_indexes: int = 64):
+        self.max_indexes = max_indexes
+        self._indexes = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, version, build):
+        """
+        获取与 version 一致的索引
+        :param build: 无参数函数，返回新构建的索引
+        """
+        with self._lock:
+            cached = self._indexes.get(key)
+            if cached is not None and cached[0] == version:
+                self._indexes.move_to_end(key)
+                return cached[1]
+        index = build()
+        with self._lock:
+            self._indexes[key] = (version, index)
+            self._indexes.move_to_end(key)
+            while len(self._indexes) > self.max_indexes:
+                self._indexes.popitem(last=False)
+        return index
+
+    def update(self, key, old_version, new_version, apply):
+        """
+        增量更新索引
+        :param apply: 接收索引对象的函数
+        """
+        with self._lock:
+            cached = self._indexes.get(key)
+            if cached is None:
+                return
+            if cached[0] != old_version:
+                del self._indexes[key]
+                return
+            apply(cached[1])
+            self._indexes[key] = (new_version, cached[1])
+
+    def discard(self, key):
+        """丢弃一个索引"""
+        with self._lock:
+            self._indexes.pop(key, None)
+
+
+indexes = IndexRegistry()
+
+
+def _benchmark(entry_count=10000, queries=('user4217', 'gith 42', 'git', 'gi', 'mail user', 'example.com', 'zzz')):
+    """构建索引并测量搜索延迟"""
+    import random
+    words = ['github', 'gitlab', 'google', 'mail', 'bank', 'shop', 'cloud', 'example', 'server', 'router']
+    index = SearchIndex()
+    start = time.perf_counter()
+    for i in range(entry_count):
+        index.add(str(i), {
+            'title': f'{random.choice(words)} {random.choice(words)} {i}',
+            'username': f'user{i}@{random.choice(words)}.com',
+            'url': f'https://{random.choice(words)}.example.com/login',
+        })
+    print(f'build {entry_count} entries: {(time.perf_counter() - start) * 1000:.1f} ms')
+    for query in queries:
+        start = time.perf_counter()
+        rounds = 20
+        for _ in range(rounds):
+            ids, total = index.search(query, limit=50)
+        elapsed = (time.perf_counter() - start) / rounds * 1000
+        print(f'{query!r:16} {total:6} matches  {elapsed:8.3f} ms')
+
+
+if __name__ == '__main__':
+    _benchmark()
@@ -0,0 +1,164 @@
+import binascii
+import heapq
+import threading
+import time
+from collections import OrderedDict
+from services.totp_engine import engine as default_engine, decode_secret, key_fingerprint
+
+
+class TotpCodeCache:
+    """
+    按时间窗口缓存TOTP代码
+
+    缓存键为 (密钥指纹, interval, 时间步)，条目在所属时间窗口结束时过期，
+    因此无论有多少客户端在查看，每个密钥每个窗口最多只计算一次 HMAC。
+    可选的后台预热线程会在窗口切换前几秒为最近使用过的密钥预先计算下一个窗口的代码；
+    最近使用过的密钥只在预热线程运行时记录，最多 max_recent 个（LRU）。
+    """
+
+    def __init__(self, engine=default_engine, max_entries=100000, max_recent=4096):
+        self.engine = engine
+        self.max_entries = max_entries
+        self.max_recent = max_recent
+        self.hits = 0
+        self.misses = 0
+        self._codes = {}
+        self._expiry = []
+        self._recent = OrderedDict()
+        self._lock = threading.Lock()
+        self._warmer = None
+        self._stop = threading.Event()
+
+    def _evict(self, now):
+        while self._expiry and self._expiry[0][0] <= now:
+            _, cache_key = heapq.heappop(self._expiry)
+            self._codes.pop(cache_key, None)
+
+    def _store(self, cache_key, code, valid_until):
+        if valid_until <= time.time() or len(self._codes) >= self.max_entries:
+            return
+        if cache_key not in self._codes:
+            heapq.heappush(self._expiry, (valid_until, cache_key))
+        self._codes[cache_key] = code
+
+    def _remember(self, prepared):
+        recent_key = (prepared.fingerprint, prepared.interval)
+        self._recent[recent_key] = prepared
+        self._recent.move_to_end(recent_key)
+        while len(self._recent) > self.max_recent:
+            self._recent.popitem(last=False)
+
+    def forget(self, secret: str, digits: int = 6, interval: int = 30, algorithm: str = 'sha1'):
+        """丢弃一个密钥的预处理结果和缓存的代码（密钥被删除或更换后调用）"""
+        self.engine.forget(secret)
+        try:
+            fingerprint = key_fingerprint(decode_secret(secret), digits, algorithm)
+        except (binascii.Error, TypeError, AttributeError):
+            return
+        with self._lock:
+            self._recent.pop((fingerprint, int(interval or 30)), None)
+            for cache_key in [k for k in self._codes if k[0] == fingerprint]:
+                del self._codes[cache_key]
+
+    def code(self, prepared, for_time: float = None):
+        """
+        获取预处理过的密钥在指定时间的代码
+        :return: (code, valid_until)
+        """
+        now = time.time() if for_time is None else for_time
+        step = prepared.timecode(now)
+        valid_until = (step + 1) * prepared.interval
+        cache_key = (prepared.fingerprint, prepared.interval, step)
+        with self._lock:
+            self._evict(time.time())
+            if self._warmer is not None:
+                self._remember(prepared)
+            code = self._codes.get(cache_key)
+            if code is not None:
+                self.hits += 1
+                return code, valid_until
+            self.misses += 1
+        code = prepared.code_for(step)
+        with self._lock:
+            self._store(cache_key, code, valid_until)
+        return code, valid_until
+
+    def batch_codes(self, items, for_time: float = None) -> dict:
+        """
+        计算一组密钥的当前代码（结果格式与 TotpEngine.batch_codes 相同）
+        :param items: 可迭代的 (item_id, secret, digits, interval, algorithm)
+        """
+        now = time.time() if for_time is None else for_time
+        codes = {}
+        for item_id, secret, digits, interval, algorithm in items:
+            try:
+                prepared = self.engine.prepare(secret, digits, interval, algorithm)
+            except ValueError:
+                continue
+            code, valid_until = self.code(prepared, now)
+            codes[item_id] = {
+                'code': code,
+                'digits': prepared.digits,
+                'interval': prepared.interval,
+                'valid_until': valid_until
+            }
+        return codes
+
+    def warm(self, lead: float = 3):
+        """为即将在 lead 秒内切换窗口的最近使用的密钥预先计算下一个窗口的代码"""
+        now = time.time()
+        with self._lock:
+            due = []
+            for recent_key, prepared in list(self._recent.items()):
+                boundary = (int(now) // prepared.interval + 1) * prepared.interval
+                if boundary - now <= lead + 0.5:
+                    due.append(prepared)
+                    del self._recent[recent_key]
+        for prepared in due:
+            step = (int(now) // prepared.interval) + 1
+            code = prepared.code_for(step)
+            with self._lock:
+                self._store((prepared.fingerprint, prepared.interval, step), code,
+                            (step + 1) * prepared.interval)
+        return len(due)
+
+    def _next_warm_time(self, now, lead):
+        with self._lock:
+            intervals = {interval for _, interval in self._recent} or {30}
+        times = []
+        for interval in intervals:
+            boundary = (int(now) // interval + 1) * interval
+            times.append(boundary - lead if boundary - lead > now else boundary + interval - lead)
+        return min(times)
+
+    def _warm_loop(self, lead):
+        while not self._stop.is_set():
+            now = time.time()
+            if self._stop.wait(max(self._next_warm_time(now, lead) - now, 0.05)):
+                break
+            self.warm(lead)
+
+    def start_warmer(self, lead: float = 3):
+        """启动后台预热线程"""
+        if self._warmer is not None and self._warmer.is_alive():
+            return
+        self._stop.clear()
+        with self._lock:
+            self._warmer = threading.Thread(target=self._warm_loop, args=(lead,), name='totp-cache-warmer',
+                                            daemon=True)
+        self._warmer.start()
+
+    def stop_warmer(self):
+        """停止后台预热线程"""
+        self._stop.set()
+        with self._lock:
+            self._warmer = None
+            self._recent.clear()
+
+    def stats(self) -> dict:
+        """缓存统计信息"""
+        with self._lock:
+            return {'entries': len(self._codes), 'hits': self.hits, 'misses': self.misses}
+
+
+code_cache = TotpCodeCache()
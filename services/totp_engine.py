@@ -0,0 +1,222 @@
+import base64
+import binascii
+import hashlib
+import hmac
+import threading
+import time
+from collections import OrderedDict
+
+DIGESTS = {
+    'sha1': hashlib.sha1,
+    'sha256': hashlib.sha256,
+    'sha512': hashlib.sha512,
+}
+
+
+def decode_secret(secret: str) -> bytes:
+    """解码 base32 密钥（与 pyotp 一致：忽略大小写、自动补齐填充）"""
+    secret = secret.replace(' ', '')
+    missing_padding = len(secret) % 8
+    if missing_padding:
+        secret += '=' * (8 - missing_padding)
+    return base64.b32decode(secret, casefold=True)
+
+
+def key_fingerprint(key: bytes, digits: int = 6, algorithm: str = 'sha1') -> str:
+    """用于缓存等场景的密钥标识，不包含密钥本身"""
+    return hashlib.sha256(b'%s:%d:%s' % (key, int(digits or 6), (algorithm or 'sha1').lower().encode())).hexdigest()[:32]
+
+
+class PreparedKey:
+    """
+    预处理过的TOTP密钥
+
+    base32 解码和 HMAC 密钥初始化只做一次，之后每个时间步只需复制
+    已初始化的 HMAC 状态再计算一次摘要。
+    """
+    __slots__ = ('digits', 'interval', 'algorithm', 'fingerprint', '_mac', '_modulus')
+
+    def __init__(self, secret: str, digits: int = 6, interval: int = 30, algorithm: str = 'sha1'):
+        algorithm = (algorithm or 'sha1').lower()
+        if algorithm not in DIGESTS:
+            raise ValueError(f'Unsupported TOTP algorithm: {algorithm}')
+        self.digits = int(digits or 6)
+        self.interval = int(interval or 30)
+        self.algorithm = algorithm
+        key = decode_secret(secret)
+        self._mac = hmac.new(key, digestmod=DIGESTS[algorithm])
+        self._modulus = 10 ** self.digits
+        self.fingerprint = key_fingerprint(key, self.digits, algorithm)
+
+    def timecode(self, for_time: float) -> int:
+        """时间对应的时间步"""
+        return int(for_time) // self.interval
+
+    def code_for(self, counter: int) -> str:
+        """计算指定时间步的代码"""
+        mac = self._mac.copy()
+        mac.update(counter.to_bytes(8, 'big'))
+        digest = mac.digest()
+        offset = digest[-1] & 0x0f
+        binary = int.from_bytes(digest[offset:offset + 4], 'big') & 0x7fffffff
+        return str(binary % self._modulus).zfill(self.digits)
+
+    def at(self, for_time: float) -> str:
+        """计算指定时间的代码"""
+        return self.code_for(self.timecode(for_time))
+
+    def now(self) -> str:
+        """计算当前代码"""
+        return self.at(time.time())
+
+    def valid_until(self, for_time: float) -> int:
+        """指定时间所在时间窗口的结束时间"""
+        return (self.timecode(for_time) + 1) * self.interval
+
+    def verify(self, code, for_time: float = None, valid_window: int = 0) -> bool:
+        """验证代码，允许前后 valid_window 个时间步的偏差"""
+        code = str(code or '').strip()
+        if len(code) != self.digits:
+            return False
+        counter = self.timecode(time.time() if for_time is None else for_time)
+        return any(
+            hmac.compare_digest(code, self.code_for(counter + offset))
+            for offset in range(-valid_window, valid_window + 1)
+        )
+
+
+class TotpEngine:
+    """
+    批量TOTP计算引擎
+
+    预处理过的密钥按 (secret, digits, interval, algorithm) 缓存在一个有界的
+    LRU 中，跨请求复用。
+    """
+
+    def __init__(self, max_keys: int = 4096):
+        self.max_keys = max_keys
+        self._keys = OrderedDict()
+        self._lock = threading.Lock()
+
+    def prepare(self, secret: str, digits: int = 6, interval: int = 30, algorithm: str = 'sha1') -> PreparedKey:
+        """获取预处理过的密钥"""
+        cache_key = (secret, int(digits or 6), int(interval or 30), (algorithm or 'sha1').lower())
+        with self._lock:
+            prepared = self._keys.get(cache_key)
+            if prepared is not None:
+                self._keys.move_to_end(cache_key)
+                return prepared
+        try:
+            prepared = PreparedKey(*cache_key)
+        except (binascii.Error, TypeError, AttributeError) as e:
+            raise ValueError(f'Invalid TOTP secret: {e}')
+        with self._lock:
+            self._keys[cache_key] = prepared
+            while len(self._keys) > self.max_keys:
+                self._keys.popitem(last=False)
+        return prepared
+
+    def forget(self, secret: str):
+        """丢弃一个密钥的所有预处理结果（密钥被删除或更换后调用）"""
+        with self._lock:
+            for cache_key in [k for k in self._keys if k[0] == secret]:
+                del self._keys[cache_key]
+
+    def code(self, secret: str, for_time: float = None, digits: int = 6, interval: int = 30,
+             algorithm: str = 'sha1') -> str:
+        """计算单个密钥的代码"""
+        prepared = self.prepare(secret, digits, interval, algorithm)
+        return prepared.at(time.time() if for_time is None else for_time)
+
+    def verify(self, secret: str, code, for_time: float = None, digits: int = 6, interval: int = 30,
+               algorithm: str = 'sha1', valid_window: int = 0) -> bool:
+        """验证代码，密钥无效时返回 False"""
+        try:
+            prepared = self.prepare(secret, digits, interval, algorithm)
+        except ValueError:
+            return False
+        return prepared.verify(code, for_time, valid_window)
+
+    def compute(self, prepared_keys, for_times) -> list:
+        """
+        一次计算多个密钥在多个时间点的代码
+        :return: 二维列表，result[i][j] 为第 i 个密钥在第 j 个时间点的代码
+        """
+        return [[key.at(for_time) for for_time in for_times] for key in prepared_keys]
+
+    def batch_codes(self, items, for_time: float = None) -> dict:
+        """
+        计算一组密钥的当前代码
+        :param items: 可迭代的 (item_id, secret, digits, interval, algorithm)
+        :return: {item_id: {'code', 'digits', 'interval', 'valid_until'}}，无效的密钥会被跳过
+        """
+        now = time.time() if for_time is None else for_time
+        codes = {}
+        for item_id, secret, digits, interval, algorithm in items:
+            try:
+                prepared = self.prepare(secret, digits, interval, algorithm)
+            except ValueError:
+                continue
+            codes[item_id] = {
+                'code': prepared.at(now),
+                'digits': prepared.digits,
+                'interval': prepared.interval,
+                'valid_until': prepared.valid_until(now)
+            }
+        return codes
+
+
+engine = TotpEngine()
+
+
+def _check_against_pyotp(rounds=200):
+    """与 pyotp 的结果逐一对比"""
+    import random
+    import pyotp
+    for i in range(rounds):
+        length = random.choice([16, 26, 32, 40])
+        secret = ''.join(random.choice('ABCDEFGHIJKLMNOPQRSTUVWXYZ234567') for _ in range(length))
+        digits = random.choice([6, 7, 8])
+        interval = random.choice([15, 30, 60])
+        algorithm = random.choice(list(DIGESTS))
+        for_time = random.randint(0, 2 ** 32)
+        expected = pyotp.TOTP(secret, digits=digits, interval=interval,
+                              digest=DIGESTS[algorithm]).at(for_time)
+        actual = engine.code(secret, for_time, digits, interval, algorithm)
+        assert actual == expected, (secret, digits, interval, algorithm, for_time, actual, expected)
+    print(f'Checked {rounds} random keys against pyotp: OK')
+
+
+def _benchmark(key_count=1000, steps=10):
+    """比较引擎与 pyotp 的吞吐量（keys/second）"""
+    import pyotp
+    secrets = [pyotp.random_base32() for _ in range(key_count)]
+    now = time.time()
+    times = [now + 30 * i for i in range(steps)]
+
+    start = time.perf_counter()
+    for secret in secrets:
+        totp = pyotp.TOTP(secret)
+        for for_time in times:
+            totp.at(for_time)
+    pyotp_rate = key_count * steps / (time.perf_counter() - start)
+
+    cold = TotpEngine(max_keys=key_count)
+    start = time.perf_counter()
+    prepared = [cold.prepare(secret) for secret in secrets]
+    cold.compute(prepared, times)
+    cold_rate = key_count * steps / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    cold.compute([cold.prepare(secret) for secret in secrets], times)
+    warm_rate = key_count * steps / (time.perf_counter() - start)
+
+    print(f'{key_count} keys x {steps} time steps')
+    print(f'pyotp:               {pyotp_rate:12,.0f} codes/s')
+    print(f'engine (cold cache): {cold_rate:12,.0f} codes/s')
+    print(f'engine (warm cache): {warm_rate:12,.0f} codes/s')
+
+
+if __name__ == '__main__':
+    _check_against_pyotp()
+    _benchmark()
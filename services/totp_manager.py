@@ -2,34 +2,76 @@ import json
 import os
 from datetime import datetime
 import uuid
-from utils.config import load_config, save_config
+from utils.config import get_storage
+from utils.journal import SET, DELETE
+from utils.pagination import PAGE_SIZE, paginate
+from services import changelog
+from services.totp_cache import code_cache
+
+def key_metadata(key):
+    """密钥的元数据（不包含密钥本身）"""
+    return {
+        'id': key['id'],
+        'name': key.get('name'),
+        'issuer': key.get('issuer'),
+        'digits': key.get('digits'),
+        'interval': key.get('interval')
+    }
+
+def _forget_codes(key):
+    """密钥被删除或更换后，丢弃缓存中它的预处理结果和代码"""
+    if key.get('secret'):
+        code_cache.forget(key['secret'], key.get('digits'), key.get('interval'), key.get('algorithm'))
 
 class TotpManager:
     def __init__(self, user_id):
         self.user_id = user_id
-        self.config = load_config()
-        self._ensure_totp_store()
+        self.storage = get_storage()
+
+    def _key_path(self, *parts):
+        """用户TOTP密钥在存储中的路径"""
+        return ('totp_store', self.user_id, 'keys') + parts
 
-    def _ensure_totp_store(self):
-        """确保TOTP密钥存储相关的配置存在"""
-        if 'totp_store' not in self.config:
-            self.config['totp_store'] = {}
-        if self.user_id not in self.config['totp_store']:
-            self.config['totp_store'][self.user_id] = {
-                'keys': {}
-            }
-            save_config(self.config)
+    def _store_path(self):
+        """用户TOTP存储在存储中的路径"""
+        return ('totp_store', self.user_id)
+
+    def _commit(self, changes, key_id, op):
+        """应用密钥的变更，递增版本号并记录变更日志"""
+        changelog.commit(self.storage, self._store_path(), changes, key_id, op)
 
     def get_all_keys(self):
         """获取所有TOTP密钥"""
         return [
             {**key, 'id': key_id}
-            for key_id, key in self.config['totp_store'][self.user_id]['keys'].items()
+            for key_id, key in self.storage.peek(self._key_path(), {}).items()
         ]
 
+    def list_page(self, cursor=None, limit=PAGE_SIZE, sort='name', query=None):
+        """
+        按游标分页获取TOTP密钥
+        :param sort: 'name' 按名称升序，'updated' 按更新时间降序
+        :param query: 只返回名称或发行方包含该文本的密钥
+        :return: (当前页的密钥列表, 下一页的游标)
+        :raises ValueError: 排序方式或游标无效
+        """
+        if sort == 'name':
+            sort_key, reverse = (lambda item: ((item[1].get('name') or '').lower(), item[0])), False
+        elif sort == 'updated':
+            sort_key, reverse = (lambda item: (str(item[1].get('updated_at') or ''), item[0])), True
+        else:
+            raise ValueError(f'Unknown sort: {sort}')
+        keys = self.storage.peek(self._key_path(), {}).items()
+        if query:
+            query = query.lower()
+            keys = [item for item in keys
+                    if query in (item[1].get('name') or '').lower() or query in (item[1].get('issuer') or '').lower()]
+        page, next_cursor = paginate(keys, sort_key, sort, cursor, limit, reverse)
+        return [{**data, 'id': key_id} for key_id, data in page], next_cursor
+
     def get_key(self, key_id):
         """获取指定的TOTP密钥"""
-        key = self.config['totp_store'][self.user_id]['keys'].get(key_id)
+        key = self.storage.get(self._key_path(key_id))
         if key:
             return {**key, 'id': key_id}
         return None
@@ -49,18 +91,17 @@ class TotpManager:
             'updated_at': now.isoformat()
         }
         
-        self.config['totp_store'][self.user_id]['keys'][key_id] = key
-        save_config(self.config)
+        self._commit([(SET, self._key_path(key_id), key)], key_id, changelog.CREATE)
         
         return {**key, 'id': key_id}
 
     def update_key(self, key_id, name, secret=None, issuer=None, digits=None, interval=None):
         """更新TOTP密钥"""
-        keys = self.config['totp_store'][self.user_id]['keys']
-        if key_id not in keys:
+        key = self.storage.get(self._key_path(key_id))
+        if key is None:
             return None
+        old_key = dict(key)
         
-        key = keys[key_id]
         key['name'] = name
         if secret:
             key['secret'] = secret
@@ -72,15 +113,29 @@ class TotpManager:
             key['interval'] = interval
         key['updated_at'] = datetime.utcnow().isoformat()
         
-        save_config(self.config)
+        self._commit([(SET, self._key_path(key_id), key)], key_id, changelog.UPDATE)
+        if any(key.get(field) != old_key.get(field) for field in ('secret', 'digits', 'interval')):
+            _forget_codes(old_key)
         return {**key, 'id': key_id}
 
     def delete_key(self, key_id):
         """删除TOTP密钥"""
-        keys = self.config['totp_store'][self.user_id]['keys']
-        if key_id not in keys:
+        key = self.storage.get(self._key_path(key_id))
+        if key is None:
             return False
         
-        del keys[key_id]
-        save_config(self.config)
+        self._commit([(DELETE, self._key_path(key_id), None)], key_id, changelog.REMOVE)
+        _forget_codes(key)
         return True
+
+    def changes_since(self, since):
+        """
+        获取某个版本之后变化的密钥
+        :return: {'version', 'resync', 'changes'}，新建和更新的密钥附带元数据（不包含密钥本身）
+        """
+        result = changelog.changes_since(self.storage, self._store_path(), since)
+        for change in result['changes']:
+            if change['op'] != changelog.REMOVE:
+                key = self.storage.peek(self._key_path(change['id']))
+                change['key'] = key_metadata({**key, 'id': change['id']}) if key else None
+        return result
@@ -0,0 +1,44 @@
+import json
+import os
+import time
+from services.totp_cache import code_cache
+
+
+class TotpBroadcaster:
+    """
+    通过 Server-Sent Events 推送TOTP代码
+
+    每次连接推送一次全部代码后立即结束响应，并用 SSE 的 retry 字段让浏览器的
+    EventSource 恰好在最早的时间窗口切换时重新连接。这样每个打开的页面每个窗口
+    只产生一次很短的请求，等待期间不占用任何 worker 线程（同步 WSGI worker 中
+    长时间保持的流会一直占用一个线程）。
+    """
+
+    def __init__(self, cache=code_cache, rollover_delay_ms=50, min_retry_ms=500):
+        """
+        :param rollover_delay_ms: 在窗口切换之后多久重连，避免重连时仍是旧窗口
+        :param min_retry_ms: 重连间隔的下限
+        """
+        self.cache = cache
+        self.rollover_delay_ms = rollover_delay_ms
+        self.min_retry_ms = min_retry_ms
+
+    @staticmethod
+    def _event(name, data) -> str:
+        return f'event: {name}\ndata: {json.dumps(data)}\n\n'
+
+    def push(self, load_items, now: float = None) -> str:
+        """
+        生成一次 SSE 响应：重连间隔和全部当前代码
+        :param load_items: 返回 (item_id, secret, digits, interval, algorithm) 列表的函数
+        """
+        now = time.time() if now is None else now
+        codes = self.cache.batch_codes(load_items(), now)
+        next_rollover = min((info['valid_until'] for info in codes.values()), default=now + 30)
+        retry = max(int((next_rollover - now) * 1000) + self.rollover_delay_ms, self.min_retry_ms)
+        return f'retry: {retry}\n\n' + self._event('codes', {'codes': codes, 'full': True})
+
+
+broadcaster = TotpBroadcaster(
+    rollover_delay_ms=int(os.environ.get('TOTP_STREAM_DELAY_MS', 50))
+)
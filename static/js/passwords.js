@@ -1,6 +1,6 @@
 // 全局变量
 let currentGroupId = null;
-let totpIntervals = {};
+let totpRefreshTimer = null;
 
 // 页面加载完成后执行
 document.addEventListener('DOMContentLoaded', () => {
@@ -140,6 +140,11 @@ async function loadPasswordEntries(groupId) {
             const card = createPasswordCard(entry);
             passwordList.appendChild(card);
         });
+
+        // 所有启用了TOTP的卡片共用一次请求
+        if (entries.some(entry => entry.have_totp)) {
+            updateTOTPCodes();
+        }
     } catch (error) {
         console.error('Error loading password entries:', error);
         showAlert('error', t('passwords.load_entries_error'));
@@ -202,43 +207,39 @@ function createPasswordCard(entry) {
     card.querySelector('.edit-password').addEventListener('click', () => editPassword(entry));
     card.querySelector('.delete-password').addEventListener('click', () => deletePassword(entry.id));
 
-    // 如果启用了TOTP，开始更新TOTP代码
-    if (entry.have_totp) {
-        updateTOTPCode(entry.id);
-    }
-
     return card;
 }
 
-// 更新TOTP代码
-async function updateTOTPCode(entryId) {
+// 更新所有TOTP代码（一次请求获取全部条目的代码）
+async function updateTOTPCodes() {
+    clearTimeout(totpRefreshTimer);
     try {
-        const response = await fetch(`/api/password-groups/${currentGroupId}/entries/${entryId}/totp`);
-        if (!response.ok) throw new Error('Failed to get TOTP code');
+        const response = await fetch('/passwords/totp_codes');
+        if (!response.ok) throw new Error('Failed to get TOTP codes');
         
         const data = await response.json();
-        const codeElement = document.getElementById(`totp-${entryId}`);
-        const progressElement = document.getElementById(`totp-progress-${entryId}`);
-        
-        if (codeElement && progressElement) {
-            codeElement.textContent = data.code;
+        const now = Date.now() / 1000;
+        let validUntil = Infinity;
+
+        Object.entries(data.codes).forEach(([entryId, info]) => {
+            const codeElement = document.getElementById(`totp-${entryId}`);
+            const progressElement = document.getElementById(`totp-progress-${entryId}`);
+            if (!codeElement || !progressElement) return;
+
+            codeElement.textContent = info.code;
             
             // 更新进度条
-            const percentage = (data.remaining_seconds / data.interval) * 100;
+            const percentage = ((info.valid_until - now) / info.interval) * 100;
             progressElement.style.width = `${percentage}%`;
+            validUntil = Math.min(validUntil, info.valid_until);
+        });
 
-            // 清除之前的定时器
-            if (totpIntervals[entryId]) {
-                clearInterval(totpIntervals[entryId]);
-            }
-
-            // 设置新的定时器
-            totpIntervals[entryId] = setInterval(() => {
-                updateTOTPCode(entryId);
-            }, data.remaining_seconds * 1000);
+        // 在最早的代码过期时再次刷新
+        if (validUntil !== Infinity) {
+            totpRefreshTimer = setTimeout(updateTOTPCodes, Math.max(validUntil - now, 1) * 1000);
         }
     } catch (error) {
-        console.error('Error updating TOTP code:', error);
+        console.error('Error updating TOTP codes:', error);
     }
 }
 
@@ -517,6 +518,6 @@ function escapeHtml(unsafe) {
 
 // 清理资源
 window.addEventListener('beforeunload', () => {
-    // 清除所有TOTP更新定时器
-    Object.values(totpIntervals).forEach(interval => clearInterval(interval));
+    // 清除TOTP更新定时器
+    clearTimeout(totpRefreshTimer);
 });
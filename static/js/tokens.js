@@ -1,4 +1,5 @@
 let updateInterval;
+let tokensValidUntil = 0;
 let currentDetailToken = null;
 
 function showCopyFeedback(button, success) {
@@ -47,9 +48,15 @@ function updateTimerProgress(element, secondsRemaining) {
 }
 
 function updateTokens() {
+    tokensValidUntil = Infinity;
     fetch('/api/tokens')
         .then(response => response.json())
         .then(data => {
+            const now = Date.now() / 1000;
+            // 代码在最早过期的令牌到期前不会变化，到期后再重新获取
+            tokensValidUntil = data.tokens.reduce(
+                (earliest, token) => Math.min(earliest, now + token.seconds_remaining), now + 30);
+
             const tokenList = document.querySelector('.token-list ul');
             if (!tokenList) return;
 
@@ -119,6 +126,7 @@ function updateTokens() {
 
                 // 更新圆形进度条
                 const timerContainer = li.querySelector('.timer-container');
+                timerContainer.dataset.validUntil = now + token.seconds_remaining;
                 updateTimerProgress(timerContainer.parentElement, token.seconds_remaining);
 
                 tokenList.appendChild(li);
@@ -130,6 +138,7 @@ function updateTokens() {
                 if (token) {
                     document.getElementById('detail-current-code').textContent = token.current_code;
                     const timerContainer = document.querySelector('#token-details-modal .timer-container');
+                    timerContainer.dataset.validUntil = now + token.seconds_remaining;
                     updateTimerProgress(timerContainer.parentElement, token.seconds_remaining);
                 }
             }
@@ -143,9 +152,23 @@ function updateTokens() {
         })
         .catch(error => {
             console.error('Error:', error);
+            tokensValidUntil = Date.now() / 1000 + 5;
         });
 }
 
+// 每秒在本地更新倒计时，只在代码过期时请求服务器
+function tickTokens() {
+    const now = Date.now() / 1000;
+    if (now >= tokensValidUntil) {
+        updateTokens();
+        return;
+    }
+    document.querySelectorAll('.timer-container[data-valid-until]').forEach(timerContainer => {
+        const remaining = Math.max(0, Math.ceil(parseFloat(timerContainer.dataset.validUntil) - now));
+        updateTimerProgress(timerContainer.parentElement, remaining);
+    });
+}
+
 async function showTokenDetails(tokenName) {
     try {
         const response = await fetch(`/api/token_details/${tokenName}`);
@@ -162,6 +185,7 @@ async function showTokenDetails(tokenName) {
             
             // 更新计时器
             const timerContainer = document.querySelector('#token-details-modal .timer-container');
+            timerContainer.dataset.validUntil = Date.now() / 1000 + data.seconds_remaining;
             updateTimerProgress(timerContainer.parentElement, data.seconds_remaining);
             
             // 显示模态框
@@ -230,5 +254,5 @@ document.addEventListener('keydown', function(event) {
 // 页面加载时启动更新
 document.addEventListener('DOMContentLoaded', () => {
     updateTokens();
-    updateInterval = setInterval(updateTokens, 1000);
+    updateInterval = setInterval(tickTokens, 1000);
 });
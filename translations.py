@@ -8,7 +8,8 @@ translations = {
             'invalid_credentials': 'Invalid username or password',
             'invalid_2fa': 'Invalid 2FA code',
             '2fa_code': '2FA Code',
-            'placeholder_2fa': 'Enter your 6-digit code'
+            'placeholder_2fa': 'Enter your 6-digit code',
+            'too_many_attempts': 'Too many failed login attempts. Please try again in {seconds} seconds'
         },
         'dashboard': {
             'title': '2FA Web Management',
@@ -79,6 +80,7 @@ translations = {
             'new_title': 'New Credential',
             'search_placeholder': 'Search credentials...',
             'no_entries': 'No credential entries found. Click "Add New Credential" to create one.',
+            'load_more': 'Load more',
             'no_search_results': 'No matching entries found.',
             'last_updated': 'Last Updated',
             'created_at': 'Created At',
@@ -104,6 +106,7 @@ translations = {
             'delete_confirm': 'Are you sure you want to delete this TOTP key?',
             'issuer': 'Issuer',
             'no_entries': 'No TOTP keys found. Click "Add New Key" to create one.',
+            'load_more': 'Load more',
             'qr_code': 'QR Code',
             'create_success': 'TOTP key created successfully',
             'create_error': 'Failed to create TOTP key',
@@ -200,7 +203,8 @@ translations = {
             'invalid_credentials': '用户名或密码错误',
             'invalid_2fa': '2FA验证码错误',
             '2fa_code': '2FA验证码',
-            'placeholder_2fa': '请输入6位验证码'
+            'placeholder_2fa': '请输入6位验证码',
+            'too_many_attempts': '登录失败次数过多，请在 {seconds} 秒后重试'
         },
         'dashboard': {
             'title': '2FA网页管理系统',
@@ -271,6 +275,7 @@ translations = {
             'new_title': '新建凭据',
             'search_placeholder': '搜索凭据...',
             'no_entries': '未找到凭据条目。点击"添加新凭据"创建一个。',
+            'load_more': '加载更多',
             'no_search_results': '未找到匹配的条目。',
             'last_updated': '最后更新',
             'created_at': '创建时间',
@@ -290,6 +295,7 @@ translations = {
             'delete_confirm': '确定要删除这个TOTP密钥吗？',
             'issuer': '发行方',
             'no_entries': '没有找到TOTP密钥。点击"添加新密钥"创建一个。',
+            'load_more': '加载更多',
             'qr_code': '二维码',
             'create_success': 'TOTP密钥创建成功',
             'create_error': '创建TOTP密钥失败',
@@ -1,11 +1,14 @@
 from .auth import login_required
-from .config import load_config, save_config
+from .config import get_storage, load_config, load_config_view, save_config, update_config
 from .login_limit import check_login_limit, record_login_attempt, get_remaining_attempts
 
 __all__ = [
     'login_required',
+    'get_storage',
     'load_config',
+    'load_config_view',
     'save_config',
+    'update_config',
     'check_login_limit',
     'record_login_attempt',
     'get_remaining_attempts'
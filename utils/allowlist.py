@@ -0,0 +1,167 @@
+import bisect
+import ipaddress
+import re
+import threading
+
+
+class HostMatcher:
+    """
+    预编译的主机名允许列表
+
+    不含通配符的主机名放在集合中，一次查找；通配符模式（* 匹配一个标签，
+    例如 *.example.com 或 api-*.example.com）按反转的标签建立前缀树，
+    匹配时沿主机名的标签从右到左走一遍，与模式数量无关。
+    """
+
+    def __init__(self, patterns):
+        self.allow_all = False
+        self._exact = set()
+        self._trie = {}
+        for pattern in patterns:
+            pattern = str(pattern).strip().lower().rstrip('.')
+            if not pattern:
+                continue
+            if pattern == '0.0.0.0':
+                self.allow_all = True
+            elif '*' in pattern:
+                self._add_wildcard(pattern)
+            else:
+                self._exact.add(pattern)
+
+    def _add_wildcard(self, pattern):
+        node = self._trie
+        for label in reversed(pattern.split('.')):
+            if label == '*' or '*' not in label:
+                node = node.setdefault('labels', {}).setdefault(label, {})
+                continue
+            # 标签内的部分通配符，例如 api-*
+            regex = re.compile('^' + re.escape(label).replace('\\*', '[^.]+') + '$')
+            for existing, child in node.setdefault('partial', []):
+                if existing.pattern == regex.pattern:
+                    node = child
+                    break
+            else:
+                child = {}
+                node['partial'].append((regex, child))
+                node = child
+        node['end'] = True
+
+    def _match(self, node, labels, index):
+        if index < 0:
+            return node.get('end', False)
+        label = labels[index]
+        children = node.get('labels', {})
+        for key in (label, '*'):
+            child = children.get(key)
+            if child is not None and self._match(child, labels, index - 1):
+                return True
+        for regex, child in node.get('partial', ()):
+            if regex.match(label) and self._match(child, labels, index - 1):
+                return True
+        return False
+
+    def __contains__(self, host):
+        if self.allow_all:
+            return True
+        host = (host or '').lower().rstrip('.')
+        if host in self._exact:
+            return True
+        if not self._trie or not host:
+            return False
+        labels = host.split('.')
+        return self._match(self._trie, labels, len(labels) - 1)
+
+
+class IpMatcher:
+    """
+    预编译的 IP 允许列表
+
+    单个地址和 CIDR 网段都转换为整数区间，按版本（IPv4/IPv6）分别排序并合并重叠的区间，
+    匹配时对区间起点二分查找，一次比较即可确定，与网段数量无关。无效的条目被忽略。
+    """
+
+    def __init__(self, entries):
+        ranges = {4: [], 6: []}
+        for entry in entries:
+            try:
+                network = ipaddress.ip_network(str(entry).strip(), strict=False)
+            except ValueError:
+                continue
+            ranges[network.version].append((int(network.network_address), int(network.broadcast_address)))
+        self._starts = {}
+        self._ends = {}
+        for version, intervals in ranges.items():
+            merged = []
+            for start, end in sorted(intervals):
+                if merged and start <= merged[-1][1] + 1:
+                    merged[-1][1] = max(merged[-1][1], end)
+                else:
+                    merged.append([start, end])
+            self._starts[version] = [start for start, _ in merged]
+            self._ends[version] = [end for _, end in merged]
+
+    def __contains__(self, ip):
+        try:
+            address = ipaddress.ip_address(ip)
+        except ValueError:
+            return False
+        if address.version == 6 and address.ipv4_mapped is not None:
+            address = address.ipv4_mapped
+        value = int(address)
+        starts = self._starts[address.version]
+        index = bisect.bisect_right(starts, value) - 1
+        return index >= 0 and value <= self._ends[address.version][index]
+
+
+class MatcherCache:
+    """
+    按允许列表内容缓存编译好的匹配器
+
+    以列表内容（元组）为键：内容不变时复用匹配器，即使配置读取返回的是新的列表对象；
+    内容改变（包括原地修改）时重新编译。
+    """
+
+    def __init__(self, factory):
+        self.factory = factory
+        self._cached = (None, None)
+        self._lock = threading.Lock()
+
+    def get(self, entries):
+        key = tuple(entries or ())
+        source, matcher = self._cached
+        if source == key:
+            return matcher
+        matcher = self.factory(key)
+        with self._lock:
+            self._cached = (key, matcher)
+        return matcher
+
+
+host_matchers = MatcherCache(HostMatcher)
+ip_matchers = MatcherCache(IpMatcher)
+
+
+def _benchmark(range_count=5000, lookups=100000):
+    """编译大量网段并测量每次匹配的耗时"""
+    import random
+    import time
+    entries = [f'10.{random.randrange(256)}.{random.randrange(256)}.0/24' for _ in range(range_count)]
+    entries += [f'2001:db8:{random.randrange(65536):x}::/48' for _ in range(range_count)]
+    start = time.perf_counter()
+    matcher = IpMatcher(entries)
+    print(f'compile {len(entries)} ranges: {(time.perf_counter() - start) * 1000:.1f} ms')
+    addresses = [f'10.{random.randrange(256)}.{random.randrange(256)}.1' for _ in range(lookups)]
+    start = time.perf_counter()
+    hits = sum(1 for address in addresses if address in matcher)
+    elapsed = time.perf_counter() - start
+    print(f'{lookups} lookups ({hits} hits): {elapsed / lookups * 1e6:.2f} us per lookup')
+
+    hosts = HostMatcher([f'*.tenant{i}.example.com' for i in range(range_count)] + ['app-*.example.org'])
+    start = time.perf_counter()
+    for i in range(lookups):
+        f'api.tenant{i % (range_count * 2)}.example.com' in hosts
+    print(f'{lookups} host lookups: {(time.perf_counter() - start) / lookups * 1e6:.2f} us per lookup')
+
+
+if __name__ == '__main__':
+    _benchmark()
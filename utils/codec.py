@@ -0,0 +1,230 @@
+import json
+import struct
+import zlib
+from datetime import date, datetime
+import yaml
+
+# YAML 会把时间戳解析成 datetime/date，JSON 中用带标记的对象保存以便原样还原
+_DATETIME_TAG = '__datetime__'
+_DATE_TAG = '__date__'
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return {_DATETIME_TAG: value.isoformat()}
+    if isinstance(value, date):
+        return {_DATE_TAG: value.isoformat()}
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+
+def _json_object_hook(obj):
+    if len(obj) == 1:
+        if _DATETIME_TAG in obj:
+            return datetime.fromisoformat(obj[_DATETIME_TAG])
+        if _DATE_TAG in obj:
+            return date.fromisoformat(obj[_DATE_TAG])
+    return obj
+
+
+def dumps_json(value):
+    """
+    将配置数据编码为紧凑的 JSON 字符串（保留 datetime/date 类型）
+    """
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':'), default=_json_default)
+
+
+def loads_json(text):
+    """
+    解码 dumps_json() 生成的 JSON 字符串
+    """
+    return json.loads(text, object_hook=_json_object_hook)
+
+
+# ---- 配置快照的编码 ----
+
+# 可用时使用 libyaml 的 C 实现，比纯 Python 的 SafeLoader/SafeDumper 快一个数量级
+YAML_LOADER = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+YAML_DUMPER = getattr(yaml, 'CSafeDumper', yaml.SafeDumper)
+
+YAML = 'yaml'
+JSON = 'json'
+BINARY = 'binary'
+FORMATS = (YAML, JSON, BINARY)
+
+# 二进制快照：魔数、格式版本、段数，之后每个顶层键一段：
+# 键长度(u16) 键(UTF-8) 数据长度(u32) CRC32(u32) 数据（紧凑 JSON）
+BINARY_MAGIC = b'2FAV'
+BINARY_VERSION = 1
+_HEADER = struct.Struct('>4sBI')
+_KEY_LENGTH = struct.Struct('>H')
+_SECTION = struct.Struct('>II')
+# 顶层不是 dict 时整个值保存为一段，键为空
+_WHOLE = ''
+
+
+def loads_yaml(data):
+    """解析 YAML（str 或 bytes）"""
+    return yaml.load(data, Loader=YAML_LOADER)
+
+
+def dumps_yaml(value) -> str:
+    """编码为 YAML"""
+    return yaml.dump(value, Dumper=YAML_DUMPER, allow_unicode=True)
+
+
+def dumps_binary(value) -> bytes:
+    """编码为二进制快照"""
+    sections = value.items() if isinstance(value, dict) else [(_WHOLE, value)]
+    parts = [_HEADER.pack(BINARY_MAGIC, BINARY_VERSION, len(sections))]
+    for key, section in sections:
+        key_bytes = str(key).encode('utf-8')
+        payload = dumps_json(section).encode('utf-8')
+        parts.append(_KEY_LENGTH.pack(len(key_bytes)))
+        parts.append(key_bytes)
+        parts.append(_SECTION.pack(len(payload), zlib.crc32(payload)))
+        parts.append(payload)
+    return b''.join(parts)
+
+
+def _binary_sections(data):
+    """逐段读取二进制快照：生成 (键, 数据的 memoryview)"""
+    view = memoryview(data)
+    if len(view) < _HEADER.size:
+        raise ValueError('Truncated binary snapshot')
+    magic, version, count = _HEADER.unpack_from(view)
+    if magic != BINARY_MAGIC:
+        raise ValueError('Not a binary snapshot')
+    if version != BINARY_VERSION:
+        raise ValueError(f'Unsupported binary snapshot version: {version}')
+    offset = _HEADER.size
+    for _ in range(count):
+        (key_length,) = _KEY_LENGTH.unpack_from(view, offset)
+        offset += _KEY_LENGTH.size
+        key = bytes(view[offset:offset + key_length]).decode('utf-8')
+        offset += key_length
+        length, crc = _SECTION.unpack_from(view, offset)
+        offset += _SECTION.size
+        payload = view[offset:offset + length]
+        if len(payload) != length or zlib.crc32(payload) != crc:
+            raise ValueError(f'Corrupted binary snapshot section: {key!r}')
+        offset += length
+        yield key, payload
+
+
+def loads_binary(data, keys=None):
+    """
+    解码二进制快照
+    :param keys: 只解码这些顶层键（其余段只校验不解析）
+    """
+    value = {}
+    for key, payload in _binary_sections(data):
+        if key == _WHOLE and keys is None:
+            return loads_json(bytes(payload).decode('utf-8'))
+        if keys is None or key in keys:
+            value[key] = loads_json(bytes(payload).decode('utf-8'))
+    return value
+
+
+def _decode(data: bytes):
+    """
+    识别格式并解码
+    :return: (格式, 值)
+
+    二进制快照按魔数识别。以 { 或 [ 开头的文本先按 JSON 解析（更快），解析失败时
+    按 YAML 解析：流式风格的 YAML（例如 {a: 1}）同样以这两个字符开头。
+    """
+    if data[:len(BINARY_MAGIC)] == BINARY_MAGIC:
+        return BINARY, loads_binary(data)
+    if data.lstrip()[:1] in (b'{', b'['):
+        try:
+            return JSON, loads_json(data.decode('utf-8'))
+        except ValueError:
+            pass
+    return YAML, loads_yaml(data)
+
+
+def detect_format(data: bytes) -> str:
+    """根据内容判断快照格式（需要解码一遍，见 _decode）"""
+    return _decode(data)[0]
+
+
+def loads(data: bytes):
+    """解码任意格式的快照（自动识别格式）"""
+    return _decode(data)[1]
+
+
+def dumps(value, fmt: str = YAML) -> bytes:
+    """按指定格式编码快照"""
+    if fmt == BINARY:
+        return dumps_binary(value)
+    if fmt == JSON:
+        return dumps_json(value).encode('utf-8')
+    if fmt == YAML:
+        return dumps_yaml(value).encode('utf-8')
+    raise ValueError(f'Unknown snapshot format: {fmt}')
+
+
+def load_file(path):
+    """读取快照文件（自动识别格式）"""
+    with open(path, 'rb') as f:
+        return loads(f.read())
+
+
+def dump_file(path, value, fmt: str = YAML):
+    """写入快照文件"""
+    with open(path, 'wb') as f:
+        f.write(dumps(value, fmt))
+
+
+def _sample_config(entry_count):
+    """生成包含 entry_count 个密码条目的配置"""
+    import base64
+    import os
+    entries = {}
+    for i in range(entry_count):
+        entries[str(i)] = {
+            'title': f'Entry {i}',
+            'username': f'user{i}@example.com',
+            'password': base64.urlsafe_b64encode(os.urandom(96)).decode(),
+            'url': f'https://site{i}.example.com/login',
+            'notes': None,
+            'category': 'login',
+            'created_at': datetime(2024, 1, 1, 12, 0, 0),
+            'updated_at': '2024-01-01T12:00:00',
+        }
+    return {
+        'users': {'admin': {'username': 'admin', 'password_hash': 'pbkdf2:sha256:260000$x$y', 'totp_enabled': False}},
+        'password_store': {'admin': {'encryption_key': 'k' * 44, 'entries': entries}},
+    }
+
+
+def _benchmark(sizes=(1000, 10000, 100000)):
+    """比较各格式的编码、解码耗时和大小"""
+    import time
+    codecs = [
+        ('yaml (pure Python)', lambda v: yaml.dump(v, Dumper=yaml.SafeDumper, allow_unicode=True).encode('utf-8'),
+         lambda d: yaml.load(d, Loader=yaml.SafeLoader), 10000),
+        ('yaml (libyaml)', lambda v: dumps(v, YAML), loads, None),
+        ('json', lambda v: dumps(v, JSON), loads, None),
+        ('binary', lambda v: dumps(v, BINARY), loads, None),
+    ]
+    if YAML_LOADER is yaml.SafeLoader:
+        print('libyaml is not available; "yaml (libyaml)" falls back to the pure Python implementation')
+    for size in sizes:
+        config = _sample_config(size)
+        print(f'{size} entries')
+        for name, dump, load, max_size in codecs:
+            if max_size is not None and size > max_size:
+                continue
+            start = time.perf_counter()
+            data = dump(config)
+            dumped = time.perf_counter() - start
+            start = time.perf_counter()
+            assert load(data) == config
+            loaded = time.perf_counter() - start
+            print(f'  {name:20} dump {dumped * 1000:9.1f} ms  load {loaded * 1000:9.1f} ms  '
+                  f'size {len(data) / 1024:9.1f} KB')
+
+
+if __name__ == '__main__':
+    _benchmark()
@@ -1,21 +1,360 @@
-import yaml
 import os
+import threading
+from collections.abc import Mapping, Sequence
+from utils.journal import SET, ConfigJournal, apply_changes
+from utils.storage import StorageBackend, VersionConflict, VERSION_PATH, clone, lookup
+from utils.group_commit import GroupCommitter
+from utils import codec
+
+try:
+    import fcntl
+except ImportError:  # Windows：只有进程内的锁
+    fcntl = None
+
+BASE_DIR = os.path.dirname(os.path.dirname(__file__))
+CONFIG_PATH = os.path.join(BASE_DIR, 'config.yaml')
+DB_PATH = os.path.join(BASE_DIR, 'config.db')
+SHARD_DIR = os.path.join(BASE_DIR, 'vault')
+# 配置快照写入的格式（yaml/json/binary），读取时自动识别
+CONFIG_FORMAT = os.environ.get('CONFIG_FORMAT', codec.YAML).lower()
+
+
+class CommitLock:
+    """
+    跨进程的提交锁（fcntl.flock），同时在锁文件中记录最后一次提交的存储版本号
+
+    文件的 (mtime, size, inode) 不足以可靠地发现其它进程刚刚的替换（inode 会被复用，
+    时间戳精度有限），所以提交前在锁内比较锁文件中的版本号，不一致就重新读取配置。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._fd = None
+
+    def __enter__(self):
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        if fcntl is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc_info):
+        if fcntl is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        os.close(self._fd)
+        self._fd = None
+
+    def version(self):
+        """最后一次提交的存储版本号，未知时为 None"""
+        os.lseek(self._fd, 0, os.SEEK_SET)
+        data = os.read(self._fd, 32).strip()
+        return int(data) if data.isdigit() else None
+
+    def set_version(self, version):
+        """记录本次提交后的存储版本号"""
+        os.lseek(self._fd, 0, os.SEEK_SET)
+        os.ftruncate(self._fd, 0)
+        os.write(self._fd, str(version).encode())
+
+
+class ReadOnlyDict(Mapping):
+    """
+    配置的只读视图，嵌套的 dict/list 在访问时同样包装为只读
+    """
+    __slots__ = ('_data',)
+
+    def __init__(self, data):
+        self._data = data
+
+    def __getitem__(self, key):
+        return _freeze(self._data[key])
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __len__(self):
+        return len(self._data)
+
+    def __repr__(self):
+        return f'ReadOnlyDict({self._data!r})'
+
+    def copy(self):
+        """返回可修改的副本"""
+        return clone(self._data if isinstance(self._data, dict) else dict(self._data))
+
+
+class ReadOnlyList(Sequence):
+    """
+    配置列表的只读视图
+    """
+    __slots__ = ('_data',)
+
+    def __init__(self, data):
+        self._data = data
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return ReadOnlyList(self._data[index])
+        return _freeze(self._data[index])
+
+    def __len__(self):
+        return len(self._data)
+
+    def __repr__(self):
+        return f'ReadOnlyList({self._data!r})'
+
+
+def _freeze(value):
+    if isinstance(value, dict):
+        return ReadOnlyDict(value)
+    if isinstance(value, list):
+        return ReadOnlyList(value)
+    return value
+
+
+class YamlBackend(StorageBackend):
+    """
+    基于单个 YAML 文件的存储后端（带进程内缓存）
+
+    解析后的配置只在文件的 (mtime_ns, size, inode) 发生变化时重新读取，
+    写入后直接用写入的内容刷新缓存。缓存的配置从不就地修改，变更只复制
+    路径上的 dict，因此可以安全地交给只读视图。
+
+    启用变更日志时，写入只把变更追加到日志，达到阈值后才把完整快照重写一次。
+
+    并发的写入经过 GroupCommitter 合并：一个短窗口内的所有变更只写一次文件
+    （或追加一条日志记录），每个调用者在写入落盘后才返回。快照总是先写临时文件
+    再原子替换，fsync 可以关闭以换取速度。多个进程的提交通过 <配置文件>.lock 上的
+    文件锁串行化。
+    """
+
+    def __init__(self, path, journal=None, group_commit_window=0.02, fsync=True, fmt=codec.YAML):
+        """
+        :param fmt: 写入快照的格式（yaml/json/binary）；读取时按内容自动识别，
+                    所以切换格式后已有的文件仍可读取，下次写入时转换
+        """
+        super().__init__()
+        if fmt not in codec.FORMATS:
+            raise ValueError(f'Unknown snapshot format: {fmt}')
+        self.path = path
+        self.journal = journal
+        self.fsync = fsync
+        self.fmt = fmt
+        self.committer = GroupCommitter(self._flush, group_commit_window)
+        self._lock = threading.Lock()
+        self._data = None
+        self._signature = None
+
+    @staticmethod
+    def _stat(path):
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+    def _stat_signature(self):
+        if self.journal is None:
+            return self._stat(self.path)
+        return (self._stat(self.path), self._stat(self.journal.path))
+
+    def _read_snapshot(self):
+        try:
+            with open(self.path, 'rb') as f:
+                return codec.loads(f.read()) or {}
+        except FileNotFoundError:
+            return {}
+
+    def _write_snapshot(self, data):
+        # 快照原子替换，崩溃时不会留下写了一半的配置（日志模式下快照和日志也不会同时损坏）
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(codec.dumps(data, self.fmt))
+            if self.fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        if self.fsync and hasattr(os, 'O_DIRECTORY'):
+            fd = os.open(os.path.dirname(os.path.abspath(self.path)), os.O_RDONLY | os.O_DIRECTORY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+    def _reload(self, signature):
+        if self.journal is None:
+            return self._read_snapshot() if signature is not None else {}
+        old = self._signature
+        if (self._data is not None and old is not None and signature[0] == old[0] and
+                signature[1] is not None and old[1] is not None and
+                signature[1][2] == old[1][2] and signature[1][1] >= self.journal.valid_offset):
+            # 快照未变，只是其它进程追加了日志：只重放新增部分
+            data, _ = self.journal.replay(self._data, self.journal.valid_offset)
+            return data
+        data, _ = self.journal.replay(self._read_snapshot())
+        return data
+
+    def view(self):
+        signature = self._stat_signature()
+        with self._lock:
+            if self._data is not None and signature == self._signature:
+                return self._data
+            self._data = self._reload(signature)
+            self._signature = signature
+            self._remember(self._data)
+            return self._data
+
+    def load(self):
+        config = clone(self.view())
+        # 带上读取时的版本号，save() 据此与之后的修改合并
+        config.setdefault(VERSION_PATH[0], 0)
+        return config
+
+    def update(self, build):
+        self.committer.submit(build)
+
+    def _flush(self, batches):
+        """
+        把一批调用者的写入合并为一次提交，返回每个调用者的错误
+
+        提交期间持有文件锁，锁内发现其它进程提交过就重新读取配置，所以它们的写入不会被覆盖；
+        每个调用者的变更按批内的顺序依次基于最新的数据生成。
+        """
+        with CommitLock(f'{self.path}.lock') as lock:
+            version = lock.version()
+            if version is None or self._data is None or lookup(self._data, VERSION_PATH, 0) != version:
+                self.invalidate()
+            current = self.view()
+            with self._lock:
+                data, applied, errors = current, [], []
+                for build in batches:
+                    try:
+                        changes = build(lambda path: lookup(data, path))
+                        data = apply_changes(data, changes)
+                    except Exception as error:
+                        errors.append(error)
+                        continue
+                    applied.extend(changes)
+                    errors.append(None)
+                if not applied:
+                    return errors
+                bump = (SET, VERSION_PATH, lookup(data, VERSION_PATH, 0) + 1)
+                applied.append(bump)
+                data = apply_changes(data, [bump])
+                if self.journal is None:
+                    self._write_snapshot(data)
+                else:
+                    self.journal.append(applied)
+                    snapshot = self._stat(self.path)
+                    if self.journal.needs_compaction(snapshot[0] / 1e9 if snapshot else 0):
+                        self._write_snapshot(data)
+                        self.journal.reset()
+                self._data = data
+                self._signature = self._stat_signature()
+                self._remember(data)
+                lock.set_version(bump[2])
+        return errors
+
+    def invalidate(self):
+        with self._lock:
+            self._data = None
+            self._signature = None
+
+
+def _env_flag(name, default):
+    return os.environ.get(name, default).lower() in ('1', 'true', 'yes', 'on')
+
+
+def _journal_from_env():
+    if not _env_flag('CONFIG_JOURNAL', ''):
+        return None
+    return ConfigJournal(
+        f'{CONFIG_PATH}.journal',
+        fsync=_env_flag('CONFIG_FSYNC', '1'),
+        max_records=int(os.environ.get('CONFIG_JOURNAL_MAX_RECORDS', 1000)),
+        max_bytes=int(os.environ.get('CONFIG_JOURNAL_MAX_BYTES', 4 * 1024 * 1024)),
+        max_age=int(os.environ.get('CONFIG_JOURNAL_MAX_AGE', 3600))
+    )
+
+
+def _create_storage():
+    backend = os.environ.get('CONFIG_BACKEND', 'yaml').lower()
+    if backend == 'sqlite':
+        from utils.sqlite_store import SqliteBackend
+        return SqliteBackend(os.environ.get('CONFIG_DB', DB_PATH), import_path=CONFIG_PATH)
+    options = {
+        'group_commit_window': float(os.environ.get('CONFIG_GROUP_COMMIT_MS', 20)) / 1000,
+        'fsync': _env_flag('CONFIG_FSYNC', '1'),
+        'fmt': CONFIG_FORMAT,
+    }
+    if backend == 'sharded':
+        from utils.sharded_store import ShardedBackend
+        return ShardedBackend(os.environ.get('CONFIG_SHARD_DIR', SHARD_DIR), import_path=CONFIG_PATH, **options)
+    if backend != 'yaml':
+        raise ValueError(f'Unknown CONFIG_BACKEND: {backend}')
+    return YamlBackend(CONFIG_PATH, _journal_from_env(), **options)
+
+
+_storage = None
+_storage_lock = threading.Lock()
+
+
+def get_storage():
+    """
+    获取当前进程使用的存储后端（由环境变量 CONFIG_BACKEND 选择：yaml/sqlite/sharded）
+    """
+    global _storage
+    if _storage is None:
+        with _storage_lock:
+            if _storage is None:
+                _storage = _create_storage()
+    return _storage
+
 
 def load_config():
     """
     加载配置文件
+
+    返回配置的独立副本，调用方可以自由修改后交给 save_config()。
+    """
+    return get_storage().load()
+
+
+def load_config_view():
+    """
+    以只读视图加载配置，不复制数据，适合只读取配置的请求
     """
-    config_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'config.yaml')
-    try:
-        with open(config_path, 'r', encoding='utf-8') as f:
-            return yaml.safe_load(f)
-    except FileNotFoundError:
-        return {}
+    return ReadOnlyDict(get_storage().view())
+
 
 def save_config(config):
     """
     保存配置文件
+    :raises VersionConflict: 配置是很多次写入之前 load_config() 得到的，无法合并；
+                             调用方应重新加载后再修改，或者使用 update_config()
+    """
+    if isinstance(config, ReadOnlyDict):
+        config = config.copy()
+    get_storage().save(config)
+
+
+def update_config(modify, retries: int = 5):
+    """
+    加载配置、用 modify(config) 原地修改后保存，无法合并时重新加载并重试
+    :return: modify 的返回值
+    """
+    for attempt in range(retries):
+        config = load_config()
+        result = modify(config)
+        try:
+            save_config(config)
+            return result
+        except VersionConflict:
+            if attempt == retries - 1:
+                raise
+
+
+def invalidate_config_cache():
+    """
+    丢弃进程内缓存（例如在外部直接替换了配置文件之后）
     """
-    config_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'config.yaml')
-    with open(config_path, 'w', encoding='utf-8') as f:
-        yaml.dump(config, f, allow_unicode=True)
+    get_storage().invalidate()
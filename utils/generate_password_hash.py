@@ -1,36 +1,21 @@
-from werkzeug.security import generate_password_hash
-import yaml
+from utils.config import get_storage
+from utils.journal import SET
+from services.password_hashing import hash_password
 
 def update_password():
-    # 生成密码哈希
+    # 生成密码哈希（使用校准后的哈希方法）
     password = 'admin'  # 默认密码
-    password_hash = generate_password_hash(password)
-    
-    # 读取现有配置
-    try:
-        with open('config.yaml', 'r', encoding='utf-8') as f:
-            config = yaml.safe_load(f)
-    except FileNotFoundError:
-        config = {}
-    
-    # 更新配置
-    if 'users' not in config:
-        config['users'] = {}
-    
-    if 'admin' not in config['users']:
-        config['users']['admin'] = {}
-    
-    config['users']['admin'].update({
-        'username': 'admin',
-        'password_hash': password_hash,
-        'totp_secret': None,
-        'totp_enabled': False
-    })
-    
-    # 保存配置
-    with open('config.yaml', 'w', encoding='utf-8') as f:
-        yaml.dump(config, f, allow_unicode=True)
-    
+    password_hash = hash_password(password)
+
+    # 经由存储后端更新配置（加锁、写日志，保留 admin 的其它字段）
+    admin = ('users', 'admin')
+    get_storage().apply([
+        (SET, admin + ('username',), 'admin'),
+        (SET, admin + ('password_hash',), password_hash),
+        (SET, admin + ('totp_secret',), None),
+        (SET, admin + ('totp_enabled',), False),
+    ])
+
     print(f'Password hash updated for admin user')
     print(f'Username: admin')
     print(f'Password: admin')
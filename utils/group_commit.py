@@ -0,0 +1,103 @@
+import threading
+import time
+
+
+class _Batch:
+    __slots__ = ('items', 'errors', 'done')
+
+    def __init__(self):
+        self.items = []
+        self.errors = None
+        self.done = threading.Event()
+
+
+class GroupCommitter:
+    """
+    写入合并（group commit）
+
+    第一个提交的线程成为本批的提交者：等待一个短窗口，让同一时间段内其它线程的
+    写入加入同一批，然后调用一次 flush 把整批写到磁盘。上一批还在写入时到达的写入
+    也会加入下一批。每个调用者在自己的写入真正落盘后才返回，写入失败时抛出对应的异常。
+    """
+
+    def __init__(self, flush, window: float = 0.02):
+        """
+        :param flush: 接收一批写入的列表，返回等长的错误列表（成功为 None）
+        :param window: 合并窗口（秒），0 表示只合并上一批写入期间到达的写入
+        """
+        self.flush = flush
+        self.window = window
+        self.flushes = 0
+        self.items = 0
+        self._pending = None
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+
+    def submit(self, item):
+        """提交一个写入，等待它落盘"""
+        with self._lock:
+            batch = self._pending
+            leader = batch is None
+            if leader:
+                batch = self._pending = _Batch()
+            index = len(batch.items)
+            batch.items.append(item)
+        if leader:
+            if self.window > 0:
+                time.sleep(self.window)
+            with self._flush_lock:
+                with self._lock:
+                    self._pending = None
+                try:
+                    batch.errors = self.flush(batch.items)
+                except BaseException as error:
+                    batch.errors = [error] * len(batch.items)
+                finally:
+                    self.flushes += 1
+                    self.items += len(batch.items)
+                    batch.done.set()
+        else:
+            batch.done.wait()
+        error = batch.errors[index]
+        if error is not None:
+            raise error
+
+    def stats(self) -> dict:
+        """合并统计信息"""
+        return {'flushes': self.flushes, 'items': self.items}
+
+
+def _benchmark(writers=10):
+    """比较逐个写入与合并写入时完整重写配置文件的次数和耗时"""
+    import os
+    import tempfile
+    from utils.config import YamlBackend
+    from utils.journal import SET
+
+    directory = tempfile.mkdtemp()
+    config = {'password_store': {'bench': {'entries': {
+        str(i): {'title': f'entry {i}', 'password': 'x' * 120} for i in range(2000)}}}}
+    for label, window, concurrent in (('sequential', 0.0, False), ('concurrent, 0 ms', 0.0, True),
+                                      ('concurrent, 20 ms', 0.02, True)):
+        backend = YamlBackend(os.path.join(directory, f'config-{window}-{concurrent}.yaml'),
+                              group_commit_window=window)
+        backend.save(config)
+        backend.committer.flushes = backend.committer.items = 0
+        edits = [[(SET, ('password_store', 'bench', 'entries', str(i), 'title'), f'edited {i}')]
+                 for i in range(writers)]
+        start = time.perf_counter()
+        if concurrent:
+            threads = [threading.Thread(target=backend.apply, args=(changes,)) for changes in edits]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        else:
+            for changes in edits:
+                backend.apply(changes)
+        elapsed = time.perf_counter() - start
+        print(f'{label:18}: {writers} edits -> {backend.committer.flushes} writes in {elapsed * 1000:.0f} ms')
+
+
+if __name__ == '__main__':
+    _benchmark()
@@ -0,0 +1,150 @@
+import os
+import time
+import zlib
+from utils.codec import dumps_json, loads_json
+
+SET = 'set'
+DELETE = 'del'
+
+
+def diff_config(old, new, path=()):
+    """
+    计算两个配置之间的差异
+    :return: 变更列表 [(op, path, value)]，只有 dict 会逐键比较，其余值整体替换
+    """
+    if isinstance(old, dict) and isinstance(new, dict):
+        changes = []
+        for key, value in new.items():
+            if key not in old:
+                changes.append((SET, path + (key,), value))
+            elif old[key] is not value:
+                changes.extend(diff_config(old[key], value, path + (key,)))
+        for key in old:
+            if key not in new:
+                changes.append((DELETE, path + (key,), None))
+        return changes
+    if type(old) is type(new) and old == new:
+        return []
+    return [(SET, path, new)]
+
+
+def _apply_one(node, path, op, value):
+    if not path:
+        return value if op == SET else {}
+    node = dict(node) if isinstance(node, dict) else {}
+    key = path[0]
+    if len(path) == 1:
+        if op == SET:
+            node[key] = value
+        else:
+            node.pop(key, None)
+    elif op == SET or key in node:
+        node[key] = _apply_one(node.get(key), path[1:], op, value)
+    return node
+
+
+def apply_changes(data, changes):
+    """
+    将变更应用到配置上
+
+    只复制变更路径上的 dict，其余部分与原配置共享，因此原配置（可能正被
+    只读视图引用）不会被修改。
+    :return: 新的配置对象
+    """
+    for op, path, value in changes:
+        data = _apply_one(data, tuple(path), op, value)
+    return data
+
+
+class ConfigJournal:
+    """
+    配置快照旁的追加式变更日志
+
+    每次保存追加一条记录：``<crc32> <json>``。启动时按顺序把记录重放到
+    快照上，遇到校验失败（例如写入中途崩溃留下的半条记录）即停止。
+    记录只包含 set/delete 操作，重复重放是幂等的，所以压缩时先替换快照、
+    再清空日志，中途崩溃也不会丢失数据。
+    """
+
+    def __init__(self, path, max_records=1000, max_bytes=4 * 1024 * 1024, max_age=3600, fsync=True):
+        self.path = path
+        self.fsync = fsync
+        self.max_records = max_records
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.records = 0
+        self.valid_offset = 0
+
+    @staticmethod
+    def _encode(changes):
+        payload = dumps_json([[op, list(path), value] for op, path, value in changes]).encode('utf-8')
+        return b'%08x %s\n' % (zlib.crc32(payload), payload)
+
+    @staticmethod
+    def _decode(line):
+        if not line.endswith(b'\n') or len(line) < 10 or line[8:9] != b' ':
+            return None
+        payload = line[9:-1]
+        try:
+            if int(line[:8], 16) != zlib.crc32(payload):
+                return None
+            return [(op, tuple(path), value) for op, path, value in loads_json(payload.decode('utf-8'))]
+        except ValueError:
+            return None
+
+    def replay(self, data, offset=0):
+        """
+        从 offset 开始把日志记录应用到 data 上
+        :return: (新的配置, 最后一条有效记录之后的偏移量)
+        """
+        if offset == 0:
+            self.records = 0
+        try:
+            with open(self.path, 'rb') as f:
+                f.seek(offset)
+                for line in f:
+                    changes = self._decode(line)
+                    if changes is None:
+                        break
+                    data = apply_changes(data, changes)
+                    offset += len(line)
+                    self.records += 1
+        except FileNotFoundError:
+            offset = 0
+        self.valid_offset = offset
+        return data, offset
+
+    def append(self, changes):
+        """
+        追加一条变更记录并刷到磁盘
+        :return: 追加后的日志大小
+        """
+        record = self._encode(changes)
+        with open(self.path, 'ab') as f:
+            # 丢弃上次崩溃留下的不完整记录
+            if f.tell() != self.valid_offset:
+                f.truncate(self.valid_offset)
+                f.seek(self.valid_offset)
+            f.write(record)
+            if self.fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        self.valid_offset += len(record)
+        self.records += 1
+        return self.valid_offset
+
+    def needs_compaction(self, snapshot_mtime):
+        """是否需要把日志合并进快照"""
+        if self.records == 0:
+            return False
+        return (self.records >= self.max_records or
+                self.valid_offset >= self.max_bytes or
+                time.time() - snapshot_mtime >= self.max_age)
+
+    def reset(self):
+        """快照写入后清空日志"""
+        with open(self.path, 'wb') as f:
+            f.flush()
+            os.fsync(f.fileno())
+        self.records = 0
+        self.valid_offset = 0
@@ -1,58 +1,187 @@
+import json
+import os
+import sqlite3
+import threading
 import time
-from flask import session
 
-# 登录尝试记录，格式：{'ip': {'attempts': count, 'last_attempt': timestamp}}
-login_attempts = {}
+BASE_DIR = os.path.dirname(os.path.dirname(__file__))
 
-def check_login_limit(ip_address, max_attempts=5, lockout_time=300):
+# 限制状态保存在本地 SQLite 文件中，多个工作进程共享，重启后锁定仍然有效
+LIMIT_DB = os.environ.get('LOGIN_LIMIT_DB', os.path.join(BASE_DIR, 'login_limit.db'))
+# 滑动窗口（秒）内失败达到次数后锁定（秒）
+MAX_ATTEMPTS = int(os.environ.get('LOGIN_MAX_ATTEMPTS', 5))
+USERNAME_MAX_ATTEMPTS = int(os.environ.get('LOGIN_USERNAME_MAX_ATTEMPTS', 10))
+WINDOW = int(os.environ.get('LOGIN_WINDOW', 900))
+LOCKOUT = int(os.environ.get('LOGIN_LOCKOUT', 300))
+# 最多保留的记录数，超出时先淘汰最早过期的记录
+MAX_KEYS = int(os.environ.get('LOGIN_LIMIT_MAX_KEYS', 100000))
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS login_failures (
+    key TEXT PRIMARY KEY,
+    failures TEXT NOT NULL,
+    locked_until REAL NOT NULL,
+    expires_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_login_failures_expires ON login_failures (expires_at);
+'''
+
+# 每次写入时最多清理的过期记录数，以及检查记录总数的间隔（写入次数）
+_SWEEP_BATCH = 100
+_CAP_INTERVAL = 256
+
+
+class LoginLimiter:
+    """
+    登录失败的滑动窗口限制
+
+    每个键（IP 或用户名）保存窗口内最近的失败时间，达到次数后锁定一段时间。
+    每条记录带有过期时间并按过期时间建立索引：每次写入顺带删除一批已过期的记录，
+    并定期把记录总数限制在 max_keys 以内，所以大量不同 IP 或用户名的尝试
+    不会让存储无限增长。检查与更新在同一个写事务中完成，多个进程看到一致的计数。
+    """
+
+    def __init__(self, path: str, max_keys: int = MAX_KEYS):
+        self.path = path
+        self.max_keys = max_keys
+        self._local = threading.local()
+        self._writes = 0
+        self._writes_lock = threading.Lock()
+        with self._conn() as conn:
+            conn.executescript(_SCHEMA)
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def _row(self, conn, key, now):
+        row = conn.execute(
+            'SELECT failures, locked_until FROM login_failures WHERE key = ? AND expires_at > ?',
+            (key, now)).fetchone()
+        if row is None:
+            return [], 0.0
+        return json.loads(row[0]), row[1]
+
+    def wait_time(self, key: str) -> int:
+        """剩余锁定时间（秒），未锁定时为 0"""
+        now = time.time()
+        _, locked_until = self._row(self._conn(), key, now)
+        return max(int(locked_until - now + 0.999), 0)
+
+    def remaining(self, key: str, max_attempts: int, window: int = WINDOW) -> int:
+        """锁定前剩余的尝试次数"""
+        now = time.time()
+        failures, locked_until = self._row(self._conn(), key, now)
+        if locked_until > now:
+            return 0
+        return max(max_attempts - sum(1 for at in failures if at > now - window), 0)
+
+    def record_failure(self, key: str, max_attempts: int, window: int = WINDOW, lockout: int = LOCKOUT) -> int:
+        """
+        记录一次失败
+        :return: 剩余锁定时间（秒），未锁定时为 0
+        """
+        now = time.time()
+        conn = self._conn()
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            failures, locked_until = self._row(conn, key, now)
+            failures = [at for at in failures if at > now - window][-(max_attempts - 1):] if max_attempts > 1 else []
+            failures.append(now)
+            if locked_until <= now and len(failures) >= max_attempts:
+                locked_until = now + lockout
+                failures = []
+            conn.execute(
+                'INSERT OR REPLACE INTO login_failures (key, failures, locked_until, expires_at) VALUES (?, ?, ?, ?)',
+                (key, json.dumps(failures), locked_until, max(locked_until, now + window)))
+            self._sweep(conn, now)
+        return max(int(locked_until - now + 0.999), 0)
+
+    def reset(self, key: str):
+        """清除一个键的记录（例如登录成功后）"""
+        conn = self._conn()
+        with conn:
+            conn.execute('DELETE FROM login_failures WHERE key = ?', (key,))
+
+    def _sweep(self, conn, now):
+        """删除一批过期记录，并定期淘汰超出上限的记录"""
+        conn.execute(
+            'DELETE FROM login_failures WHERE key IN '
+            '(SELECT key FROM login_failures WHERE expires_at <= ? ORDER BY expires_at LIMIT ?)',
+            (now, _SWEEP_BATCH))
+        with self._writes_lock:
+            self._writes += 1
+            check_cap = self._writes % _CAP_INTERVAL == 0
+        if not check_cap:
+            return
+        excess = conn.execute('SELECT COUNT(*) FROM login_failures').fetchone()[0] - self.max_keys
+        if excess > 0:
+            conn.execute(
+                'DELETE FROM login_failures WHERE key IN '
+                '(SELECT key FROM login_failures ORDER BY expires_at LIMIT ?)',
+                (excess,))
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def get_limiter() -> LoginLimiter:
+    """获取共享的登录限制器"""
+    global _limiter
+    if _limiter is None:
+        with _limiter_lock:
+            if _limiter is None:
+                _limiter = LoginLimiter(LIMIT_DB)
+    return _limiter
+
+
+def _keys(ip_address, username):
+    keys = [(f'ip:{ip_address}', MAX_ATTEMPTS)]
+    if username:
+        keys.append((f'user:{username}', USERNAME_MAX_ATTEMPTS))
+    return keys
+
+
+def check_login_limit(ip_address, username=None):
     """
-    检查登录限制
+    检查登录限制（IP 和用户名分别计数）
     :param ip_address: IP地址
-    :param max_attempts: 最大尝试次数
-    :param lockout_time: 锁定时间（秒）
+    :param username: 用户名
     :return: (是否允许登录, 剩余等待时间)
     """
-    current_time = time.time()
-    ip_record = login_attempts.get(ip_address, {'attempts': 0, 'last_attempt': 0})
-    
-    # 如果已经过了锁定时间，重置尝试次数
-    if current_time - ip_record['last_attempt'] > lockout_time:
-        ip_record['attempts'] = 0
-    
-    # 如果超过最大尝试次数
-    if ip_record['attempts'] >= max_attempts:
-        wait_time = lockout_time - (current_time - ip_record['last_attempt'])
-        if wait_time > 0:
-            return False, int(wait_time)
-        # 锁定时间已过，重置尝试次数
-        ip_record['attempts'] = 0
-    
-    return True, 0
-
-def record_login_attempt(ip_address, success):
+    limiter = get_limiter()
+    wait_time = max(limiter.wait_time(key) for key, _ in _keys(ip_address, username))
+    return wait_time == 0, wait_time
+
+
+def record_login_attempt(ip_address, success, username=None):
     """
     记录登录尝试
     :param ip_address: IP地址
     :param success: 是否登录成功
+    :param username: 用户名
     """
-    if ip_address not in login_attempts:
-        login_attempts[ip_address] = {'attempts': 0, 'last_attempt': 0}
-    
-    if success:
-        # 登录成功，清除记录
-        login_attempts[ip_address]['attempts'] = 0
-    else:
-        # 登录失败，增加尝试次数
-        login_attempts[ip_address]['attempts'] += 1
-        login_attempts[ip_address]['last_attempt'] = time.time()
+    limiter = get_limiter()
+    for key, max_attempts in _keys(ip_address, username):
+        if success:
+            # 登录成功，清除记录
+            limiter.reset(key)
+        else:
+            limiter.record_failure(key, max_attempts)
+
 
-def get_remaining_attempts(ip_address, max_attempts=5):
+def get_remaining_attempts(ip_address, username=None):
     """
     获取剩余的登录尝试次数
     :param ip_address: IP地址
-    :param max_attempts: 最大尝试次数
+    :param username: 用户名
     :return: 剩余尝试次数
     """
-    if ip_address not in login_attempts:
-        return max_attempts
-    return max_attempts - login_attempts[ip_address]['attempts']
+    limiter = get_limiter()
+    return min(limiter.remaining(key, max_attempts) for key, max_attempts in _keys(ip_address, username))
@@ -0,0 +1,18 @@
+from utils.config import get_storage
+from services.password_manager import migrate_ciphertexts
+
+
+def migrate():
+    """把所有用户的旧格式密文一次性改写为紧凑格式（登录时也会迁移当前用户）"""
+    total = 0
+    for user_id in get_storage().peek(('password_store',), {}):
+        migrated = migrate_ciphertexts(user_id)
+        if migrated:
+            print(f'{user_id}: {migrated} fields migrated')
+        total += migrated
+    print(f'Migrated {total} legacy ciphertext fields')
+    return total
+
+
+if __name__ == '__main__':
+    migrate()
@@ -0,0 +1,29 @@
+import os
+import sys
+from utils.config import CONFIG_PATH, DB_PATH
+from utils.sqlite_store import SqliteBackend, import_yaml
+
+
+def migrate(yaml_path=CONFIG_PATH, db_path=DB_PATH, force=False):
+    """
+    把 config.yaml 一次性导入到 SQLite 数据库
+    :param force: 数据库已存在时是否覆盖其中的数据
+    """
+    if os.path.exists(db_path) and not force:
+        print(f'Database already exists: {db_path} (use --force to overwrite)')
+        return False
+
+    backend = SqliteBackend(db_path)
+    config = import_yaml(yaml_path, backend)
+
+    users = config.get('users', {})
+    entries = sum(len(store.get('entries', {})) for store in config.get('password_store', {}).values())
+    keys = sum(len(store.get('keys', {})) for store in config.get('totp_store', {}).values())
+    print(f'Imported {yaml_path} into {db_path}')
+    print(f'Users: {len(users)}, password entries: {entries}, TOTP keys: {keys}')
+    print('Start the app with CONFIG_BACKEND=sqlite to use the database')
+    return True
+
+
+if __name__ == '__main__':
+    migrate(force='--force' in sys.argv[1:])
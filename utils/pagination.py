@@ -0,0 +1,68 @@
+import base64
+import heapq
+import json
+
+# 默认每页条数和上限
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+def clamp_limit(limit) -> int:
+    """把请求的每页条数限制在 1..MAX_PAGE_SIZE 之间"""
+    try:
+        limit = int(limit)
+    except (TypeError, ValueError):
+        return PAGE_SIZE
+    return min(max(limit, 1), MAX_PAGE_SIZE)
+
+
+def encode_cursor(sort: str, key) -> str:
+    """把排序方式和最后一条记录的排序键编码为不透明的游标"""
+    payload = json.dumps([sort, list(key)], separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(payload).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str, sort: str, key_types: tuple = (str, str)) -> tuple:
+    """
+    解码游标
+    :param key_types: 排序键每个元素的类型；游标中的键必须逐个匹配，否则与记录的键无法比较
+    :raises ValueError: 游标无效或不属于当前排序方式
+    """
+    try:
+        payload = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        cursor_sort, key = json.loads(payload.decode('utf-8'))
+    except (ValueError, TypeError, UnicodeDecodeError):
+        raise ValueError('Invalid cursor')
+    if cursor_sort != sort or not isinstance(key, list) or len(key) != len(key_types):
+        raise ValueError('Invalid cursor')
+    if not all(isinstance(value, key_type) and not isinstance(value, bool)
+               for value, key_type in zip(key, key_types)):
+        raise ValueError('Invalid cursor')
+    return tuple(key)
+
+
+def paginate(records, key, sort: str, cursor: str = None, limit: int = PAGE_SIZE, reverse: bool = False,
+             key_types: tuple = (str, str)):
+    """
+    按游标分页
+
+    排序键必须唯一（通常以记录 ID 结尾），这样记录增删时翻页也不会重复或遗漏。
+    只取出当前页需要的记录，不对全部记录排序。
+    :param records: 可迭代的记录
+    :param key: 记录 -> 排序键（元组）
+    :param reverse: 是否按排序键降序
+    :param key_types: 排序键每个元素的类型（用于校验游标）
+    :return: (当前页的记录列表, 下一页的游标，没有下一页时为 None)
+    """
+    limit = clamp_limit(limit)
+    keyed = ((key(record), record) for record in records)
+    if cursor:
+        after = decode_cursor(cursor, sort, key_types)
+        if reverse:
+            keyed = (item for item in keyed if item[0] < after)
+        else:
+            keyed = (item for item in keyed if item[0] > after)
+    select = heapq.nlargest if reverse else heapq.nsmallest
+    page = select(limit + 1, keyed, key=lambda item: item[0])
+    next_cursor = encode_cursor(sort, page[limit - 1][0]) if len(page) > limit else None
+    return [record for _, record in page[:limit]], next_cursor
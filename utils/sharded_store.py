@@ -0,0 +1,357 @@
+import os
+import threading
+from collections import OrderedDict
+from collections.abc import Mapping
+from urllib.parse import quote, unquote
+from utils import codec
+from utils.config import YamlBackend, fcntl
+from utils.journal import SET, DELETE, apply_changes
+from utils.storage import StorageBackend, VERSION_PATH, clone, lookup, _MISSING
+
+# 按用户拆分到单独文件的顶层键，其余配置保存在索引文件中
+SHARDED_KEYS = ('password_store', 'totp_store')
+
+# 路径涉及所有用户（例如整个 password_store）
+_ALL = object()
+
+
+class _Retry(Exception):
+    """提交时发现写入涉及的分片与预判的不同"""
+
+
+class _TreeLock:
+    """
+    整个分片目录的读写锁（fcntl.flock）
+
+    只涉及一个分片的提交持有共享锁，可以并行；跨分片的提交持有排它锁。
+    """
+
+    def __init__(self, path, exclusive):
+        self.path = path
+        self.exclusive = exclusive
+        self._fd = None
+
+    def __enter__(self):
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        if fcntl is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_EX if self.exclusive else fcntl.LOCK_SH)
+        return self
+
+    def __exit__(self, *exc_info):
+        if fcntl is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        os.close(self._fd)
+        self._fd = None
+
+
+class ShardedView(Mapping):
+    """
+    分片存储的整个配置的只读视图
+
+    索引中的键直接读取；password_store/totp_store 只在访问时才读取所有用户的分片。
+    """
+
+    def __init__(self, backend):
+        self._backend = backend
+        self._index = backend.index.view()
+        self._stores = {}
+
+    def __getitem__(self, key):
+        if key == VERSION_PATH[0]:
+            return self._backend.version()
+        if key in SHARDED_KEYS:
+            if key not in self._stores:
+                self._stores[key] = self._backend._collect(key)
+            if not self._stores[key]:
+                raise KeyError(key)
+            return self._stores[key]
+        return self._index[key]
+
+    def __iter__(self):
+        for key in self._index:
+            if key != VERSION_PATH[0]:
+                yield key
+        for key in SHARDED_KEYS:
+            if key in self:
+                yield key
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+
+class ShardedBackend(StorageBackend):
+    """
+    按用户分片的 YAML 存储后端
+
+    用户、分组等配置保存在一个小的索引文件（index.yaml）中，每个用户的密码存储和
+    TOTP 存储保存在 users/<用户>.yaml 中。每个文件都是一个独立的 YamlBackend
+    （带缓存、写入合并和提交锁），所以读写一个用户的条目只会解析和重写这个用户的文件，
+    登录只读取索引文件。
+
+    只涉及一个文件的写入直接在该文件上提交；涉及多个文件的写入（例如重命名用户、
+    恢复备份）持有整个目录的排它锁，先把所有变更写入预写记录（.pending），再依次提交到
+    各个文件，最后删除记录；中途崩溃时下一次跨文件提交或 load() 重放记录（变更是幂等的）。
+
+    整个存储的版本号保存在索引文件中：每次提交（包括只涉及一个分片的提交）都递增索引的
+    版本号，所以读取版本号不需要打开所有分片。从索引中删除的用户的分片文件连同其中的
+    数据一并删除。
+    """
+
+    def __init__(self, directory, import_path=None, group_commit_window=0.02, fsync=True, fmt='yaml',
+                 max_open=256):
+        super().__init__()
+        self.directory = directory
+        self.users_dir = os.path.join(directory, 'users')
+        self.max_open = max_open
+        self._options = {'group_commit_window': group_commit_window, 'fsync': fsync, 'fmt': fmt}
+        os.makedirs(self.users_dir, exist_ok=True)
+        index_path = os.path.join(directory, 'index.yaml')
+        created = not os.path.exists(index_path)
+        self.index = YamlBackend(index_path, **self._options)
+        self._shards = OrderedDict()
+        self._lock = threading.Lock()
+        self._tree_lock_path = os.path.join(directory, '.lock')
+        self._pending_path = os.path.join(directory, '.pending')
+        if created and import_path and os.path.exists(import_path):
+            self._import(import_path)
+
+    def _import(self, yaml_path):
+        """从单个 YAML 配置文件（连同尚未压缩的变更日志）迁移"""
+        from utils.journal import ConfigJournal
+        journal_path = f'{yaml_path}.journal'
+        journal = ConfigJournal(journal_path) if os.path.exists(journal_path) else None
+        config = YamlBackend(yaml_path, journal).load()
+        config.pop(VERSION_PATH[0], None)
+        self.apply([(SET, (), config)])
+
+    # ---- 分片 ----
+
+    def _shard_path(self, user_id):
+        return os.path.join(self.users_dir, quote(str(user_id), safe='') + '.yaml')
+
+    def _shard(self, user_id) -> YamlBackend:
+        """用户的分片（最多缓存 max_open 个）"""
+        with self._lock:
+            shard = self._shards.get(user_id)
+            if shard is None:
+                shard = self._shards[user_id] = YamlBackend(self._shard_path(user_id), **self._options)
+            self._shards.move_to_end(user_id)
+            while len(self._shards) > self.max_open:
+                self._shards.popitem(last=False)
+            return shard
+
+    def _shard_ids(self):
+        return [unquote(name[:-5]) for name in sorted(os.listdir(self.users_dir)) if name.endswith('.yaml')]
+
+    def _backend(self, key):
+        return self.index if key is None else self._shard(key)
+
+    @staticmethod
+    def _route(path):
+        """
+        路径所在的文件
+        :return: (分片键, 文件内的路径)；分片键 None 表示索引文件，_ALL 表示所有文件
+        """
+        if not path:
+            return _ALL, path
+        if path[0] in SHARDED_KEYS:
+            if len(path) == 1:
+                return _ALL, path
+            return path[1], (path[0],) + path[2:]
+        return None, path
+
+    def _collect(self, store):
+        """所有用户的某类存储（不复制）"""
+        stores = {}
+        for user_id in self._shard_ids():
+            value = lookup(self._shard(user_id).view(), (store,), _MISSING)
+            if value is not _MISSING:
+                stores[user_id] = value
+        return stores
+
+    def _value(self, path):
+        """按路径读取（不复制），不存在时返回 _MISSING"""
+        key, sub = self._route(path)
+        if key is _ALL:
+            if not path:
+                return dict(ShardedView(self))
+            value = self._collect(path[0])
+            return value if value else _MISSING
+        return lookup(self._backend(key).view(), sub, _MISSING)
+
+    # ---- 写入 ----
+
+    def _expand(self, op, path, value):
+        """把涉及所有文件的变更展开为每个文件内的变更"""
+        key, sub = self._route(path)
+        if key is not _ALL:
+            yield key, (op, sub, value)
+            return
+        if not path:
+            current = set(self._value(()))
+            new = value if op == SET and isinstance(value, dict) else {}
+            for top, child in new.items():
+                if top != VERSION_PATH[0]:
+                    yield from self._expand(SET, (top,), child)
+            for top in current - set(new):
+                yield from self._expand(DELETE, (top,), None)
+            return
+        store = path[0]
+        new = value if op == SET and isinstance(value, dict) else {}
+        for user_id, child in new.items():
+            yield user_id, (SET, (store,), child)
+        for user_id in set(self._collect(store)) - set(new):
+            yield user_id, (DELETE, (store,), None)
+
+    def update(self, build):
+        # 先用缓存的数据预判涉及的文件；只涉及一个文件时直接在该文件上提交
+        touched = set()
+
+        def probe(path):
+            touched.add(self._route(tuple(path))[0])
+            value = self._value(tuple(path))
+            return None if value is _MISSING else value
+        try:
+            changes = build(probe)
+        except Exception:
+            changes = None
+        if changes is not None and not any(self._removes_users(op, tuple(path)) for op, path, _ in changes):
+            touched.update(self._route(tuple(path))[0] for _, path, _ in changes)
+            if len(touched) == 1 and _ALL not in touched:
+                try:
+                    self._update_one(touched.pop(), build)
+                    return
+                except _Retry:
+                    pass
+        self._update_all(build)
+
+    @staticmethod
+    def _removes_users(op, path):
+        """变更是否可能从索引中删除用户（需要同时删除用户的分片）"""
+        return not path or (path[:1] == ('users',) and (len(path) == 1 or (len(path) == 2 and op == DELETE)))
+
+    def _touch_index(self):
+        """递增索引中整个存储的版本号（提交没有修改索引时）"""
+        self.index.update(lambda read: [(SET, VERSION_PATH, read(VERSION_PATH) or 0)])
+
+    def _update_one(self, key, build):
+        """在一个文件上提交（持有目录的共享锁）"""
+        def shard_build(read):
+            def routed(path):
+                path_key, sub = self._route(tuple(path))
+                if path_key != key:
+                    raise _Retry()
+                return read(sub)
+            changes = []
+            for op, path, value in build(routed):
+                path_key, sub = self._route(tuple(path))
+                if path_key != key:
+                    raise _Retry()
+                changes.append((op, sub, value))
+            return changes
+        with _TreeLock(self._tree_lock_path, exclusive=False):
+            if os.path.exists(self._pending_path):
+                raise _Retry()  # 有未完成的跨文件提交，由 _update_all 先恢复
+            self._backend(key).update(shard_build)
+            if key is not None:
+                self._touch_index()
+
+    def _update_all(self, build):
+        """跨文件提交（持有目录的排它锁，期间没有其它提交）"""
+        with _TreeLock(self._tree_lock_path, exclusive=True):
+            self.invalidate()
+            self._recover()
+
+            def read(path):
+                value = self._value(tuple(path))
+                return None if value is _MISSING else value
+            grouped = {}
+            for op, path, value in build(read):
+                for key, change in self._expand(op, tuple(path), value):
+                    grouped.setdefault(key, []).append(change)
+            if not grouped:
+                return
+            # 从索引中删除的用户，同时删除其分片中的数据
+            if None in grouped:
+                before = set(self.index.view().get('users') or {})
+                after = set(apply_changes(self.index.view(), grouped[None]).get('users') or {})
+                for user_id in before - after:
+                    grouped.setdefault(user_id, []).extend((DELETE, (store,), None) for store in SHARDED_KEYS)
+            self._write_pending(grouped)
+            self._commit_grouped(grouped)
+            os.remove(self._pending_path)
+
+    def _commit_grouped(self, grouped):
+        """把按文件分组的变更依次提交到各个文件，删除清空的分片（持有排它锁）"""
+        for key, changes in grouped.items():
+            self._backend(key).apply(changes)
+        if None not in grouped:
+            self._touch_index()
+        for key in grouped:
+            if key is not None and not any(store in self._shard(key).view() for store in SHARDED_KEYS):
+                self._remove_shard(key)
+
+    def _write_pending(self, grouped):
+        """写入跨文件提交的预写记录（原子替换并 fsync）"""
+        records = [[key, [[op, list(path), value] for op, path, value in changes]]
+                   for key, changes in grouped.items()]
+        tmp_path = f'{self._pending_path}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(codec.dumps(records, codec.JSON))
+            if self._options['fsync']:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp_path, self._pending_path)
+
+    def _recover(self):
+        """重放上次崩溃时未完成的跨文件提交（持有排它锁）"""
+        try:
+            records = codec.load_file(self._pending_path)
+        except FileNotFoundError:
+            return
+        grouped = {key: [(op, tuple(path), value) for op, path, value in changes] for key, changes in records}
+        self._commit_grouped(grouped)
+        os.remove(self._pending_path)
+
+    def _remove_shard(self, user_id):
+        """删除用户的分片文件（持有排它锁，期间没有其它进程在提交分片）"""
+        path = self._shard_path(user_id)
+        with self._lock:
+            self._shards.pop(user_id, None)
+        for name in (path, f'{path}.lock'):
+            try:
+                os.remove(name)
+            except FileNotFoundError:
+                pass
+
+    # ---- StorageBackend 接口 ----
+
+    def version(self) -> int:
+        return self.index.get(VERSION_PATH, 0)
+
+    def view(self):
+        return ShardedView(self)
+
+    def load(self):
+        # 排它锁：读取期间没有任何提交，内容与版本号一致
+        with _TreeLock(self._tree_lock_path, exclusive=True):
+            self._recover()
+            config = clone(dict(ShardedView(self)))
+            config[VERSION_PATH[0]] = self.version()
+        self._remember(clone(config))
+        return config
+
+    def get(self, path, default=None):
+        value = self._value(tuple(path))
+        return default if value is _MISSING else clone(value)
+
+    def peek(self, path, default=None):
+        value = self._value(tuple(path))
+        return default if value is _MISSING else value
+
+    def invalidate(self):
+        self.index.invalidate()
+        with self._lock:
+            shards = list(self._shards.values())
+        for shard in shards:
+            shard.invalidate()
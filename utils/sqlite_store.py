@@ -0,0 +1,371 @@
+import os
+import sqlite3
+import threading
+from utils.codec import dumps_json, loads_json
+from utils.journal import SET, DELETE, apply_changes
+from utils.storage import StorageBackend, VERSION_PATH, clone, lookup, _MISSING
+
+# 每个用户存储的元数据表，以及存储下的集合 -> 表（集合中的每一项各占一行）
+_STORES = {
+    'password_store': ('password_stores', {'entries': 'password_entries', 'changes': 'password_changes'}),
+    'totp_store': ('totp_stores', {'keys': 'totp_keys', 'changes': 'totp_changes'}),
+}
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS users (
+    user_id TEXT PRIMARY KEY,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS password_stores (
+    user_id TEXT PRIMARY KEY,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS password_entries (
+    user_id TEXT NOT NULL,
+    id TEXT NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (user_id, id)
+);
+CREATE INDEX IF NOT EXISTS idx_password_entries_id ON password_entries (id);
+CREATE TABLE IF NOT EXISTS totp_stores (
+    user_id TEXT PRIMARY KEY,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS totp_keys (
+    user_id TEXT NOT NULL,
+    id TEXT NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (user_id, id)
+);
+CREATE INDEX IF NOT EXISTS idx_totp_keys_id ON totp_keys (id);
+CREATE TABLE IF NOT EXISTS password_changes (
+    user_id TEXT NOT NULL,
+    id TEXT NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (user_id, id)
+);
+CREATE TABLE IF NOT EXISTS totp_changes (
+    user_id TEXT NOT NULL,
+    id TEXT NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (user_id, id)
+);
+CREATE TABLE IF NOT EXISTS groups (
+    id TEXT PRIMARY KEY,
+    position INTEGER,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS settings (
+    key TEXT PRIMARY KEY,
+    data TEXT NOT NULL
+);
+'''
+
+
+class SqliteBackend(StorageBackend):
+    """
+    基于 SQLite（WAL 模式）的存储后端
+
+    用户、每个用户的密码条目、TOTP 密钥和分组各占一张表，每个条目一行，
+    因此读写单个条目只触及对应的一行。其余顶层配置项保存在 settings 表中。
+    """
+
+    def __init__(self, path, import_path=None):
+        super().__init__()
+        self.path = path
+        self._local = threading.local()
+        created = not os.path.exists(path)
+        conn = self._conn()
+        with conn:
+            conn.executescript(_SCHEMA)
+        if created and import_path and os.path.exists(import_path):
+            import_yaml(import_path, self)
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    # ---- 读取 ----
+
+    @staticmethod
+    def _row(conn, sql, params):
+        row = conn.execute(sql, params).fetchone()
+        return _MISSING if row is None else loads_json(row[0])
+
+    def _read_users(self, conn):
+        return {user_id: loads_json(data) for user_id, data in conn.execute('SELECT user_id, data FROM users')}
+
+    def _read_items(self, conn, table, user_id):
+        return {
+            item_id: loads_json(data)
+            for item_id, data in conn.execute(f'SELECT id, data FROM {table} WHERE user_id = ?', (user_id,))
+        }
+
+    def _read_store(self, conn, store, user_id):
+        meta_table, children = _STORES[store]
+        meta = self._row(conn, f'SELECT data FROM {meta_table} WHERE user_id = ?', (user_id,))
+        collections = {child: self._read_items(conn, table, user_id) for child, table in children.items()}
+        if meta is _MISSING and not any(collections.values()):
+            return _MISSING
+        result = {} if meta is _MISSING else meta
+        result.update(collections)
+        return result
+
+    def _read_stores(self, conn, store):
+        meta_table, children = _STORES[store]
+        result = {user_id: loads_json(data) for user_id, data in conn.execute(f'SELECT user_id, data FROM {meta_table}')}
+        for child, table in children.items():
+            for user_id, item_id, data in conn.execute(f'SELECT user_id, id, data FROM {table}'):
+                result.setdefault(user_id, {}).setdefault(child, {})[item_id] = loads_json(data)
+        for store_data in result.values():
+            for child in children:
+                store_data.setdefault(child, {})
+        return result
+
+    def _read_groups(self, conn):
+        rows = conn.execute('SELECT position, data FROM groups ORDER BY position').fetchall()
+        if not rows:
+            return _MISSING
+        if rows[0][0] is None:
+            return loads_json(rows[0][1])
+        return [loads_json(data) for _, data in rows]
+
+    def _read_all(self, conn):
+        config = {}
+        for key, data in conn.execute('SELECT key, data FROM settings'):
+            config[key] = loads_json(data)
+        users = self._read_users(conn)
+        if users:
+            config['users'] = users
+        for store in _STORES:
+            stores = self._read_stores(conn, store)
+            if stores:
+                config[store] = stores
+        groups = self._read_groups(conn)
+        if groups is not _MISSING:
+            config['groups'] = groups
+        return config
+
+    def _read(self, conn, path):
+        if not path:
+            return self._read_all(conn)
+        top, rest = path[0], path[1:]
+        if top == 'users':
+            if not rest:
+                users = self._read_users(conn)
+                return users if users else _MISSING
+            value = self._row(conn, 'SELECT data FROM users WHERE user_id = ?', (rest[0],))
+            return lookup(value, rest[1:], _MISSING) if value is not _MISSING else _MISSING
+        if top in _STORES:
+            meta_table, children = _STORES[top]
+            if not rest:
+                stores = self._read_stores(conn, top)
+                return stores if stores else _MISSING
+            user_id = rest[0]
+            if len(rest) == 1:
+                return self._read_store(conn, top, user_id)
+            if rest[1] in children:
+                table = children[rest[1]]
+                if len(rest) == 2:
+                    items = self._read_items(conn, table, user_id)
+                    if not items and self._row(conn, f'SELECT data FROM {meta_table} WHERE user_id = ?',
+                                               (user_id,)) is _MISSING:
+                        return _MISSING
+                    return items
+                value = self._row(conn, f'SELECT data FROM {table} WHERE user_id = ? AND id = ?',
+                                  (user_id, str(rest[2])))
+                return lookup(value, rest[3:], _MISSING) if value is not _MISSING else _MISSING
+            value = self._row(conn, f'SELECT data FROM {meta_table} WHERE user_id = ?', (user_id,))
+            return lookup(value, rest[1:], _MISSING) if value is not _MISSING else _MISSING
+        if top == 'groups':
+            groups = self._read_groups(conn)
+            return lookup(groups, rest, _MISSING) if groups is not _MISSING else _MISSING
+        value = self._row(conn, 'SELECT data FROM settings WHERE key = ?', (top,))
+        return lookup(value, rest, _MISSING) if value is not _MISSING else _MISSING
+
+    # ---- 写入 ----
+
+    def _delete(self, conn, path):
+        """删除 path 下的所有行"""
+        if not path:
+            for table in ('users', 'groups', 'settings'):
+                conn.execute(f'DELETE FROM {table}')
+            for meta_table, children in _STORES.values():
+                for table in (meta_table,) + tuple(children.values()):
+                    conn.execute(f'DELETE FROM {table}')
+            return
+        top, rest = path[0], path[1:]
+        if top == 'users':
+            if rest:
+                conn.execute('DELETE FROM users WHERE user_id = ?', (rest[0],))
+            else:
+                conn.execute('DELETE FROM users')
+        elif top in _STORES:
+            meta_table, children = _STORES[top]
+            if not rest:
+                for table in (meta_table,) + tuple(children.values()):
+                    conn.execute(f'DELETE FROM {table}')
+            elif len(rest) == 1:
+                for table in (meta_table,) + tuple(children.values()):
+                    conn.execute(f'DELETE FROM {table} WHERE user_id = ?', (rest[0],))
+            elif len(rest) == 2:
+                conn.execute(f'DELETE FROM {children[rest[1]]} WHERE user_id = ?', (rest[0],))
+            else:
+                conn.execute(f'DELETE FROM {children[rest[1]]} WHERE user_id = ? AND id = ?',
+                             (rest[0], str(rest[2])))
+        elif top == 'groups':
+            conn.execute('DELETE FROM groups')
+        else:
+            conn.execute('DELETE FROM settings WHERE key = ?', (top,))
+
+    def _insert(self, conn, path, value):
+        """把 path 处的值写成对应的行（调用前已删除旧行）"""
+        if not path:
+            for key, item in (value or {}).items():
+                self._insert(conn, (key,), item)
+            return
+        top, rest = path[0], path[1:]
+        if top == 'users':
+            if rest:
+                conn.execute('INSERT OR REPLACE INTO users (user_id, data) VALUES (?, ?)',
+                             (rest[0], dumps_json(value)))
+            else:
+                for user_id, user in (value or {}).items():
+                    self._insert(conn, ('users', user_id), user)
+        elif top in _STORES:
+            meta_table, children = _STORES[top]
+            if not rest:
+                for user_id, store in (value or {}).items():
+                    self._insert(conn, (top, user_id), store)
+            elif len(rest) == 1:
+                meta = {k: v for k, v in (value or {}).items() if k not in children}
+                conn.execute(f'INSERT OR REPLACE INTO {meta_table} (user_id, data) VALUES (?, ?)',
+                             (rest[0], dumps_json(meta)))
+                for child in children:
+                    self._insert(conn, (top, rest[0], child), (value or {}).get(child) or {})
+            elif len(rest) == 2:
+                conn.executemany(
+                    f'INSERT OR REPLACE INTO {children[rest[1]]} (user_id, id, data) VALUES (?, ?, ?)',
+                    [(rest[0], str(item_id), dumps_json(item)) for item_id, item in (value or {}).items()]
+                )
+            else:
+                conn.execute(f'INSERT OR REPLACE INTO {children[rest[1]]} (user_id, id, data) VALUES (?, ?, ?)',
+                             (rest[0], str(rest[2]), dumps_json(value)))
+        elif top == 'groups':
+            if isinstance(value, list):
+                conn.executemany('INSERT INTO groups (id, position, data) VALUES (?, ?, ?)', [
+                    (str(group.get('id', index)) if isinstance(group, dict) else str(index), index, dumps_json(group))
+                    for index, group in enumerate(value)
+                ])
+            else:
+                group_id = str(value.get('id', '')) if isinstance(value, dict) else ''
+                conn.execute('INSERT INTO groups (id, position, data) VALUES (?, NULL, ?)',
+                             (group_id, dumps_json(value)))
+        else:
+            conn.execute('INSERT OR REPLACE INTO settings (key, data) VALUES (?, ?)', (top, dumps_json(value)))
+
+    @staticmethod
+    def _row_path(path):
+        """返回 path 所在行的路径；path 位于行之上时返回 None"""
+        if not path:
+            return None
+        top = path[0]
+        if top == 'users':
+            return path[:2] if len(path) >= 2 else None
+        if top in _STORES:
+            if len(path) < 3:
+                return None
+            if path[2] in _STORES[top][1]:
+                return path[:4] if len(path) >= 4 else None
+            return path[:2]
+        # 分组和其它顶层配置项整体保存
+        return path[:1]
+
+    def _apply_change(self, conn, op, path, value):
+        row_path = self._row_path(path)
+        if row_path is None or row_path == path:
+            self._delete(conn, path)
+            if op == SET:
+                self._insert(conn, path, value)
+            return
+        # 修改行内的字段：读出整行，修改后写回
+        if row_path[0] in _STORES and len(row_path) == 2:
+            meta_table = _STORES[row_path[0]][0]
+            row = self._row(conn, f'SELECT data FROM {meta_table} WHERE user_id = ?', (row_path[1],))
+            if row is _MISSING:
+                if op == DELETE:
+                    return
+                row = {}
+            row = apply_changes(row, [(op, path[2:], value)])
+            conn.execute(f'INSERT OR REPLACE INTO {meta_table} (user_id, data) VALUES (?, ?)',
+                         (row_path[1], dumps_json(row)))
+            return
+        row = self._read(conn, row_path)
+        if row is _MISSING:
+            if op == DELETE:
+                return
+            row = {}
+        row = apply_changes(row, [(op, path[len(row_path):], value)])
+        self._delete(conn, row_path)
+        self._insert(conn, row_path, row)
+
+    # ---- StorageBackend 接口 ----
+
+    def _read_snapshot(self, path):
+        """在同一个读事务中完成一次读取涉及的所有查询，不会看到其它进程提交了一半的状态"""
+        conn = self._conn()
+        conn.execute('BEGIN')
+        try:
+            return self._read(conn, path)
+        finally:
+            conn.execute('COMMIT')
+
+    def load(self):
+        config = self._read_snapshot(())
+        config.setdefault(VERSION_PATH[0], 0)
+        self._remember(clone(config))
+        return config
+
+    def get(self, path, default=None):
+        value = self._read_snapshot(tuple(path))
+        return default if value is _MISSING else value
+
+    def peek(self, path, default=None):
+        # 每次读取的都是新对象，不需要再复制
+        return self.get(path, default)
+
+    def update(self, build):
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            def read(path):
+                value = self._read(conn, tuple(path))
+                return None if value is _MISSING else value
+            changes = build(read)
+            if changes:
+                for op, path, value in changes:
+                    self._apply_change(conn, op, tuple(path), value)
+                version = read(VERSION_PATH) or 0
+                self._apply_change(conn, SET, VERSION_PATH, version + 1)
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+
+def import_yaml(yaml_path, backend):
+    """
+    把 YAML 配置文件（连同尚未压缩的变更日志）导入到存储后端
+    """
+    from utils.config import YamlBackend
+    from utils.journal import ConfigJournal
+    journal_path = f'{yaml_path}.journal'
+    journal = ConfigJournal(journal_path) if os.path.exists(journal_path) else None
+    config = YamlBackend(yaml_path, journal).load()
+    backend.apply([(SET, (), config)])
+    return config
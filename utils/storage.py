@@ -0,0 +1,188 @@
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from utils.journal import SET, DELETE, apply_changes, diff_config
+
+_MISSING = object()
+
+# 整个存储的版本号，每次提交写入时递增
+VERSION_PATH = ('store_version',)
+
+
+class VersionConflict(Exception):
+    """提交时存储中的值与预期不一致（其它请求或进程先写入了）"""
+
+
+def check_expected(read, expect):
+    """
+    检查提交的前提条件
+    :param read: 路径 -> 当前值（不存在时为 None）
+    :param expect: [(path, 预期的值)]，预期为 None 表示路径不存在
+    :raises VersionConflict: 任一路径的当前值与预期不同
+    """
+    for path, value in expect or ():
+        if read(tuple(path)) != value:
+            raise VersionConflict(f'{"/".join(map(str, path))} changed concurrently')
+
+
+def clone(value):
+    """
+    复制配置数据（只包含 dict/list/标量，比 copy.deepcopy 快得多）
+    """
+    if isinstance(value, dict):
+        return {k: clone(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [clone(v) for v in value]
+    return value
+
+
+def lookup(data, path, default=None):
+    """
+    按路径在配置中取值（不复制）
+    """
+    for key in path:
+        if not isinstance(data, dict) or key not in data:
+            return default
+        data = data[key]
+    return data
+
+
+def _rebase(op, path, value, read):
+    """把相对旧版本新建 dict 的变更改为逐键设置（当前版本中该路径已经是 dict 时）"""
+    if op == SET and isinstance(value, dict) and isinstance(read(tuple(path)), dict):
+        for key, child in value.items():
+            yield from _rebase(op, tuple(path) + (key,), child, read)
+    else:
+        yield op, path, value
+
+
+class StorageBackend(ABC):
+    """
+    配置存储后端的基类
+
+    配置按路径寻址，例如 ``('password_store', user_id, 'entries', entry_id)``。
+    load()/save() 读写整个配置；get()/apply() 只读写一个子树，
+    后端可以只触及对应的那部分数据。
+
+    所有写入最终都经过 update()：在提交锁内读取最新数据并生成变更，然后一起提交，
+    每次提交递增 store_version。在此之上，apply() 可以附带前提条件
+    （compare-and-swap，不满足时抛出 VersionConflict）；save() 按调用方 load()
+    时的版本做三方合并，只写入调用方改动过的路径，期间其它请求的修改不会被覆盖。
+    """
+
+    # 保留的最近版本的快照数量（用于 save() 的三方合并）
+    max_snapshots = 32
+
+    def __init__(self):
+        self._snapshots = OrderedDict()
+        self._snapshots_lock = threading.Lock()
+
+    def _remember(self, data):
+        """记录一个版本的快照（必须是之后不会被修改的对象）"""
+        if not isinstance(data, dict):
+            return
+        version = data.get(VERSION_PATH[0], 0)
+        with self._snapshots_lock:
+            self._snapshots[version] = data
+            self._snapshots.move_to_end(version)
+            while len(self._snapshots) > self.max_snapshots:
+                self._snapshots.popitem(last=False)
+
+    def _save_changes(self, config, read):
+        """
+        save() 需要写入的变更
+
+        只写入相对调用方 load() 时的版本的改动；调用方新建的 dict 如果在此期间也被
+        别人建立了，则逐键合并而不是整体替换。不是 load() 得到的配置（没有版本号，
+        例如恢复备份）整体替换当前配置。
+        :raises VersionConflict: 调用方读取时的版本已不在保留的快照中，无法合并
+        """
+        if not isinstance(config, dict) or VERSION_PATH[0] not in config:
+            changes = diff_config(read(()) or {}, config)
+            return [change for change in changes if tuple(change[1]) != VERSION_PATH]
+        version = config[VERSION_PATH[0]]
+        with self._snapshots_lock:
+            base = self._snapshots.get(version)
+        if base is None:
+            current = read(()) or {}
+            if current.get(VERSION_PATH[0], 0) != version:
+                # 没有合并的基础，整体替换会丢掉此后其它请求的所有写入
+                raise VersionConflict(f'config version {version} is too old to merge')
+            base = current
+        changes = []
+        for op, path, value in diff_config(base, config):
+            changes.extend(_rebase(op, path, value, read))
+        return [change for change in changes if tuple(change[1]) != VERSION_PATH]
+
+    def version(self) -> int:
+        """存储的版本号"""
+        return self.get(VERSION_PATH, 0)
+
+    def view(self):
+        """返回整个配置（可能是共享对象，调用方不得修改）"""
+        return self.load()
+
+    @abstractmethod
+    def load(self):
+        """返回整个配置的独立副本"""
+
+    @abstractmethod
+    def update(self, build):
+        """
+        原子地读取并修改配置
+        :param build: 接收 read(path) 的函数，返回变更列表；read 读取提交时的最新值
+                      （不存在时为 None，read(()) 返回整个配置），可以抛出异常放弃提交
+        """
+
+    def save(self, config):
+        """
+        保存整个配置（与调用方 load() 之后其它请求的修改合并）
+        :raises VersionConflict: 调用方 load() 之后的写入太多，无法合并
+        """
+        config = clone(config)
+        self.update(lambda read: self._save_changes(config, read))
+
+    def get(self, path, default=None):
+        """
+        读取一个子树
+        :param path: 键路径（元组）
+        :return: 子树的独立副本，不存在时返回 default
+        """
+        value = lookup(self.view(), path, _MISSING)
+        return default if value is _MISSING else clone(value)
+
+    def peek(self, path, default=None):
+        """
+        读取一个子树，不复制（可能是共享对象，调用方不得修改）
+
+        用于只读遍历大的子树，例如分页列出条目。
+        """
+        value = lookup(self.view(), path, _MISSING)
+        return default if value is _MISSING else value
+
+    def apply(self, changes, expect=None):
+        """
+        原子地应用一组变更
+        :param changes: [(SET, path, value)] 或 [(DELETE, path, None)]
+        :param expect: 前提条件 [(path, 预期的值)]，见 check_expected()
+        :raises VersionConflict: 前提条件不满足
+        """
+        changes = [(op, tuple(path), clone(value)) for op, path, value in changes]
+        if not changes:
+            return
+
+        def build(read):
+            check_expected(read, expect)
+            return changes
+        self.update(build)
+
+    def set(self, path, value):
+        """设置一个子树"""
+        self.apply([(SET, tuple(path), value)])
+
+    def delete(self, path):
+        """删除一个子树"""
+        self.apply([(DELETE, tuple(path), None)])
+
+    def invalidate(self):
+        """丢弃后端持有的缓存"""
@@ -0,0 +1,126 @@
+"""
+配置存储的并发压力测试
+
+多个进程、每个进程多个线程同时创建和修改同一个用户的密码条目，并通过
+update_config() 修改各自的设置项，最后检查没有任何写入丢失，
+并检查保存一个落后太多版本的配置时会报告冲突而不是覆盖其间的写入：
+
+    python -m utils.stress_config --processes 4 --threads 4 --ops 20 [--backend sqlite|sharded] [--journal]
+"""
+import argparse
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+import yaml
+from utils.storage import StorageBackend, VersionConflict
+
+USER = 'stress'
+
+
+def _open_storage(directory, backend, journal):
+    """在当前进程中打开指定目录下的存储，并设为 get_storage() 的返回值"""
+    from utils import config
+    from utils.journal import ConfigJournal
+    path = os.path.join(directory, 'config.yaml')
+    if backend == 'sqlite':
+        from utils.sqlite_store import SqliteBackend
+        storage = SqliteBackend(os.path.join(directory, 'config.db'), import_path=path)
+    elif backend == 'sharded':
+        from utils.sharded_store import ShardedBackend
+        storage = ShardedBackend(os.path.join(directory, 'vault'), import_path=path)
+    else:
+        storage = config.YamlBackend(path, ConfigJournal(f'{path}.journal') if journal else None)
+    config._storage = storage
+    return storage
+
+
+def _worker(directory, backend, journal, process, threads, ops):
+    """一个进程：多个线程交替创建条目、修改条目、保存整个配置"""
+    _open_storage(directory, backend, journal)
+    from services.password_manager import PasswordManager
+    from utils.config import update_config
+
+    def run(thread):
+        manager = PasswordManager(USER)
+        for op in range(ops):
+            name = f'p{process}-t{thread}-{op}'
+            entry = manager.create_entry(title=name, password=name)
+            manager.update_entry(entry.id, title=f'{name}-edited')
+            # 读取整个配置、修改一个键再保存，不能覆盖其它线程同时做的修改
+            update_config(lambda config: config['users'][USER].setdefault('marks', {}).__setitem__(name, op))
+
+    workers = [threading.Thread(target=run, args=(thread,)) for thread in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+
+def _check_stale_save(storage, writes=StorageBackend.max_snapshots + 8):
+    """保存落后于所有保留快照的配置必须抛出 VersionConflict，不能删掉其间的写入"""
+    from utils.journal import SET
+    stale = storage.load()
+    for i in range(writes):
+        # 其它请求的加载把 stale 的版本挤出保留的快照
+        storage.load()
+        storage.apply([(SET, ('users', f'stale-{i}'), {'username': f'stale-{i}'})])
+    stale['users'][USER]['stale_save'] = True
+    try:
+        storage.save(stale)
+    except VersionConflict:
+        pass
+    else:
+        raise AssertionError('saving a stale config did not raise VersionConflict')
+    users = storage.get(('users',), {})
+    assert all(f'stale-{i}' in users for i in range(writes)), 'stale save deleted concurrent writes'
+    assert 'stale_save' not in users[USER]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Concurrent write stress test for the config store')
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--ops', type=int, default=20)
+    parser.add_argument('--backend', choices=('yaml', 'sqlite', 'sharded'), default='yaml')
+    parser.add_argument('--journal', action='store_true')
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    with open(os.path.join(directory, 'config.yaml'), 'w', encoding='utf-8') as f:
+        yaml.dump({'users': {USER: {'username': USER}}}, f)
+    _open_storage(directory, args.backend, args.journal)
+    from services.password_manager import PasswordManager
+    PasswordManager(USER)  # 预先生成加密密钥
+
+    context = multiprocessing.get_context('spawn')
+    processes = [context.Process(target=_worker, args=(
+        directory, args.backend, args.journal, process, args.threads, args.ops))
+        for process in range(args.processes)]
+    start = time.perf_counter()
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+        assert process.exitcode == 0, f'worker exited with {process.exitcode}'
+    elapsed = time.perf_counter() - start
+
+    storage = _open_storage(directory, args.backend, args.journal)
+    expected = {f'p{p}-t{t}-{o}' for p in range(args.processes) for t in range(args.threads) for o in range(args.ops)}
+    entries = storage.get(('password_store', USER, 'entries'), {})
+    titles = {entry['title'] for entry in entries.values()}
+    marks = storage.get(('users', USER, 'marks'), {})
+    version = storage.get(('password_store', USER, 'version'), 0)
+
+    assert len(entries) == len(expected), f'{len(expected) - len(entries)} creates lost'
+    assert titles == {f'{name}-edited' for name in expected}, f'{len(titles - {f"{n}-edited" for n in expected})} updates lost'
+    assert set(marks) == expected, f'{len(expected - set(marks))} saves lost'
+    assert version == 2 * len(expected), f'store version {version}, expected {2 * len(expected)}'
+    _check_stale_save(storage)
+    print(f'{len(expected) * 3} writes from {args.processes} processes x {args.threads} threads '
+          f'in {elapsed:.1f} s: nothing lost')
+
+
+if __name__ == '__main__':
+    main()